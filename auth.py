@@ -1,10 +1,14 @@
 import aiohttp
 import json
+import logging
 from classes.dropbox import DropboxClient
+from classes.metrics import time_external_call
 
-async def refresh_access_token_async(refresh_token, client_id, client_secret):
+logger = logging.getLogger(__name__)
+
+async def refresh_access_token_async(refresh_token, client_id, client_secret, api_url="https://api.dropbox.com"):
     async with aiohttp.ClientSession() as session:
-        url = "https://api.dropbox.com/oauth2/token"
+        url = f"{api_url}/oauth2/token"
         data = {
             "grant_type": "refresh_token",
             "refresh_token": refresh_token,
@@ -12,38 +16,40 @@ async def refresh_access_token_async(refresh_token, client_id, client_secret):
             "client_secret": client_secret
         }
 
-        async with session.post(url, data=data) as response:
-            result = await response.json()
-            new_access_token = result.get("access_token")
-            return new_access_token
+        with time_external_call("dropbox", "refresh_token"):
+            async with session.post(url, data=data) as response:
+                result = await response.json()
+                new_access_token = result.get("access_token")
+                return new_access_token
 
-async def load_allowed_user_ids_from_dropbox(dbx):
+async def load_allowed_user_ids_from_dropbox(dbx, content_url="https://content.dropboxapi.com"):
     try:
-        res_data = await DropboxClient.dbx_files_download_async("/Apps/TelegramGPT/allowed_user_ids.json", dbx)
+        res_data = await DropboxClient.dbx_files_download_async("/Apps/TelegramGPT/allowed_user_ids.json", dbx, content_url)
         if res_data:
             return list(json.loads(res_data))
         else:
             return []
-    except Exception as e:
-        print(f"Error downloading allowed_user_ids.json: {e}")
+    except Exception:
+        logger.exception("Error downloading allowed_user_ids.json")
         return []
 
-async def save_allowed_user_ids_to_dropbox(allowed_user_ids, dbx):
+async def save_allowed_user_ids_to_dropbox(allowed_user_ids, dbx, content_url="https://content.dropboxapi.com"):
     try:
         data = json.dumps(allowed_user_ids)
         
         async with aiohttp.ClientSession() as session:
-            url = f"https://content.dropboxapi.com/2/files/upload"
+            url = f"{content_url}/2/files/upload"
             headers = {
                 "Authorization": f"Bearer {dbx._oauth2_access_token}",
                 "Content-Type": "application/octet-stream",
                 "Dropbox-API-Arg": json.dumps({"path": "/Apps/TelegramGPT/allowed_user_ids.json", "mode": "overwrite"}),
             }
 
-            async with session.post(url, headers=headers, data=data.encode("utf-8")) as response:
-                res_data = await response.text()
-                if response.status != 200:
-                    print(f"Error uploading allowed_user_ids.json. Status: {response.status}, Message: {res_data}")
+            with time_external_call("dropbox", "upload"):
+                async with session.post(url, headers=headers, data=data.encode("utf-8")) as response:
+                    res_data = await response.text()
+            if response.status != 200:
+                logger.error("Error uploading allowed_user_ids.json. Status: %s, Message: %s", response.status, res_data)
                     
-    except Exception as e:
-        print(f"Error uploading allowed_user_ids.json: {e}")
\ No newline at end of file
+    except Exception:
+        logger.exception("Error uploading allowed_user_ids.json")
\ No newline at end of file
@@ -0,0 +1,316 @@
+import io
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+import logging
+import threading
+from typing import Dict
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Local stand-ins for every external API the bot talks to, served from one aiohttp app with a
+# path prefix per service. Each service answers after an injected delay, so benchmarks measure
+# the bot's own overhead plus a known, configurable backend latency.
+
+DEFAULT_LATENCY = {
+    "telegram": 0.03,
+    "elevenlabs": 0.8,
+    "stability": 2.0,
+    "bing": 0.3,
+    "pages": 0.2,
+    "deepgram": 0.5,
+    "openai": 1.5,
+    "weather": 0.1,
+    "dropbox": 0.1,
+}
+
+VOICES = [
+    {"voice_id": "7kRUX4UzUC1zcoeqNF4s", "name": "Default"},
+    {"voice_id": "TxGEqnHWrfWFTfGW9XjX", "name": "Josh"},
+]
+
+PAGE_PARAGRAPH = (
+    "The quick brown fox jumps over the lazy dog while researchers measure how long it takes. "
+    "Benchmarks need realistic page sizes so parsing and token counting cost what they cost in production. "
+)
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    """
+    Parse latency overrides in seconds, e.g. "stability=1.5,telegram=0.05".
+    """
+    latency = dict(DEFAULT_LATENCY)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name.strip() not in latency:
+            raise ValueError(f"Unknown service '{name.strip()}', expected one of {', '.join(latency)}")
+        latency[name.strip()] = float(value)
+    return latency
+
+def make_png(size: int = 64) -> bytes:
+    from PIL import Image
+    image = Image.new("RGB", (size, size), (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def make_ogg(duration_ms: int = 1500) -> bytes:
+    """
+    A short silent OGG/Opus voice note. Needs ffmpeg, like the bot's own audio conversion.
+    """
+    try:
+        from pydub import AudioSegment
+        buffer = io.BytesIO()
+        AudioSegment.silent(duration=duration_ms, frame_rate=16000).export(buffer, format="ogg", codec="libopus")
+        return buffer.getvalue()
+    except Exception as e:
+        logger.warning("Could not encode a test voice note (is ffmpeg installed?): %s", e)
+        return b"OggS"
+
+class FakeServices():
+    """
+    Fake Telegram Bot API, ElevenLabs, Stability, Bing (plus the result pages), Deepgram, OpenAI,
+    OpenWeatherMap and Dropbox.
+
+    The fake Telegram records what the bot sent so a benchmark can count replies and errors.
+    """
+
+    # Replies the bot sends when a handler fails
+    ERROR_MARKERS = ("error", "oops", "went wrong", "issue with", "sorry")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: Dict[str, float] = None, jitter: float = 0.2, allowed_user_ids=(), page_paragraphs: int = 40):
+        self.host = host
+        self.port = port
+        self.latency = latency or dict(DEFAULT_LATENCY)
+        self.jitter = jitter
+        self.allowed_user_ids = list(allowed_user_ids)
+        self.page_paragraphs = page_paragraphs
+        self.telegram_calls: Dict[str, int] = {}
+        self.sent_texts = []
+        self.error_replies = 0
+        self._message_id = 0
+        self._png = None
+        self._ogg = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def config_env(self) -> Dict[str, str]:
+        """
+        Environment variables that point `Config` at these services.
+        """
+        return {
+            "TELEGRAM_API_URL": f"{self.base_url}/telegram",
+            "ELEVENLABS_API_URL": f"{self.base_url}/elevenlabs",
+            "STABILITY_API_URL": f"{self.base_url}/stability",
+            "BING_API_URL": f"{self.base_url}/bing",
+            "DEEPGRAM_API_URL": f"{self.base_url}/deepgram/v1",
+            "OPENAI_API_URL": f"{self.base_url}/openai/v1",
+            "WEATHER_API_URL": f"{self.base_url}/weather",
+            "DROPBOX_API_URL": f"{self.base_url}/dropbox-api",
+            "DROPBOX_CONTENT_URL": f"{self.base_url}/dropbox-content",
+        }
+
+    def reset_counters(self) -> None:
+        self.telegram_calls = {}
+        self.sent_texts = []
+        self.error_replies = 0
+
+    async def _delay(self, service: str) -> None:
+        delay = self.latency.get(service, 0)
+        if delay > 0:
+            await asyncio.sleep(delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    # Telegram
+
+    def _message(self, chat_id, text: str = None) -> Dict:
+        self._message_id += 1
+        chat_id = int(chat_id)
+        chat = {"id": chat_id, "type": "private", "first_name": "Load"} if chat_id > 0 else {"id": chat_id, "type": "group", "title": "Load Test Group"}
+        message = {"message_id": self._message_id, "date": int(time.time()), "chat": chat}
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def telegram_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post()) if request.can_read_body else {}
+        if not data and request.content_type == "application/json":
+            data = await request.json()
+        self.telegram_calls[method] = self.telegram_calls.get(method, 0) + 1
+        await self._delay("telegram")
+
+        text = data.get("text") or data.get("caption")
+        if isinstance(text, str) and method in ("sendMessage", "editMessageText"):
+            self.sent_texts.append(text)
+            if any(marker in text.lower() for marker in self.ERROR_MARKERS):
+                self.error_replies += 1
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method in ("sendMessage", "editMessageText", "editMessageCaption", "sendPhoto", "sendVoice", "sendAudio", "sendDocument"):
+            result = self._message(data.get("chat_id", 1), text if isinstance(text, str) else None)
+        elif method == "getFile":
+            result = {"file_id": data.get("file_id", "voice"), "file_unique_id": "voice", "file_size": len(self._ogg or b""), "file_path": "voice/note.oga"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def telegram_file(self, request: web.Request) -> web.Response:
+        await self._delay("telegram")
+        if self._ogg is None:
+            self._ogg = await asyncio.to_thread(make_ogg)
+        return web.Response(body=self._ogg, content_type="audio/ogg")
+
+    # Everything else
+
+    async def elevenlabs_voices(self, request: web.Request) -> web.Response:
+        await self._delay("elevenlabs")
+        return web.json_response({"voices": VOICES})
+
+    async def elevenlabs_tts(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await self._delay("elevenlabs")
+        # Roughly the size of a real MP3 for the text
+        return web.Response(body=b"\xff\xfb" * (len(payload.get("text", "")) * 40 + 100), content_type="audio/mpeg")
+
+    async def stability_generate(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._delay("stability")
+        if self._png is None:
+            self._png = make_png()
+        return web.json_response({"artifacts": [{"base64": base64.b64encode(self._png).decode(), "seed": 0, "finishReason": "SUCCESS"}]})
+
+    async def bing_search(self, request: web.Request) -> web.Response:
+        await self._delay("bing")
+        query = request.query.get("q", "")
+        results = [
+            {"name": f"Result {n} for {query}", "url": f"{self.base_url}/pages/{n}", "snippet": f"Snippet {n} about {query}"}
+            for n in range(1, 6)
+        ]
+        return web.json_response({"webPages": {"value": results}})
+
+    async def page(self, request: web.Request) -> web.Response:
+        await self._delay("pages")
+        # Pages never change, so a conditional GET for one is always answered with 304 Not Modified
+        etag = f'"page-{request.match_info["page"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        body = "".join(f"<p>{PAGE_PARAGRAPH}</p>" for _ in range(self.page_paragraphs))
+        html = f"<html><head><style>p {{}}</style><script>var x = 1;</script></head><body><h1>Page {request.match_info['page']}</h1>{body}</body></html>"
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    async def deepgram_listen(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._delay("deepgram")
+        return web.json_response({"results": {"channels": [{"alternatives": [{"transcript": "hey what's the weather like today", "confidence": 0.98}]}]}})
+
+    async def openai_chat(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await self._delay("openai")
+        content = "Here is a summary.\n\n- First point\n- Second point\n- Third point"
+        if payload.get("stream"):
+            # Server-sent events, one chunk per word, like the real API
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for word in re.findall(r"\S+\s*", content):
+                chunk = {"id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": int(time.time()), "model": payload.get("model", "gpt-4"),
+                         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        return web.json_response({
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        })
+
+    async def weather(self, request: web.Request) -> web.Response:
+        await self._delay("weather")
+        temp = 17.0 if request.query.get("units") == "metric" else 290.15
+        return web.json_response({"weather": [{"description": "clear sky"}], "main": {"temp": temp}, "name": request.query.get("q", "")})
+
+    async def geocode(self, request: web.Request) -> web.Response:
+        await self._delay("weather")
+        name = request.query.get("q", "").split(",")[0]
+        return web.json_response([{"name": name, "state": "Pennsylvania", "country": "US", "lat": 40.4406, "lon": -79.9959}])
+
+    async def dropbox_token(self, request: web.Request) -> web.Response:
+        await self._delay("dropbox")
+        return web.json_response({"access_token": "benchmark-token", "token_type": "bearer", "expires_in": 14400})
+
+    async def dropbox_download(self, request: web.Request) -> web.Response:
+        await self._delay("dropbox")
+        path = json.loads(request.headers.get("Dropbox-API-Arg", "{}")).get("path", "")
+        if path.endswith("allowed_user_ids.json"):
+            return web.Response(text=json.dumps(self.allowed_user_ids))
+        return web.Response(text="")
+
+    async def dropbox_upload(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._delay("dropbox")
+        return web.json_response({"name": "upload", "size": request.content_length or 0})
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/telegram/bot{token}/{method}", self.telegram_method)
+        app.router.add_get("/telegram/file/bot{token}/{path:.*}", self.telegram_file)
+        app.router.add_get("/elevenlabs/v1/voices", self.elevenlabs_voices)
+        app.router.add_post("/elevenlabs/v1/text-to-speech/{voice_id}", self.elevenlabs_tts)
+        app.router.add_post("/stability/v1/generation/{engine}/text-to-image", self.stability_generate)
+        app.router.add_get("/bing/v7.0/search", self.bing_search)
+        app.router.add_get("/pages/{page}", self.page)
+        app.router.add_post("/deepgram/v1/listen", self.deepgram_listen)
+        app.router.add_post("/openai/v1/chat/completions", self.openai_chat)
+        app.router.add_get("/weather/data/2.5/weather", self.weather)
+        app.router.add_get("/weather/geo/1.0/direct", self.geocode)
+        app.router.add_post("/dropbox-api/oauth2/token", self.dropbox_token)
+        app.router.add_post("/dropbox-content/2/files/download", self.dropbox_download)
+        app.router.add_post("/dropbox-content/2/files/upload", self.dropbox_upload)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Port 0 picks a free port
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> None:
+        """
+        Serve from a background thread with its own event loop. `Config` talks to Dropbox with
+        `asyncio.run()` at import time, so the services have to be up before the bot is imported.
+        """
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+
+        self._thread = threading.Thread(target=serve, name="FakeServices", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
@@ -0,0 +1,261 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing
+from typing import Dict, List
+
+from scripts.prompts import SYSTEM_PROMPT
+from classes.metrics import get_rss_bytes
+
+# LLM micro-benchmark: measures time to first token, prefill and decode speed and memory of the
+# local model across GGUF files (e.g. the same model in Q4_0, Q4_K_M, Q5_K_M and Q8_0), thread
+# counts, prompt batch sizes and prompt lengths, using the bot's own prompts.
+#
+# Example:
+#   python -m benchmarks.llm --models ./models/nous-hermes-llama2-13b.Q4_0.gguf,./models/nous-hermes-llama2-13b.Q5_K_M.gguf \
+#       --threads 4,8 --batch-sizes 8,128 --history 0,6,20 --json llm.json
+#   python -m benchmarks.llm --models ./models/nous-hermes-llama2-13b.Q4_0.gguf --draft ./models/tinyllama-1.1b-chat.Q4_0.gguf --draft-tokens 2,4,6
+#
+# With --draft, each model is also run on llama.cpp, once with plain decoding and once per draft
+# length with speculative decoding (classes/speculative.py, needs requirements-speculative.txt), so the
+# "llama.cpp" row is the baseline for the "spec" rows.
+#
+# Each model/thread combination runs in a fresh process, so the reported RSS belongs to that model
+# alone. The context window is fixed when gpt4all loads the model (2048 tokens), so "context length"
+# here means how much of it the prompt fills: the persona prompt plus N turns of chat history.
+
+SAMPLE_HISTORY = [
+    ("user", "hey whats up"),
+    ("assistant", "not much bro just chillin, hbu"),
+    ("user", "can you explain how vaccines train the immune system?"),
+    ("assistant", "sure. a vaccine shows your immune system a harmless piece or version of a pathogen, so b cells learn to make antibodies for it and memory cells stick around. next time the real thing shows up, the response is fast enough that you barely notice"),
+    ("user", "lol ok nerd"),
+    ("assistant", "LMFAOOOO guilty"),
+    ("user", "whats a good name for a black cat"),
+    ("assistant", "salem, obviously. or void if youre feeling dramatic"),
+    ("user", "write me a python one liner to reverse a string"),
+    ("assistant", "s[::-1]"),
+]
+
+QUESTION = "what's the difference between a list and a tuple in python?"
+
+QUANT_PATTERN = re.compile(r"(?:^|[.\-_])((?:IQ|Q)\d(?:_[A-Z0-9]+)*|F16|F32)(?:[.\-_]|$)", re.IGNORECASE)
+
+def quantization(model_file: str) -> str:
+    match = QUANT_PATTERN.search(os.path.basename(model_file))
+    return match.group(1).upper() if match else "?"
+
+def build_prompt(history_turns: int) -> str:
+    """
+    The private chat prompt the bot sends (see `chat_gpt_direct`), preceded by the persona prompt and
+    the last `history_turns` messages once there is history to carry.
+    """
+    question = f"SYSTEM CONTEXT:\n\nCurrent Date: 01/01/2024\nCurrent Time: 12:00 PM (EST)\n\nPRIVATE CHAT, Load Tester: {QUESTION}"
+    if not history_turns:
+        return question
+    turns = [SAMPLE_HISTORY[i % len(SAMPLE_HISTORY)] for i in range(history_turns)]
+    history = "\n".join(f"### {'Human' if role == 'user' else 'Assistant'}:\n{content}" for role, content in turns)
+    return f"{SYSTEM_PROMPT}\n\n{history}\n### Human:\n{question}\n### Assistant:\n"
+
+def run_one(model, prompt: str, max_tokens: int, n_batch: int, temp: float) -> Dict[str, float]:
+    token_times = []
+
+    def on_token(token_id, response):
+        token_times.append(time.perf_counter())
+        return True
+
+    start = time.perf_counter()
+    model.generate(prompt, max_tokens=max_tokens, n_batch=n_batch, temp=temp, callback=on_token)
+    end = time.perf_counter()
+
+    completion_tokens = len(token_times)
+    first_token_at = token_times[0] if token_times else end
+    # n_past counts every token evaluated in this (freshly reset) context: the prompt plus all but the last generated token
+    prompt_tokens = max(1, model.model.context.n_past - max(0, completion_tokens - 1))
+    prefill_s = first_token_at - start
+    decode_s = end - first_token_at
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "ttft_s": prefill_s,
+        "prefill_tps": prompt_tokens / prefill_s if prefill_s > 0 else 0.0,
+        "decode_tps": (completion_tokens - 1) / decode_s if completion_tokens > 1 and decode_s > 0 else 0.0,
+        "total_s": end - start,
+    }
+
+def run_one_speculative(decoder, prompt: str, max_tokens: int, temp: float) -> Dict[str, float]:
+    token_times = []
+    start = time.perf_counter()
+    for _ in decoder.generate(prompt, max_tokens, temp=temp):
+        token_times.append(time.perf_counter())
+    end = time.perf_counter()
+
+    stats = decoder.last_stats
+    completion_tokens = stats["completion_tokens"]
+    prompt_tokens = len(decoder.target.tokenize(prompt.encode("utf-8")))
+    # Tokens arrive in bursts of one verification round, so decode speed is measured after the first one
+    first_token_at = token_times[0] if token_times else end
+    prefill_s = first_token_at - start
+    decode_s = end - first_token_at
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "ttft_s": prefill_s,
+        "prefill_tps": prompt_tokens / prefill_s if prefill_s > 0 else 0.0,
+        "decode_tps": (completion_tokens - 1) / decode_s if completion_tokens > 1 and decode_s > 0 else 0.0,
+        "total_s": end - start,
+        "acceptance": stats["accepted_tokens"] / stats["draft_tokens"] if stats["draft_tokens"] else 0.0,
+    }
+
+def benchmark_model(model_file: str, threads: int, settings: Dict) -> List[Dict]:
+    """
+    Load one model with one thread count and run every batch size / prompt length combination.
+    Runs in a child process.
+    """
+    from gpt4all import GPT4All
+
+    rss_before = get_rss_bytes()
+    load_start = time.perf_counter()
+    model = GPT4All(os.path.basename(model_file), model_path=os.path.dirname(os.path.abspath(model_file)), allow_download=False, n_threads=threads)
+    load_s = time.perf_counter() - load_start
+    rss_loaded = get_rss_bytes()
+
+    results = []
+    for n_batch in settings["batch_sizes"]:
+        for history_turns in settings["history"]:
+            prompt = build_prompt(history_turns)
+            # The first run warms up caches and the allocator
+            run_one(model, prompt, min(8, settings["max_tokens"]), n_batch, settings["temp"])
+            runs = [run_one(model, prompt, settings["max_tokens"], n_batch, settings["temp"]) for _ in range(settings["repeats"])]
+            if not any(run["completion_tokens"] for run in runs):
+                print(f"{os.path.basename(model_file)}: nothing generated with {history_turns} history turns; the prompt may not fit the context window", file=sys.stderr)
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            results.append({
+                "model": os.path.basename(model_file),
+                "engine": "gpt4all",
+                "quantization": quantization(model_file),
+                "threads": threads,
+                "n_batch": n_batch,
+                "history_turns": history_turns,
+                "load_s": round(load_s, 2),
+                "model_rss_mb": round((rss_loaded - rss_before) / 1024 / 1024, 1),
+                "peak_rss_mb": round(get_rss_bytes() / 1024 / 1024, 1),
+                **{key: round(value, 3) for key, value in median.items()},
+            })
+    return results
+
+def benchmark_speculative(model_file: str, threads: int, settings: Dict) -> List[Dict]:
+    """
+    Load one model with the draft model on llama.cpp and run every draft length / prompt length
+    combination, draft length 0 being plain decoding. Runs in a child process.
+    """
+    from classes.speculative import SpeculativeDecoder
+
+    rss_before = get_rss_bytes()
+    load_start = time.perf_counter()
+    # Never fall back to plain decoding, so each row measures what it says
+    decoder = SpeculativeDecoder(model_file, settings["draft"], n_threads=threads, min_acceptance=0)
+    load_s = time.perf_counter() - load_start
+    rss_loaded = get_rss_bytes()
+
+    results = []
+    for draft_tokens in [0] + settings["draft_tokens"]:
+        decoder.draft_tokens = draft_tokens
+        for history_turns in settings["history"]:
+            prompt = build_prompt(history_turns)
+            run_one_speculative(decoder, prompt, min(8, settings["max_tokens"]), settings["temp"])
+            runs = [run_one_speculative(decoder, prompt, settings["max_tokens"], settings["temp"]) for _ in range(settings["repeats"])]
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            results.append({
+                "model": os.path.basename(model_file),
+                "engine": f"spec k={draft_tokens}" if draft_tokens else "llama.cpp",
+                "quantization": quantization(model_file),
+                "threads": threads,
+                "n_batch": decoder.target.n_batch,
+                "history_turns": history_turns,
+                "load_s": round(load_s, 2),
+                "model_rss_mb": round((rss_loaded - rss_before) / 1024 / 1024, 1),
+                "peak_rss_mb": round(get_rss_bytes() / 1024 / 1024, 1),
+                **{key: round(value, 3) for key, value in median.items()},
+            })
+    return results
+
+def _worker(benchmark, model_file: str, threads: int, settings: Dict, results) -> None:
+    try:
+        results.put(benchmark(model_file, threads, settings))
+    except Exception as e:
+        results.put({"model": os.path.basename(model_file), "threads": threads, "error": f"{type(e).__name__}: {e}"})
+
+def run_in_subprocess(benchmark, model_file: str, threads: int, settings: Dict) -> List[Dict]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_worker, args=(benchmark, model_file, threads, settings, results))
+    process.start()
+    try:
+        outcome = results.get()
+    finally:
+        process.join()
+    if isinstance(outcome, dict):
+        print(f"{outcome['model']} ({threads} threads) failed: {outcome['error']}", file=sys.stderr)
+        return []
+    return outcome
+
+def print_report(results: List[Dict]) -> None:
+    header = f"{'model':<40}{'engine':>11}{'quant':>8}{'thr':>5}{'batch':>7}{'hist':>6}{'prompt':>8}{'ttft s':>9}{'pre t/s':>9}{'dec t/s':>9}{'accept':>8}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        acceptance = f"{result['acceptance']:>8.2f}" if "acceptance" in result and result["engine"].startswith("spec") else f"{'-':>8}"
+        print(f"{result['model'][:39]:<40}{result['engine']:>11}{result['quantization']:>8}{result['threads']:>5}{result['n_batch']:>7}{result['history_turns']:>6}"
+              f"{result['prompt_tokens']:>8.0f}{result['ttft_s']:>9.2f}{result['prefill_tps']:>9.1f}{result['decode_tps']:>9.1f}{acceptance}{result['model_rss_mb']:>9.0f}")
+
+def parse_ints(spec: str) -> List[int]:
+    return [int(value) for value in spec.split(",") if value.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare local GGUF models, quantizations and runtime settings.")
+    parser.add_argument("--models", required=True, help="Comma-separated GGUF files")
+    parser.add_argument("--threads", default=str(os.cpu_count() or 4), help="Comma-separated thread counts")
+    parser.add_argument("--batch-sizes", default="8", help="Comma-separated prompt batch sizes (n_batch); gpt4all defaults to 8")
+    parser.add_argument("--history", default="0,6,20", help="Comma-separated chat history lengths (turns) to prepend to the prompt")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Tokens to generate per run")
+    parser.add_argument("--temp", type=float, default=0.7, help="Sampling temperature")
+    parser.add_argument("--repeats", type=int, default=3, help="Measured runs per combination; the median is reported")
+    parser.add_argument("--draft", help="Draft GGUF model; also benchmark llama.cpp with and without speculative decoding")
+    parser.add_argument("--draft-tokens", default="4", help="Comma-separated draft lengths to try with --draft")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    settings = {
+        "batch_sizes": parse_ints(args.batch_sizes),
+        "history": parse_ints(args.history),
+        "max_tokens": args.max_tokens,
+        "temp": args.temp,
+        "repeats": args.repeats,
+        "draft": os.path.abspath(args.draft) if args.draft else None,
+        "draft_tokens": parse_ints(args.draft_tokens),
+    }
+    if args.draft and not os.path.isfile(args.draft):
+        parser.error(f"No such draft model file: {args.draft}")
+
+    results = []
+    for model_file in (path.strip() for path in args.models.split(",") if path.strip()):
+        if not os.path.isfile(model_file):
+            parser.error(f"No such model file: {model_file}")
+        for threads in parse_ints(args.threads):
+            print(f"{os.path.basename(model_file)} with {threads} threads", file=sys.stderr)
+            results.extend(run_in_subprocess(benchmark_model, model_file, threads, settings))
+            if settings["draft"]:
+                results.extend(run_in_subprocess(benchmark_speculative, model_file, threads, settings))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import importlib
+from typing import Dict, List
+
+from benchmarks.fake_services import FakeServices, parse_latency
+from benchmarks.run import SCENARIOS, USER_ID_BASE, ScenarioRunner, percentile, prepare_environment
+
+# Open-loop load generator: replays a traffic mix at increasing arrival rates against the bot
+# (in-process, with the fake backends from benchmarks/fake_services.py) and reports, per stage,
+# the achieved throughput, end-to-end and queueing latency, and where the bot saturates.
+#
+# Example:
+#   python -m benchmarks.load --model ./models/tiny.gguf --rates 0.5,1,2,4,8 --stage-seconds 30
+#   python -m benchmarks.load --model ./models/tiny.gguf --mix private_chat=70,group_slash=30 --rates 1,2,4 --json load.json
+#
+# Requests arrive as a Poisson process, so bursts happen like they do in real traffic. Requests
+# still in flight when a stage ends keep running into the next one, exactly as a backlog would.
+
+GROUP_ID_BASE = 200000
+
+DEFAULT_MIX = "private_chat=45,group_slash=15,group_chat=5,speak=10,image=5,search=10,voice=10"
+
+GROUP_SCENARIOS = ("group_chat", "group_slash")
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class LoadGenerator():
+    def __init__(self, runner: ScenarioRunner, mix: Dict[str, float], users: int, groups: int, seed: int = None):
+        self.runner = runner
+        self.scenarios = list(mix)
+        self.weights = list(mix.values())
+        self.users = users
+        self.groups = groups
+        self.random = random.Random(seed)
+        self.records: List[Dict] = []
+        self.current_stage = 0
+        self.max_backlog: Dict[int, int] = {}
+
+    def _build(self, update_id: int) -> Dict:
+        scenario = self.random.choices(self.scenarios, self.weights)[0]
+        user_id = USER_ID_BASE + self.random.randrange(self.users)
+        payload = SCENARIOS[scenario](update_id, user_id)
+        if scenario in GROUP_SCENARIOS:
+            # Many users share a few groups, which is what makes group traffic queue up per chat
+            group_id = GROUP_ID_BASE + self.random.randrange(self.groups)
+            payload["message"]["chat"] = {"id": -group_id, "type": "group", "title": f"Load Test Group {group_id}"}
+        return {"scenario": scenario, "payload": payload}
+
+    async def _request(self, stage: int, request: Dict) -> None:
+        arrived = time.perf_counter()
+        latency = await self.runner.submit(request["payload"])
+        update_id = request["payload"]["update_id"]
+        queue_wait = next((attributes.get("queue_wait_ms", 0) / 1000 for name, _, _, attributes in self.runner.take_spans(update_id) if name == "update"), None)
+        self.records.append({
+            "stage": stage,
+            "scenario": request["scenario"],
+            "arrived": arrived,
+            "finished": arrived + latency if latency is not None else None,
+            "latency": latency,
+            "queue_wait": queue_wait,
+        })
+
+    async def _sample_backlog(self, stop: asyncio.Event) -> None:
+        # Updates queued in PTB plus those waiting in the update processor for their chat or a slot
+        processor = self.runner.application.update_processor
+        while not stop.is_set():
+            backlog = processor.get_stats()["pending"] + self.runner.application.update_queue.qsize()
+            self.max_backlog[self.current_stage] = max(self.max_backlog.get(self.current_stage, 0), backlog)
+            try:
+                await asyncio.wait_for(stop.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, rates: List[float], stage_seconds: float) -> List[Dict]:
+        tasks = []
+        windows = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_backlog(stop))
+
+        for index, rate in enumerate(rates):
+            self.current_stage = index
+            start = time.perf_counter()
+            end = start + stage_seconds
+            arrivals = 0
+            print(f"stage {index + 1}/{len(rates)}: {rate} req/s for {stage_seconds:.0f}s", file=sys.stderr)
+            next_arrival = start + self.random.expovariate(rate)
+            while next_arrival < end:
+                await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+                request = self._build(self.runner.reserve_update_ids(1))
+                tasks.append(asyncio.create_task(self._request(index, request)))
+                arrivals += 1
+                next_arrival += self.random.expovariate(rate)
+            await asyncio.sleep(max(0.0, end - time.perf_counter()))
+            windows.append({"rate": rate, "start": start, "end": end, "arrivals": arrivals})
+
+        print("draining in-flight requests", file=sys.stderr)
+        await asyncio.gather(*tasks)
+        stop.set()
+        await sampler
+        return windows
+
+    def report(self, windows: List[Dict], slo: float) -> Dict:
+        stages = []
+        saturation = None
+        for index, window in enumerate(windows):
+            records = [record for record in self.records if record["stage"] == index]
+            latencies = [record["latency"] for record in records if record["latency"] is not None]
+            queue_waits = [record["queue_wait"] for record in records if record["queue_wait"] is not None]
+            finished_in_window = sum(1 for record in self.records if record["finished"] and window["start"] <= record["finished"] < window["end"])
+            duration = window["end"] - window["start"]
+            by_scenario = {}
+            for record in records:
+                by_scenario.setdefault(record["scenario"], []).append(record["latency"])
+
+            stage = {
+                "target_rps": window["rate"],
+                "offered_rps": round(window["arrivals"] / duration, 3),
+                "completed_rps": round(finished_in_window / duration, 3),
+                "requests": len(records),
+                "timeouts": len(records) - len(latencies),
+                "latency_s": {key: round(percentile(latencies, p), 3) for key, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+                "queue_wait_s": {key: round(percentile(queue_waits, p), 3) for key, p in (("p50", 0.50), ("p95", 0.95))},
+                "max_backlog": self.max_backlog.get(index, 0),
+                "scenarios_p95_s": {
+                    name: round(percentile([value for value in values if value is not None], 0.95), 3)
+                    for name, values in sorted(by_scenario.items())
+                },
+            }
+
+            reasons = []
+            if stage["completed_rps"] < 0.9 * stage["offered_rps"]:
+                reasons.append("throughput fell behind arrivals")
+            if stage["latency_s"]["p95"] > slo:
+                reasons.append(f"p95 latency above {slo:g}s")
+            if stage["timeouts"]:
+                reasons.append("requests timed out")
+            stage["saturated"] = bool(reasons)
+            if reasons and saturation is None:
+                saturation = {"target_rps": window["rate"], "reasons": reasons}
+            stages.append(stage)
+
+        return {"stages": stages, "saturation": saturation}
+
+def print_report(report: Dict) -> None:
+    header = f"{'rate':>7}{'offered':>9}{'done/s':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'qwait95':>9}{'backlog':>9}{'t/o':>6}"
+    print(header)
+    print("-" * len(header))
+    for stage in report["stages"]:
+        latency = stage["latency_s"]
+        print(f"{stage['target_rps']:>7g}{stage['offered_rps']:>9.2f}{stage['completed_rps']:>9.2f}{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+              f"{latency['p99']:>9.2f}{stage['queue_wait_s']['p95']:>9.2f}{stage['max_backlog']:>9}{stage['timeouts']:>6}{'  *' if stage['saturated'] else ''}")
+    print()
+    saturation = report["saturation"]
+    if saturation:
+        print(f"Saturated at {saturation['target_rps']:g} req/s: {', '.join(saturation['reasons'])}")
+    else:
+        print("No saturation within the tested rates")
+
+async def run_load(bot, services: FakeServices, args) -> Dict:
+    from classes.tracing import tracer
+    from classes.metrics import get_rss_bytes, HANDLER_ERRORS
+
+    application = bot.build_application()
+    await bot.model_router.preload(bot.system_message()["content"])
+    async with application:
+        await application.start()
+        runner = ScenarioRunner(application, services, tracer, get_rss_bytes, HANDLER_ERRORS, args.timeout)
+        generator = LoadGenerator(runner, args.mix, args.users, args.groups, args.seed)
+        errors_before = HANDLER_ERRORS.total()
+        windows = await generator.run(args.rates, args.stage_seconds)
+        report = generator.report(windows, args.slo)
+        report["handler_errors"] = int(HANDLER_ERRORS.total() - errors_before)
+        report["error_replies"] = services.error_replies
+        await application.stop()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp up simulated user traffic against the bot and find where it saturates.")
+    parser.add_argument("--model", required=True, help="Path to a (small) GGUF model for the local LLM")
+    parser.add_argument("--fast-model", help="Path to a GGUF model for small talk (LLM_FAST_MODEL); by default --model serves everything")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights, out of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rates", default="0.5,1,2,4,8", help="Arrival rates (requests/s) of the successive stages")
+    parser.add_argument("--stage-seconds", type=float, default=30, help="Duration of each stage")
+    parser.add_argument("--users", type=int, default=200, help="Distinct simulated users")
+    parser.add_argument("--groups", type=int, default=20, help="Distinct group chats for group traffic")
+    parser.add_argument("--slo", type=float, default=10, help="p95 latency (s) above which a stage counts as saturated")
+    parser.add_argument("--latency", default="", help="Backend latency overrides in seconds, e.g. stability=0.5,telegram=0.05")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- fraction applied to every backend delay")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before a request counts as timed out")
+    parser.add_argument("--seed", type=int, help="Seed for arrivals and the traffic mix")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    try:
+        args.mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    args.rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+
+    services = FakeServices(
+        latency=parse_latency(args.latency),
+        jitter=args.jitter,
+        allowed_user_ids=range(USER_ID_BASE, USER_ID_BASE + args.users),
+    )
+    services.start_in_thread()
+    prepare_environment(services, args)
+
+    try:
+        bot = importlib.import_module("main")
+        report = asyncio.run(run_load(bot, services, args))
+    finally:
+        services.stop_thread()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "latency": services.latency, **report}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import importlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fake_services import FakeServices, parse_latency
+from scripts.fake_telegram_sender import build_update
+
+# Offline benchmark: drives the bot's real handlers with synthetic updates against local stand-ins
+# for Telegram and every external API, and reports throughput, latency percentiles, a per-stage
+# breakdown and peak RSS per scenario.
+#
+# Example:
+#   python -m benchmarks.run --model ./models/tinyllama-1.1b-chat.Q4_0.gguf --requests 40 --concurrency 8
+#   python -m benchmarks.run --model ./models/tiny.gguf --scenarios image,search --latency stability=0.5 --json results.json
+#   python -m benchmarks.run --model ./models/nous-hermes-llama2-13b.Q4_0.gguf --fast-model ./models/tinyllama-1.1b-chat.Q4_0.gguf --scenarios private_chat,group_slash
+#
+# Bot settings can be tuned per run through the usual environment variables, e.g.
+# MAX_CONCURRENT_UPDATES=8 MAX_CONCURRENT_OPENAI=8 python -m benchmarks.run ...
+# The outbound Telegram limits stay at their real values (~1 message/s per private chat), so spread
+# requests over enough --users or raise TELEGRAM_PRIVATE_CHAT_RATE to measure the handlers alone.
+#
+# The voice scenario needs ffmpeg, like the bot. /summarize is not covered because the YouTube
+# transcript API has no configurable endpoint.
+
+USER_ID_BASE = 100000
+
+def voice_update(update_id: int, user_id: int) -> Dict:
+    update = build_update(update_id, user_id, "")
+    message = update["message"]
+    del message["text"]
+    message["voice"] = {"file_id": f"voice-{update_id}", "file_unique_id": f"voice-{update_id}", "duration": 2, "mime_type": "audio/ogg"}
+    return update
+
+# Each scenario maps (update_id, user_id) to an update payload
+SCENARIOS: Dict[str, Callable[[int, int], Dict]] = {
+    "start": lambda update_id, user_id: build_update(update_id, user_id, "/start"),
+    "help": lambda update_id, user_id: build_update(update_id, user_id, "/help"),
+    "private_chat": lambda update_id, user_id: build_update(update_id, user_id, "what's a good name for a cat?"),
+    "group_chat": lambda update_id, user_id: build_update(update_id, user_id, "/chat what's a good name for a cat?", chat_type="group"),
+    "speak": lambda update_id, user_id: build_update(update_id, user_id, "/v good morning"),
+    "voices": lambda update_id, user_id: build_update(update_id, user_id, "/voices"),
+    "image": lambda update_id, user_id: build_update(update_id, user_id, "/image a black cat sitting on a throne"),
+    "group_slash": lambda update_id, user_id: build_update(update_id, user_id, "/ anyone up for lunch?", chat_type="group"),
+    "search": lambda update_id, user_id: build_update(update_id, user_id, "/search recent ai news"),
+    "weather": lambda update_id, user_id: build_update(update_id, user_id, "/weather pittsburg"),
+    "voice": voice_update,
+}
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def prepare_environment(services: FakeServices, args) -> None:
+    """
+    Point `Config` at the fake services before anything imports it.
+    """
+    model_path = os.path.abspath(args.model)
+    os.environ.update(services.config_env())
+    os.environ.update({
+        "LLM_MODEL": os.path.basename(model_path),
+        "LLM_MODEL_PATH": os.path.dirname(model_path),
+        "LLM_ALLOW_DOWNLOAD": "false",
+        "METRICS_ENABLED": "false",
+    })
+    if getattr(args, "fast_model", None):
+        os.environ["LLM_FAST_MODEL"] = os.path.abspath(args.fast_model)
+    for key in ("TELEGRAM_BOT_TOKEN", "OPENAI_API_KEY", "ELEVEN_API_KEY", "BING_API_KEY", "DEEPGRAM_API_KEY", "STABILITY_API_KEY",
+                "WEATHER_API_KEY", "GOOGLE_API_KEY", "DROPBOX_REFRESH_TOKEN", "DROPBOX_CLIENT_ID", "DROPBOX_CLIENT_SECRET"):
+        os.environ[key] = "123456:benchmark" if key == "TELEGRAM_BOT_TOKEN" else "benchmark"
+
+    # Quotas would reject most benchmark traffic, and state must not leak into a real deployment
+    os.environ.setdefault("COMMAND_QUOTAS", json.dumps({name: {"per_hour": 1e9, "burst": 1e9} for name in ("image", "summarize", "search", "voice")}))
+    state_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("ADMISSION_STATE_PATH", os.path.join(state_dir, "admission_state.json"))
+    os.environ.setdefault("WEATHER_GEOCODE_CACHE_PATH", os.path.join(state_dir, "geocode_cache.json"))
+    os.environ.setdefault("PAGE_CACHE_DIR", os.path.join(state_dir, "pages"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_LEVELS", "telegram=WARNING")
+    os.environ.setdefault("TRACE_EXPORTERS", "ring")
+    # Scenarios repeat the same messages, which would otherwise be answered from the response cache
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+
+class ScenarioRunner():
+    """
+    Feeds updates into the application's update queue with a fixed number in flight (closed loop)
+    and times each one from enqueue until its "update" span ends.
+    """
+
+    def __init__(self, application, services: FakeServices, tracer, get_rss_bytes, handler_errors, timeout: float):
+        self.application = application
+        self.services = services
+        self.tracer = tracer
+        self.get_rss_bytes = get_rss_bytes
+        self.handler_errors = handler_errors
+        self.timeout = timeout
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._spans: Dict[str, List] = {}
+        self._next_update_id = 1
+        tracer.on_span_end.append(self._on_span_end)
+
+    def _on_span_end(self, span) -> None:
+        spans = self._spans.get(span.trace_id)
+        if spans is None:
+            return
+        spans.append((span.name, span.duration_ms, span.status, dict(span.attributes)))
+        if span.name == "update":
+            waiter = self._waiters.get(span.trace_id)
+            if waiter is not None:
+                end = time.perf_counter()
+                waiter.get_loop().call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(end))
+
+    def _error_total(self) -> float:
+        return self.handler_errors.total()
+
+    async def _sample_rss(self, peak: Dict[str, int], stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            peak["rss"] = max(peak["rss"], self.get_rss_bytes())
+            try:
+                await asyncio.wait_for(stop.wait(), 0.05)
+            except asyncio.TimeoutError:
+                pass
+
+    def reserve_update_ids(self, count: int) -> int:
+        first_id = self._next_update_id
+        self._next_update_id += count
+        return first_id
+
+    async def submit(self, update_payload: Dict) -> Optional[float]:
+        """
+        Enqueue one update and wait until it has been processed.
+
+        Returns:
+            Optional[float]: Seconds from enqueue to the end of the update span, or None on timeout.
+        """
+        from telegram import Update
+        request_id = str(update_payload["update_id"])
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = waiter
+        self._spans[request_id] = []
+
+        start = time.perf_counter()
+        await self.application.update_queue.put(Update.de_json(update_payload, self.application.bot))
+        try:
+            return await asyncio.wait_for(waiter, self.timeout) - start
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self._waiters[request_id]
+
+    def take_spans(self, request_id) -> List[Tuple[str, float, str, Dict]]:
+        """
+        Remove and return the (name, duration_ms, status, attributes) of every span recorded for a request.
+        """
+        return self._spans.pop(str(request_id), [])
+
+    async def _send_one(self, update_payload: Dict, latencies: List[float], timeouts: List[str]) -> None:
+        latency = await self.submit(update_payload)
+        if latency is None:
+            timeouts.append(str(update_payload["update_id"]))
+        else:
+            latencies.append(latency)
+
+    async def run(self, name: str, requests: int, concurrency: int, users: int) -> Dict:
+        build = SCENARIOS[name]
+        self.services.reset_counters()
+        errors_before = self._error_total()
+        latencies, timeouts = [], []
+        first_id = self.reserve_update_ids(requests)
+        queue = asyncio.Queue()
+        for n in range(requests):
+            queue.put_nowait(build(first_id + n, USER_ID_BASE + n % users))
+
+        async def worker():
+            while not queue.empty():
+                await self._send_one(queue.get_nowait(), latencies, timeouts)
+
+        peak = {"rss": self.get_rss_bytes()}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self._sample_rss(peak, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+        # Per-stage breakdown from the spans of this scenario's requests
+        stages: Dict[str, List[float]] = {}
+        stage_errors = 0
+        for request_id in range(first_id, first_id + requests):
+            for span_name, duration_ms, status, _ in self.take_spans(request_id):
+                stages.setdefault(span_name, []).append(duration_ms / 1000)
+                stage_errors += status == "error"
+
+        return {
+            "scenario": name,
+            "requests": requests,
+            "completed": len(latencies),
+            "timeouts": len(timeouts),
+            "handler_errors": int(self._error_total() - errors_before),
+            "error_replies": self.services.error_replies,
+            "failed_stages": stage_errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            "latency_s": {key: round(percentile(latencies, p), 4) for key, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+            "latency_max_s": round(max(latencies, default=0.0), 4),
+            "peak_rss_mb": round(peak["rss"] / 1024 / 1024, 1),
+            "telegram_calls": dict(self.services.telegram_calls),
+            "stages_p50_s": {stage: round(percentile(values, 0.5), 4) for stage, values in sorted(stages.items())},
+        }
+
+def print_report(results: List[Dict]) -> None:
+    header = f"{'scenario':<14}{'ok':>6}{'err':>6}{'rps':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        errors = result["timeouts"] + result["handler_errors"] + result["error_replies"]
+        latency = result["latency_s"]
+        print(f"{result['scenario']:<14}{result['completed']:>6}{errors:>6}{result['throughput_rps']:>9.2f}"
+              f"{latency['p50']:>9.3f}{latency['p95']:>9.3f}{latency['p99']:>9.3f}{result['peak_rss_mb']:>9.1f}")
+    print()
+    for result in results:
+        stages = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in result["stages_p50_s"].items() if stage != "update")
+        print(f"{result['scenario']}: {stages or 'no traced stages'}")
+
+async def run_benchmarks(bot, services: FakeServices, args) -> List[Dict]:
+    from classes.tracing import tracer
+    from classes.metrics import get_rss_bytes, HANDLER_ERRORS
+
+    application = bot.build_application()
+    results = []
+    await bot.model_router.preload(bot.system_message()["content"])
+    async with application:
+        await application.start()
+        runner = ScenarioRunner(application, services, tracer, get_rss_bytes, HANDLER_ERRORS, args.timeout)
+        for name in args.scenarios:
+            if args.warmup:
+                await runner.run(name, min(args.warmup, args.requests), args.concurrency, args.users)
+            result = await runner.run(name, args.requests, args.concurrency, args.users)
+            results.append(result)
+            print(f"{name}: {result['completed']}/{result['requests']} in {result['elapsed_s']}s", file=sys.stderr)
+        await application.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers against local fake backends.")
+    parser.add_argument("--model", required=True, help="Path to a (small) GGUF model for the local LLM")
+    parser.add_argument("--fast-model", help="Path to a GGUF model for small talk (LLM_FAST_MODEL); by default --model serves everything")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated, out of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at a time")
+    parser.add_argument("--users", type=int, default=10, help="Distinct users/chats the requests are spread over")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per scenario before the measured run")
+    parser.add_argument("--latency", default="", help="Backend latency overrides in seconds, e.g. stability=0.5,telegram=0.05")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- fraction applied to every backend delay")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before a request counts as timed out")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    services = FakeServices(
+        latency=parse_latency(args.latency),
+        jitter=args.jitter,
+        allowed_user_ids=range(USER_ID_BASE, USER_ID_BASE + args.users),
+    )
+    services.start_in_thread()
+    prepare_environment(services, args)
+
+    try:
+        # Imported only now: loading config talks to (fake) Dropbox
+        bot = importlib.import_module("main")
+        results = asyncio.run(run_benchmarks(bot, services, args))
+    finally:
+        services.stop_thread()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": {key: value for key, value in vars(args).items()}, "latency": services.latency, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import json
+import random
+import argparse
+import statistics
+import timeit
+from collections import Counter
+from typing import Dict
+
+import numpy as np
+
+from scripts.prompts import SYSTEM_PROMPT
+from classes.handlers.chat_handler import unstable_text
+
+# Micro-benchmark of the "unstable mode" text transform: the vectorized implementation against the
+# per-character one it replaced, on replies of a few sizes (the bot's persona prompt, repeated or cut
+# to length, as a stand-in for a long reply). Also checks that both draw from the same distribution.
+#
+# Example:
+#   python -m benchmarks.unstable --sizes 256,4096,16384 --json unstable.json
+
+def reference_unstable_text(text: str) -> str:
+    """
+    The per-character implementation, as it was before vectorizing.
+    """
+    result = []
+    for char in text:
+        if char.isalpha():
+            repeat_count = random.choice([1, 1, 2, 3, 3])
+            random_case = random.choices([True, False], weights=[0.8, 0.2], k=1)[0]
+            if random_case:
+                char = char.upper()
+            else:
+                char = char.lower()
+            result.append(char * repeat_count)
+        else:
+            result.append(char)
+    return "".join(result)
+
+def sample_text(size: int) -> str:
+    return (SYSTEM_PROMPT * (size // len(SYSTEM_PROMPT) + 1))[:size]
+
+def letter_stats(text: str, samples: int, transform) -> Dict[str, float]:
+    """
+    Share of letters written 1, 2 and 3 times, and in upper case, over `samples` transforms of "ab".
+    """
+    runs = Counter()
+    upper = 0
+    for _ in range(samples):
+        output = transform(text)
+        for letter in ("a", "b"):
+            run = output.lower().count(letter)
+            runs[run] += 1
+            upper += output.count(letter.upper()) == run
+    total = samples * 2
+    return {"x1": runs[1] / total, "x2": runs[2] / total, "x3": runs[3] / total, "upper": upper / total}
+
+def time_ms(function, repeats: int) -> float:
+    # Median of `repeats` timings, each averaged over enough calls to take about 0.2s
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return statistics.median(timer.repeat(repeats, number)) / number * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the unstable mode text transform with the per-character implementation.")
+    parser.add_argument("--sizes", default="256,4096,16384", help="Comma-separated text sizes in characters")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per size; the median is reported")
+    parser.add_argument("--samples", type=int, default=20000, help="Transforms per implementation for the distribution check")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for both implementations' random numbers")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    print(f"{'chars':>8}{'reference ms':>14}{'vectorized ms':>15}{'speedup':>9}")
+    for size in (int(value) for value in args.sizes.split(",") if value.strip()):
+        text = sample_text(size)
+        reference_ms = time_ms(lambda: reference_unstable_text(text), args.repeats)
+        vectorized_ms = time_ms(lambda: unstable_text(text, rng), args.repeats)
+        results.append({"chars": size, "reference_ms": round(reference_ms, 3), "vectorized_ms": round(vectorized_ms, 3),
+                        "speedup": round(reference_ms / vectorized_ms, 1)})
+        print(f"{size:>8}{reference_ms:>14.3f}{vectorized_ms:>15.3f}{reference_ms / vectorized_ms:>8.1f}x")
+
+    distribution = {
+        "reference": letter_stats("ab", args.samples, reference_unstable_text),
+        "vectorized": letter_stats("ab", args.samples, lambda text: unstable_text(text, rng)),
+    }
+    for name, stats in distribution.items():
+        print(f"{name}: " + ", ".join(f"{key} {value:.3f}" for key, value in stats.items()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results, "distribution": distribution}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+from telegram import Update
+from telegram.ext import ContextTypes
+from classes.concurrency import TokenBucket
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class AdmissionController():
+    """
+    Admission control for expensive commands (/image, /summarize, /search and voice notes).
+
+    Each request has to pass three checks before its handler runs:
+        1. Quota: a token bucket per user and command, plus a per-user budget of cost units shared by all commands.
+        2. Shedding: if the queue for the command's cost class is already full, the request is rejected.
+        3. Backpressure: if every slot of the cost class is busy, the user is told their queue position and waits.
+
+    Bucket state is written to `Config.ADMISSION_STATE_PATH` so quotas hold across restarts.
+    """
+
+    # cost: units charged against the user budget, per_hour/burst: refill rate and size of the command bucket
+    COMMANDS = {
+        "image": {"cost_class": "heavy", "cost": 4, "per_hour": 6, "burst": 2},
+        "summarize": {"cost_class": "heavy", "cost": 3, "per_hour": 10, "burst": 3},
+        "search": {"cost_class": "medium", "cost": 2, "per_hour": 30, "burst": 5},
+        "voice": {"cost_class": "medium", "cost": 1, "per_hour": 60, "burst": 10},
+    }
+
+    # Heavy requests get a short queue so they are shed first under load
+    COST_CLASSES = {
+        "heavy": {"max_running": 2, "max_queue": 4},
+        "medium": {"max_running": 4, "max_queue": 16},
+    }
+
+    USER_BUDGET = {"per_hour": 60, "burst": 20}
+
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path or Config.ADMISSION_STATE_PATH
+        self.commands = {name: {**settings, **Config.COMMAND_QUOTAS.get(name, {})} for name, settings in self.COMMANDS.items()}
+        self.cost_classes = {name: dict(settings) for name, settings in self.COST_CLASSES.items()}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._running = {name: 0 for name in self.cost_classes}
+        self._queues = {name: deque() for name in self.cost_classes}
+        self.stats = {"admitted": 0, "queued": 0, "rejected_quota": 0, "shed": 0}
+        self._save_task = None
+        self._save_pending = False
+        self._load_state()
+
+    def _get_bucket(self, key: str, per_hour: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Wall-clock time so the refill is correct after a restart
+            bucket = TokenBucket(per_hour / 3600, burst, clock=time.time)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _load_state(self) -> None:
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning("Could not load admission state from %s: %s", self.state_path, e)
+            return
+
+        for key, saved in state.get("buckets", {}).items():
+            bucket = TokenBucket(saved["rate"], saved["capacity"], clock=time.time)
+            bucket.tokens = saved["tokens"]
+            bucket.updated_at = saved["updated_at"]
+            self._buckets[key] = bucket
+
+    def _write_state(self, state) -> None:
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    async def save_state(self) -> None:
+        # Full buckets carry no information, so they are not persisted
+        buckets = {
+            key: {"rate": bucket.rate, "capacity": bucket.capacity, "tokens": bucket.tokens, "updated_at": bucket.updated_at}
+            for key, bucket in self._buckets.items()
+            if not bucket.is_full()
+        }
+        try:
+            await asyncio.to_thread(self._write_state, {"buckets": buckets})
+        except Exception as e:
+            logger.warning("Could not save admission state to %s: %s", self.state_path, e)
+
+    def _schedule_save(self) -> None:
+        # One write in flight at a time; changes made meanwhile trigger one more write afterwards
+        self._save_pending = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_loop())
+
+    async def _save_loop(self) -> None:
+        while self._save_pending:
+            self._save_pending = False
+            await self.save_state()
+
+    def check_quota(self, user_id: int, command: str) -> float:
+        """
+        Charge the user's quota for one run of `command`.
+
+        Args:
+            user_id (int): The Telegram user ID.
+            command (str): The command name, a key of `COMMANDS`.
+
+        Returns:
+            float: 0 if the request was charged, otherwise the number of seconds until it would fit in the quota.
+        """
+        settings = self.commands[command]
+        command_bucket = self._get_bucket(f"{user_id}:{command}", settings["per_hour"], settings["burst"])
+        user_bucket = self._get_bucket(f"{user_id}:*", self.USER_BUDGET["per_hour"], self.USER_BUDGET["burst"])
+
+        wait = max(command_bucket.time_until_available(1), user_bucket.time_until_available(settings["cost"]))
+        if wait > 0:
+            return wait
+
+        command_bucket.try_consume(1)
+        user_bucket.try_consume(settings["cost"])
+        return 0.0
+
+    @staticmethod
+    def format_wait(seconds: float) -> str:
+        minutes = int(seconds // 60) + 1
+        return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+    @asynccontextmanager
+    async def admit(self, update: Update, command: str):
+        """
+        Async context manager that yields True once the request may run, or False if it was rejected.
+        The user is told why when a request is rejected or has to wait.
+        """
+        async with self.acquire(update.effective_user.id, command, update.effective_message.reply_text) as admitted:
+            yield admitted
+
+    @asynccontextmanager
+    async def acquire(self, user_id: int, command: str, notify: Optional[Callable[[str], Awaitable]] = None):
+        """
+        Like `admit`, for a user rather than an update, e.g. a tool the chat model calls for them.
+        What the user would be told is passed to `notify`, if given.
+        """
+        async def tell(text: str) -> None:
+            if notify is not None:
+                await notify(text)
+
+        settings = self.commands[command]
+        cost_class = settings["cost_class"]
+        limits = self.cost_classes[cost_class]
+        queue = self._queues[cost_class]
+
+        must_wait = self._running[cost_class] >= limits["max_running"] or bool(queue)
+
+        # Shed before charging the quota, so a rejected request doesn't cost the user anything
+        if must_wait and len(queue) >= limits["max_queue"]:
+            self.stats["shed"] += 1
+            await tell("I'm swamped right now. Please try again in a minute.")
+            yield False
+            return
+
+        wait = self.check_quota(user_id, command)
+        if wait > 0:
+            self.stats["rejected_quota"] += 1
+            await tell(f"You've hit the limit for /{command}. Try again in about {self.format_wait(wait)}.")
+            yield False
+            return
+        self._schedule_save()
+
+        if must_wait:
+            waiter = asyncio.get_running_loop().create_future()
+            queue.append(waiter)
+            self.stats["queued"] += 1
+            await tell(f"Queued, position {len(queue)}. I'll get to it shortly.")
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in queue:
+                    queue.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # The slot was already handed to us; pass it on
+                    self._running[cost_class] -= 1
+                    self._release(cost_class)
+                raise
+        else:
+            self._running[cost_class] += 1
+
+        self.stats["admitted"] += 1
+        try:
+            yield True
+        finally:
+            self._running[cost_class] -= 1
+            self._release(cost_class)
+
+    def _release(self, cost_class: str) -> None:
+        # Hand the freed slot directly to the next waiter so new arrivals can't jump the queue
+        queue = self._queues[cost_class]
+        while queue:
+            waiter = queue.popleft()
+            if not waiter.done():
+                self._running[cost_class] += 1
+                waiter.set_result(True)
+                return
+
+    def guard(self, command: str):
+        """
+        Decorator that puts a handler behind admission control for `command`. Unauthorized users and
+        commands sent without an argument go straight to the handler, which replies to them itself.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+                message = update.effective_message
+                has_argument = message is None or message.text is None or len(message.text.split()) > 1
+                if update.effective_user.id not in Config.AUTHORIZED_USER_IDS or not has_argument:
+                    return await func(update, context, *args, **kwargs)
+
+                async with self.admit(update, command) as admitted:
+                    if admitted:
+                        return await func(update, context, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            **self.stats,
+            "running": dict(self._running),
+            "queued_now": {name: len(queue) for name, queue in self._queues.items()},
+        }
+
+admission_controller = AdmissionController()
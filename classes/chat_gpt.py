@@ -1,12 +1,15 @@
-import os
-import openai
-# from transformers import AutoTokenizer, AutoModelForCausalLM
+import logging
+from classes.model_router import model_router
+from classes.tools import system_message, tool_dispatcher
+from scripts.prompts import SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
 
 class ChatGPT:
     def __init__(self):
         pass
-    
-    async def get_chat_gpt_response(self, user_input, user_id, context):
+
+    async def get_chat_gpt_response(self, user_input, user_id, context, chat_type="private", max_tokens=512):
         if 'messages' not in context.user_data:
             context.user_data['messages'] = {}
 
@@ -16,37 +19,61 @@ class ChatGPT:
         # Add user's message to history
         context.user_data['messages'][user_id].append({"role": "user", "content": user_input})
 
-        # Prepare the prompt for the model
-        prompt = "\n".join([m["content"] for m in context.user_data['messages'][user_id][-20:]])
-
-        # Generate a response using the model
-        inputs = self.tokenizer(prompt, return_tensors="pt")
-        response = self.model.generate(**inputs, max_length=1000, pad_token_id=self.tokenizer.eos_token_id)
-        model_response = self.tokenizer.decode(response[0], skip_special_tokens=True)
+        # Generate a response with whichever model the router picks for this message, after the shared persona.
+        # The model can call tools, like in chat, and the dispatcher adds their descriptions to the persona.
+        model = model_router.route(user_input, chat_type=chat_type)
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}] + context.user_data['messages'][user_id][-20:]
+        model_response = await tool_dispatcher.chat(model, messages, max_tokens=max_tokens, user_id=user_id)
 
         # Append model's response to history
         context.user_data['messages'][user_id].append({"role": "assistant", "content": model_response})
 
         return model_response
-        
-    async def call_gpt(caption_text, user_id, user_data):
-        try:
-            openai.api_key = os.getenv["OPENAI_API_KEY"]
 
-            messages = user_data['messages'].get(user_id, [])
-            messages.append({"role": "user", "content": f"Please summarize the following video and then provide a bulleted list of the most important points: {caption_text}"})
+    async def stream_chat_gpt_response(self, user_input, user_id, context, chat_type="private", max_tokens=512, command=None):
+        """
+        Like get_chat_gpt_response, but yields the response's text as it's generated. It's added
+        to the history once it's complete.
+        """
+        if 'messages' not in context.user_data:
+            context.user_data['messages'] = {}
 
-            response = openai.ChatCompletion.create(
-                model="gpt-4-1106-preview",
-                messages=messages,
-                temperature=0.5,
+        if user_id not in context.user_data['messages']:
+            context.user_data['messages'][user_id] = []
+
+        context.user_data['messages'][user_id].append({"role": "user", "content": user_input})
+
+        # The same system message as every other request, so a local model reuses its evaluated state
+        model = model_router.route(user_input, chat_type=chat_type, command=command)
+        messages = [system_message()] + context.user_data['messages'][user_id][-20:]
+        model_response = ""
+        async for text in model.stream(messages, max_tokens=max_tokens):
+            model_response += text
+            yield text
+
+        context.user_data['messages'][user_id].append({"role": "assistant", "content": model_response.strip()})
+
+    async def call_gpt(self, caption_text):
+        # Independent of who asked, so one summary can be shared by everyone who summarizes the video
+        try:
+            # The same system message as every other request, so a local model reuses its evaluated state
+            messages = [
+                system_message(),
+                {"role": "user", "content": f"Please summarize the following video and then provide a bulleted list of the most important points. Don't call any functions: {caption_text}"},
+            ]
+
+            model = model_router.route(caption_text, command="summarize")
+            summary = await model.chat(
+                messages,
                 max_tokens=4096,
+                temperature=0.5,
                 top_p=1,
                 frequency_penalty=0,
                 presence_penalty=0
             )
-
-            return response.choices[0].message["content"].strip()
-        except Exception as e:
-            print(f"An error occurred while calling GPT: {e}")
-            return None
\ No newline at end of file
+            # The tools are described in the system message but aren't run here
+            _, summary = tool_dispatcher.parse_tool_calls(summary)
+            return summary or None
+        except Exception:
+            logger.exception("An error occurred while calling GPT")
+            return None
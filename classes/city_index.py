@@ -0,0 +1,121 @@
+import re
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9]+")
+
+def normalize_city(name: str) -> str:
+    """
+    Lookup key for a city name: lowercase, with punctuation and hyphens as single spaces,
+    so "Winston-Salem", "winston salem" and "WINSTON  SALEM" are the same city.
+    """
+    return NON_ALPHANUMERIC_PATTERN.sub(" ", name.lower()).strip()
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    """
+    Every string obtained by deleting up to `max_distance` characters from `word`, including `word` itself.
+    """
+    variants, frontier = {word}, {word}
+    for _ in range(max_distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))} - variants
+        variants |= frontier
+    return variants
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Damerau-Levenshtein distance (optimal string alignment, so a swap of two neighbours costs 1),
+    or `max_distance + 1` as soon as it's known to exceed `max_distance`. Only the diagonal band
+    of cells that can stay within `max_distance` is computed.
+    """
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+    previous_previous, previous = None, [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            cost = a[i - 1] != b[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if cost and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = min(value, too_far)
+        if min(current) > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+class CityIndex():
+    """
+    Resolves a city name as typed by a user to a known city. Exact matches on the normalized name
+    are a dict lookup; typos are found with a symmetric delete index (SymSpell): every city is
+    indexed under the strings left by deleting up to `max_distance` characters from its name, so
+    the candidates for a query are found by looking up its own deletes, and only those few are
+    checked with a real edit distance.
+
+    Short names allow fewer typos (none under 4 characters, one under 8), so "Ada" isn't "corrected" to "Ava".
+
+    Usage:
+        city_index.resolve("winston salm")  # "Winston-Salem"
+    """
+
+    def __init__(self, names: Iterable[str], max_distance: int = 2):
+        self.max_distance = max_distance
+        # Normalized name -> the name as written in the list; the first spelling wins for duplicates
+        self.cities: Dict[str, str] = {}
+        self._deletes: Dict[str, List[str]] = {}
+        for name in names:
+            name = name.strip()
+            key = normalize_city(name)
+            if not key or key in self.cities:
+                continue
+            self.cities[key] = name
+            for variant in deletes(key, max_distance):
+                self._deletes.setdefault(variant, []).append(key)
+
+    @classmethod
+    def from_file(cls, path: str, max_distance: int = 2) -> "CityIndex":
+        start = time.perf_counter()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = cls(f, max_distance)
+        except OSError as e:
+            logger.warning("Can't read the city list %s, city names won't be corrected: %s", path, e)
+            return cls([], max_distance)
+        logger.info("Indexed %d cities from %s in %.0fms", len(index.cities), path, (time.perf_counter() - start) * 1000)
+        return index
+
+    def allowed_distance(self, key: str) -> int:
+        return min(self.max_distance, len(key) // 4)
+
+    def matches(self, name: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """
+        Known cities within the allowed edit distance of `name`, closest first, as (city, distance).
+        """
+        key = normalize_city(name)
+        if key in self.cities:
+            return [(self.cities[key], 0)]
+        max_distance = self.allowed_distance(key)
+        if not max_distance:
+            return []
+
+        candidates = set()
+        for variant in deletes(key, max_distance):
+            candidates.update(self._deletes.get(variant, ()))
+        distances = sorted((edit_distance(key, candidate, max_distance), candidate) for candidate in candidates)
+        return [(self.cities[candidate], distance) for distance, candidate in distances[:limit] if distance <= max_distance]
+
+    def resolve(self, name: str) -> Optional[str]:
+        """
+        The known city closest to `name`, or None if nothing is close enough.
+        """
+        matches = self.matches(name, limit=1)
+        return matches[0][0] if matches else None
+
+# Built once at startup and shared by the weather lookups
+city_index = CityIndex.from_file(Config.CITIES_PATH, Config.CITY_MATCH_MAX_DISTANCE)
@@ -0,0 +1,129 @@
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import Config
+
+class WaitStats():
+    """
+    Keeps a running count, total and a window of recent wait times (in seconds) so queueing delay can be reported.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": (self.total / self.count * 1000) if self.count else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class TokenBucket():
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_consume(self, tokens: float = 1) -> bool:
+        """
+        Take `tokens` from the bucket if they are available right now.
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def time_until_available(self, tokens: float = 1) -> float:
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Wait until `tokens` are available and take them. Waiters are served in FIFO order.
+        """
+        async with self._lock:
+            while not self.try_consume(tokens):
+                await asyncio.sleep(self.time_until_available(tokens))
+
+class FeatureLimits():
+    """
+    Named semaphores that cap how many calls to an expensive backend can be in flight at once,
+    e.g. at most N concurrent Stability generations or M concurrent LLM generations.
+
+    Usage:
+        async with feature_limits.limit("stability"):
+            ...
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._semaphores = {name: asyncio.Semaphore(value) for name, value in self.limits.items()}
+        self.in_flight = {name: 0 for name in self.limits}
+        self.wait_stats = {name: WaitStats() for name in self.limits}
+
+    @asynccontextmanager
+    async def limit(self, feature: str):
+        semaphore = self._semaphores.get(feature)
+        if semaphore is None:
+            raise KeyError(f"Unknown feature limit: {feature}")
+
+        start = time.perf_counter()
+        async with semaphore:
+            self.wait_stats[feature].record(time.perf_counter() - start)
+            self.in_flight[feature] += 1
+            try:
+                yield
+            finally:
+                self.in_flight[feature] -= 1
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"limit": self.limits[name], "in_flight": self.in_flight[name], **self.wait_stats[name].summary()}
+            for name in self.limits
+        }
+
+# Shared by every handler so the caps are process-wide. Each local model gets its own "llm:<name>" cap of one
+# generation, since it has a single context.
+feature_limits = FeatureLimits({
+    **{f"llm:{name}": 1 for name, spec in Config.LLM_MODELS.items() if spec.get("backend", "gpt4all") == "gpt4all"},
+    "openai": Config.MAX_CONCURRENT_OPENAI,
+    "stability": Config.MAX_CONCURRENT_STABILITY,
+    "elevenlabs": Config.MAX_CONCURRENT_ELEVENLABS,
+    "deepgram": Config.MAX_CONCURRENT_DEEPGRAM,
+})
@@ -1,18 +1,20 @@
 import aiohttp
 import json
+from classes.metrics import time_external_call
 
 class DropboxClient():
     def __init__(self):
         pass
 
-    async def dbx_files_download_async(path, dbx):
+    async def dbx_files_download_async(path, dbx, content_url="https://content.dropboxapi.com"):
         async with aiohttp.ClientSession() as session:
-            url = f"https://content.dropboxapi.com/2/files/download"
+            url = f"{content_url}/2/files/download"
             headers = {
                 "Authorization": f"Bearer {dbx._oauth2_access_token}",
                 "Dropbox-API-Arg": json.dumps({"path": path})
             }
 
-            async with session.post(url, headers=headers) as response:
-                res_data = await response.text()
-                return res_data
\ No newline at end of file
+            with time_external_call("dropbox", "download"):
+                async with session.post(url, headers=headers) as response:
+                    res_data = await response.text()
+                    return res_data
\ No newline at end of file
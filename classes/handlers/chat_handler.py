@@ -1,20 +1,46 @@
-import random
+from typing import Optional
+import numpy as np
+
+# How many times each letter is written in unstable mode, drawn uniformly from this list
+UNSTABLE_REPEATS = np.array([1, 1, 2, 3, 3])
+# Chance that a letter is upper case in unstable mode
+UNSTABLE_UPPER_PROBABILITY = 0.8
+
+unstable_rng = np.random.default_rng()
+
+def unstable_text(text: str, rng: Optional[np.random.Generator] = None) -> str:
+    """
+    Every letter of `text` written 1 to 3 times, mostly in upper case; everything else unchanged.
+
+    All the random draws are made at once. Each distinct character is looked at once, and its
+    seven possible renderings (as is, or upper or lower case written 1 to 3 times) are put in a
+    table; the output is the table entries picked by the draws, joined. Pass a seeded `rng`
+    for a reproducible result.
+    """
+    if not text:
+        return text
+    rng = rng or unstable_rng
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    distinct, positions = np.unique(codes, return_inverse=True)
+
+    # Row 0 of each character's renderings is the character itself, rows 1-3 upper case and 4-6 lower case
+    renderings = np.empty((len(distinct), 7), dtype=object)
+    is_alpha = np.zeros(len(distinct), dtype=bool)
+    for i, code in enumerate(distinct.tolist()):
+        char = chr(code)
+        is_alpha[i] = char.isalpha()
+        upper, lower = char.upper(), char.lower()
+        renderings[i] = [char, upper, upper * 2, upper * 3, lower, lower * 2, lower * 3]
+
+    repeats = UNSTABLE_REPEATS[rng.integers(0, len(UNSTABLE_REPEATS), size=len(codes))]
+    lower_case = rng.random(len(codes)) >= UNSTABLE_UPPER_PROBABILITY
+    rows = np.where(is_alpha[positions], repeats + 3 * lower_case, 0)
+    return "".join(renderings.ravel()[positions * 7 + rows].tolist())
 
 class ChatHandler():
     def __init__(self):
         pass
 
-    async def unstable_text_transform(text):
-        result = []
-        for char in text:
-            if char.isalpha():
-                repeat_count = random.choice([1, 1, 2, 3, 3])
-                random_case = random.choices([True, False], weights=[0.8, 0.2], k=1)[0]
-                if random_case:
-                    char = char.upper()
-                else:
-                    char = char.lower()
-                result.append(char * repeat_count)
-            else:
-                result.append(char)
-        return "".join(result)
\ No newline at end of file
+    @staticmethod
+    async def unstable_text_transform(text: str, rng: Optional[np.random.Generator] = None) -> str:
+        return unstable_text(text, rng)
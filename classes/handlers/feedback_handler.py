@@ -1,8 +1,11 @@
 import aiohttp
 import json
+import logging
 from config import Config
 import requests
 
+logger = logging.getLogger(__name__)
+
 class FeedbackHandler():
     def __init__(self):
         pass
@@ -10,7 +13,7 @@ class FeedbackHandler():
     async def store_feedback(user_name, feedback_text):
         try:
             # Download the existing feedback.txt file from Dropbox
-            url = "https://content.dropboxapi.com/2/files/download"
+            url = f"{Config.DROPBOX_CONTENT_URL}/2/files/download"
             headers = {
                 "Authorization": f"Bearer {Config.DROPBOX_ACCESS_TOKEN}",
                 "Dropbox-API-Arg": json.dumps({"path": "/Apps/TelegramGPT/feedback.txt"}),
@@ -29,17 +32,17 @@ class FeedbackHandler():
 
             # Upload the updated feedback.txt file to Dropbox
             headers["Dropbox-API-Arg"] = json.dumps({"path": "/Apps/TelegramGPT/feedback.txt", "mode": "overwrite"})
-            url = "https://content.dropboxapi.com/2/files/upload"
+            url = f"{Config.DROPBOX_CONTENT_URL}/2/files/upload"
 
             async with aiohttp.ClientSession() as session:
                 async with session.post(url, headers=headers, data=feedback.encode("utf-8")) as response:
                     if response.status != 200:
-                        print(f"Error uploading feedback.txt. Status: {response.status}, Message: {await response.text()}")
+                        logger.error("Error uploading feedback.txt. Status: %s, Message: %s", response.status, await response.text())
                     else:
-                        print("Feedback successfully uploaded.")
-        except requests.exceptions.HTTPError as e:
-            print(f"HTTP error occurred: {e}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error uploading feedback.txt: {e}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+                        logger.info("Feedback successfully uploaded.")
+        except requests.exceptions.HTTPError:
+            logger.exception("HTTP error occurred")
+        except requests.exceptions.RequestException:
+            logger.exception("Error uploading feedback.txt")
+        except Exception:
+            logger.exception("An error occurred while storing feedback")
@@ -1,16 +1,38 @@
+import io
 import os
+import re
 import base64
+import logging
 import aiohttp
 from PIL import Image
 from scripts.helper_functions import send_chat_action_async, escape_markdown_v2_text
+from classes.concurrency import feature_limits
+from classes.tracing import tracer
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+OUT_DIR = './out'
+# Callback data of the enlarge buttons: image_<chat id>_<message id>_<image number>
+IMAGE_CALLBACK = re.compile(r"image_(-?\d+)_(\d+)_([1-4])")
+
 class ImageHandler():
     def __init__(self):
         pass
 
+    @staticmethod
+    def image_file(callback_data: str, chat_id: int):
+        """
+        The generated image an enlarge button points to, or None if the button doesn't belong to `chat_id`.
+        Each /image request keeps its images in a directory of its own, named after its progress message.
+        """
+        match = IMAGE_CALLBACK.fullmatch(callback_data or "")
+        if not match or int(match.group(1)) != chat_id:
+            return None
+        return f'{OUT_DIR}/{match.group(1)}_{match.group(2)}/v1_txt2img_{match.group(3)}.png'
+
     async def generate_image(prompt, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:       
         try:
             user_id = update.effective_user.id
@@ -22,22 +44,19 @@ class ImageHandler():
             
             prompt = " ".join(update.message.text.split()[1:]).capitalize()
 
-            print(f"{user_name} (ID: {user_id}): /image {prompt}")
+            logger.info("%s (ID: %s): /image %s", user_name, user_id, prompt)
 
             if not prompt:
                 await update.message.reply_text("Please provide a description after the /image command.")
                 return
             
-            # Debug
-            print("Calling Stability AI API")
-
             # Call Stability AI API to generate an image
             api_key = Config.STABILITY_API_KEY
 
             if api_key is None:
                 raise Exception('Missing Stability AI API key')
             
-            url = "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
+            url = f"{Config.STABILITY_API_URL}/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
 
             body = {
                 "width": 1024,
@@ -61,9 +80,6 @@ class ImageHandler():
                 'Authorization': f'Bearer {Config.STABILITY_API_KEY}'
             }
             
-            # Debug
-            print("Response received from Stability AI API")
-            
             # List of generated images
             images = []
 
@@ -73,10 +89,14 @@ class ImageHandler():
                 text="Generating image x of 4",
             )
 
+            # Concurrent requests each get their own directory, keyed by the progress message
+            request_key = f"{update.effective_chat.id}_{initial_message.message_id}"
+            request_dir = f'{OUT_DIR}/{request_key}'
+            os.makedirs(request_dir, exist_ok=True)
+
             # for each image we want to generate
             for i in range(1, 5):
-                # Debug
-                print(f'Generating image')
+                logger.debug("Generating image %s of 4", i)
 
                 # Send a message to the user indicating the progress
                 await context.bot.edit_message_text(
@@ -85,52 +105,50 @@ class ImageHandler():
                     text=f"Generating image {i} of 4",
                 )
 
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=body) as response:
-                        if response.status != 200:
-                            raise Exception(f'Non-200 response: {await response.text()}')
-                        
-                        data = await response.json()
-
-                # Ensure the 'out' directory exists and create it if it doesn't
-                out_dir = './out'
-                if not os.path.exists(out_dir):
-                    os.makedirs(out_dir)
-
-                # Write the generated image to a file
-                with open(f'./out/v1_txt2img_{i}.png', 'wb') as f:
-                    f.write(base64.b64decode(data['artifacts'][0]['base64']))
-                
+                async with feature_limits.limit("stability"), tracer.span("stability.generate", image=i):
+                    async with aiohttp.ClientSession() as session:
+                        async with session.post(url, headers=headers, json=body) as response:
+                            if response.status != 200:
+                                raise Exception(f'Non-200 response: {await response.text()}')
+                            
+                            data = await response.json()
+
+                # Keep the image for the enlarge buttons
+                image_data = base64.b64decode(data['artifacts'][0]['base64'])
+                with open(f'{request_dir}/v1_txt2img_{i}.png', 'wb') as f:
+                    f.write(image_data)
+
                 # Add the generated image to the list of generated images
-                with open(f'./out/v1_txt2img_{i}.png', 'wb') as f:
-                    f.write(base64.b64decode(data['artifacts'][0]['base64']))
-                img = Image.open(f'./out/v1_txt2img_{i}.png')
+                img = Image.open(io.BytesIO(image_data))
                 images.append(img)
 
             keyboard = [
-                [InlineKeyboardButton("1️⃣", callback_data='image_1'), InlineKeyboardButton("2️⃣", callback_data='image_2')],
-                [InlineKeyboardButton("3️⃣", callback_data='image_3'), InlineKeyboardButton("4️⃣", callback_data='image_4')]
+                [InlineKeyboardButton("1️⃣", callback_data=f'image_{request_key}_1'), InlineKeyboardButton("2️⃣", callback_data=f'image_{request_key}_2')],
+                [InlineKeyboardButton("3️⃣", callback_data=f'image_{request_key}_3'), InlineKeyboardButton("4️⃣", callback_data=f'image_{request_key}_4')]
             ]
 
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            # Create a new PIL image with the generated images
-            composite = Image.new('RGB', (images[0].width * 2, images[0].height * 2))
+            with tracer.span("image.composite"):
+                # Create a new PIL image with the generated images
+                composite = Image.new('RGB', (images[0].width * 2, images[0].height * 2))
 
-            # Paste each image into the composite image
-            composite.paste(images[0], (0, 0))
-            composite.paste(images[1], (images[0].width, 0))
-            composite.paste(images[2], (0, images[0].height))
-            composite.paste(images[3], (images[0].width, images[0].height))
+                # Paste each image into the composite image
+                composite.paste(images[0], (0, 0))
+                composite.paste(images[1], (images[0].width, 0))
+                composite.paste(images[2], (0, images[0].height))
+                composite.paste(images[3], (images[0].width, images[0].height))
 
-            # Save the composite image
-            composite.save(f'{out_dir}/composite.png')
+                # Encode the composite image in memory
+                img_file = io.BytesIO()
+                composite.save(img_file, format='PNG')
+                img_file.seek(0)
 
             escaped_prompt = escape_markdown_v2_text(prompt)
 
             # Send the composite image as a photo
-            with open(f"{out_dir}/composite.png", "rb") as img_file:
-                await send_chat_action_async(update, 'upload_photo')
+            await send_chat_action_async(update, 'upload_photo')
+            async with tracer.span("telegram.upload"):
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
                     photo=img_file,
@@ -138,13 +156,12 @@ class ImageHandler():
                     parse_mode='MarkdownV2',
                     reply_markup=reply_markup
                 )
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=initial_message.message_id,
-                )
+            await context.bot.delete_message(
+                chat_id=update.effective_chat.id,
+                message_id=initial_message.message_id,
+            )
 
-            print(f'Image generated and sent to {user_name} (ID: {user_id}) with prompt: {prompt}')
-        except Exception as e:
-            error_message = f"An error occurred: {str(e)}"
-            print(error_message)
+            logger.info("Image generated and sent to %s (ID: %s) with prompt: %s", user_name, user_id, prompt)
+        except Exception:
+            logger.exception("An error occurred in generate_image")
             await update.message.reply_text("Oops! Something went wrong. Please try again later.")
\ No newline at end of file
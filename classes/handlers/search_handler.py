@@ -1,17 +1,20 @@
-import traceback
 import asyncio
-import requests
 import logging
 import aiohttp
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 from config import Config
 import tiktoken
 from telegram import Update
 from telegram.ext import ContextTypes
 from classes.chat_gpt import ChatGPT
-from scripts.helper_functions import send_chat_action_async
+from classes.host_stats import host_stats
+from classes.page_cache import page_cache
+from classes.passage_ranker import select_passages
+from scripts.helper_functions import send_chat_action_async, stream_long_message
+from classes.tracing import tracer
+from classes.metrics import SEARCH_PAGES
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 class SearchHandler():
     def __init__(self):
@@ -23,6 +26,7 @@ class SearchHandler():
         tokens = enc.encode(text)
         return len(tokens)
 
+    @tracer.trace("bing.search")
     async def bing_search(self, query, subscription_key):
         """
         Perform a Bing search using the given query and subscription key.
@@ -42,10 +46,12 @@ class SearchHandler():
 
         """
         try:
-            search_url = f'https://api.bing.microsoft.com/v7.0/search?q={query}'
+            # The query is sent as a URL parameter, so "&" or "#" in it don't cut it short
             headers = {'Ocp-Apim-Subscription-Key': subscription_key}
-            response = requests.get(search_url, headers=headers)
-            data = response.json()
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'{Config.BING_API_URL}/v7.0/search', params={"q": query}, headers=headers,
+                                       timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    data = await response.json(content_type=None)
             search_results = []
 
             if 'webPages' in data:
@@ -56,108 +62,103 @@ class SearchHandler():
                         "snippet": result['snippet']
                     })
             return search_results
-        except Exception as e:
-            print(f"Error during search: {e}")
+        except Exception:
+            logger.exception("Error during search")
             return []
 
     async def fetch_url_content(self, url: str) -> str:
-        try:
-            async with aiohttp.ClientSession() as session:
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                timeout = aiohttp.ClientTimeout(total=10)
-                async with session.get(url, headers=headers, timeout=timeout) as response:
-                    if response.status == 200:
-                        html_content = await response.text()
-                        soup = BeautifulSoup(html_content, 'html.parser')
-
-                        # Remove unnecessary elements, such as scripts and styles
-                        for script in soup(["script", "style"]):
-                            script.decompose()
-
-                        # Extract the text from the cleaned HTML
-                        content = soup.get_text(separator="\n")
-
-                        return content
-                    else:
-                        return ""
-        except Exception as e:
-            print(f"ERROR: /classes/handlers/search_handler.py/`SearchHandler().fetch_url_content`: Error fetching URL content from {url}. Status: {response.status}, Reason: {response.reason}")
-            return ""
+        # Pages are cached as text and revalidated once stale, so popular pages aren't downloaded and parsed for every search
+        return await page_cache.get(url)
+
+    async def fetch_pages(self, search_results, wanted: int, spares: int, budget: float):
+        """
+        Fetch the pages of the top `wanted` search results plus `spares` all at once, and keep the first
+        `wanted` that arrive with any text within `budget` seconds. The rest are cancelled, so one
+        slow site can't hold up the answer. Results on persistently slow or failing hosts are tried last.
+
+        Returns:
+            list: (result, page text) pairs, in the search results' order.
+        """
+        candidates = host_stats.rank(list(enumerate(search_results)), lambda item: urlparse(item[1]["link"]).netloc)[:wanted + spares]
+        tasks = {asyncio.ensure_future(self.fetch_url_content(result["link"])): (rank, result) for rank, result in candidates}
+        pages = []
+        pending = set(tasks)
+        deadline = asyncio.get_running_loop().time() + budget
+        while pending and len(pages) < wanted:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - asyncio.get_running_loop().time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                text = task.result()
+                SEARCH_PAGES.inc(result="used" if text.strip() else "empty")
+                if text.strip():
+                    pages.append((*tasks[task], text))
+
+        for task in pending:
+            task.cancel()
+            SEARCH_PAGES.inc(result="cancelled")
+        if pending:
+            logger.debug("Gave up on %d slow search result pages", len(pending))
+        # More than `wanted` can finish at the same moment
+        return [(result, text) for _, result, text in sorted(pages, key=lambda page: page[0])[:wanted]]
 
     async def handle_search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query: str) -> None:
         user_id = update.message.from_user.id        
         search_results = await self.bing_search(query, Config.BING_API_KEY)
-        MAX_RESULTS = 3  # Fetch content of top 3 search results
-        MAX_TOKENS = 11000
 
-        print(f"\n\nQuery: {query}")
-        print(f"\n\nSearch results: {search_results}")
+        logger.info("Search query: %s (%d results)", query, len(search_results))
 
         try:
             if search_results:
-                content_list = []
-                total_token_count = 0
-
-                # Limit our loop to the top MAX_RESULTS results
-                for idx, result in enumerate(search_results[:MAX_RESULTS]):
-                    url_content = await self.fetch_url_content(result["link"])
-                    token_count = SearchHandler.count_tokens(url_content)
-                    
+                # The first pages of the top results to arrive; slow sites are skipped for spare results
+                pages = await self.fetch_pages(search_results, Config.SEARCH_PAGES, Config.SEARCH_SPARE_PAGES, Config.SEARCH_FETCH_BUDGET)
+                for idx, (result, _) in enumerate(pages):
                     # Log the Bing result for debugging or analysis
-                    logging.info(f"Result {idx + 1}: Title: {result['title']}, Link: {result['link']}")
-
-                    if total_token_count + token_count <= 16385:
-                        content_list.append(url_content)
-                        total_token_count += token_count
-                    else:
-                        break
+                    logger.debug("Result %d: Title: %s, Link: %s", idx + 1, result['title'], result['link'])
 
-                combined_content = "\n\n".join(content_list)
-                print(f"\n\nCombined content: {combined_content}")
+                # Nothing arrived in time: the search snippets are better than nothing
+                documents = [text for _, text in pages] or [f"{result['title']}\n{result['snippet']}" for result in search_results]
 
-                if self.count_tokens(combined_content) > MAX_TOKENS:
-                    trimmed_content = ""
-                    for content in content_list:
-                        if self.count_tokens(trimmed_content + content) <= MAX_TOKENS:
-                            trimmed_content += content + "\n\n"
-                    combined_content = trimmed_content
+                # Only the passages most relevant to the query go in the prompt, not whole pages
+                async with tracer.span("search.rank", pages=len(documents)) as span:
+                    passages = await asyncio.to_thread(
+                        select_passages, query, documents, Config.SEARCH_CONTEXT_TOKENS, SearchHandler.count_tokens, Config.SEARCH_PASSAGE_WORDS
+                    )
+                    span.set_attribute("passages", len(passages))
+                combined_content = "\n\n".join(f"[{passage['document'] + 1}] {passage['text']}" for passage in passages)
 
-                print(f"\n\nCombined content after trimming: {combined_content}")
+                logger.debug("Selected passages: %s", combined_content)
 
                 # Clear the conversation history for the user
                 if 'messages' in context.user_data and user_id in context.user_data['messages']:
                     context.user_data['messages'][user_id] = []
 
                 # User-friendly prompt to guide GPT
-                gpt_prompt = f"Tell me about '{query}'. Respond in a way that is easy to understand and that flows naturally. It should feel like a human is responding. Do not use bullet points or numbered lists. Respond only in paragraph form."
-                print(f"\n\nPrompt: {gpt_prompt}")
+                gpt_prompt = f"Tell me about '{query}'. Respond in a way that is easy to understand and that flows naturally. It should feel like a human is responding. Do not use bullet points or numbered lists. Respond only in paragraph form. Answer from the search results below without calling any functions."
+                logger.debug("Prompt: %s", gpt_prompt)
 
                 # Send "Thinking..." and store the message_id
                 await send_chat_action_async(update, 'typing')
                 thinking_message = await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Searching for {query}...")
                 thinking_message_id = thinking_message.message_id
 
-                # Pass the combined content and prompt to ChatGPT and generate a response
+                # Stream the answer into the "Searching..." message as it's generated, with the sources it was given after it
                 chat_gpt = ChatGPT()
-                chat_gpt_response = await chat_gpt.get_chat_gpt_response(gpt_prompt + "\n\n" + combined_content, user_id, context)
-
-                formatted_response = chat_gpt_response["choices"][0]["message"]["content"]
-                print(f"\n\nResponse: {formatted_response}")
-
-                try:
-                    # Try to edit the "Thinking..." message
-                    await send_chat_action_async(update, 'typing')
-                    await asyncio.sleep(1)
-                    await context.bot.edit_message_text(chat_id=update.effective_chat.id, 
-                                                        message_id=thinking_message_id, 
-                                                        text=formatted_response)
-                    print("\n\nSuccessfully edited message.")
-                except Exception as e:
-                    # If an exception occurs, print it to the console
-                    print(f"Failed to edit message: {e}")
+                sources = [result for result, _ in pages] or search_results
+                cited = sorted({passage["document"] for passage in passages})
+                sources_text = "\n\nSources:\n" + "\n".join(f"[{index + 1}] {sources[index]['title']}: {sources[index]['link']}" for index in cited) if cited else ""
+                response = await stream_long_message(
+                    context.bot, update.effective_chat.id,
+                    chat_gpt.stream_chat_gpt_response(gpt_prompt + "\n\n" + combined_content, user_id, context, chat_type=update.effective_chat.type, command="search"),
+                    thinking_message_id, interval=Config.SEARCH_STREAM_INTERVAL, suffix=sources_text
+                )
+                logger.debug("Response: %s", response)
+                # None if generating it failed, and the message already says so
+                if response == "":
+                    await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=thinking_message_id,
+                                                        text="Sorry, I couldn't come up with an answer. Please try again.")
             else:
                 await update.message.reply_text("Sorry, I couldn't find any results for your query.")
         except Exception as e:
-            error_details = traceback.format_exc()
-            logging.error(f"ERROR: /classes/handlers/search_handler.py/`SearchHandler().handle_search_command`: {e}\n{error_details}")
+            logger.exception("Error while handling search command: %s", e)
             await update.message.reply_text("Sorry, an error occurred while processing your request.")
\ No newline at end of file
@@ -2,6 +2,7 @@ import requests
 import aiohttp
 import asyncio
 import io
+import logging
 import tempfile
 import speech_recognition as sr
 from telegram import Update
@@ -11,11 +12,15 @@ from classes.chat_gpt import ChatGPT
 from io import BytesIO
 from deepgram import Deepgram
 from scripts.helper_functions import send_chat_action_async
+from classes.concurrency import feature_limits
+from classes.tracing import tracer
 from typing import List, Dict, Tuple, Union
 from config import Config
 
+logger = logging.getLogger(__name__)
+
 # Initialize Deepgram client on startup
-deepgram = Deepgram(Config.DEEPGRAM_API_KEY)
+deepgram = Deepgram({'api_key': Config.DEEPGRAM_API_KEY, 'api_url': Config.DEEPGRAM_API_URL})
 
 class VoiceHandler():
     """
@@ -48,7 +53,7 @@ class VoiceHandler():
             A tuple containing the list of available voices and an error message, if applicable.
         """
         async with aiohttp.ClientSession() as session:
-            url = "https://api.elevenlabs.io/v1/voices"
+            url = f"{Config.ELEVENLABS_API_URL}/v1/voices"
 
             async with session.get(url) as response:
                 if response.status == 200:
@@ -73,7 +78,7 @@ class VoiceHandler():
         """
         voice_list, error = await self.fetch_voice_list()
         if error:
-            print(error)
+            logger.error(error)
         return any(voice["name"].lower() == voice_name.lower() for voice in voice_list)
 
     async def handle_voice_api_request(method: str, url: str, **kwargs) -> Union[bytes, None]:
@@ -141,11 +146,8 @@ class VoiceHandler():
         str
             The text content of the ChatGPT response.
         """
-        # Pass context to the function call
-        response_data = await ChatGPT.get_chat_gpt_response(text, user_id, context)
-
-        # Return chat GPT response
-        return response_data['choices'][0]['message']['content']
+        # Pass context to the function call; the router picks the model from the transcribed text
+        return await ChatGPT().get_chat_gpt_response(text, user_id, context)
 
     async def voice_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
@@ -159,7 +161,7 @@ class VoiceHandler():
         context : ContextTypes.DEFAULT_TYPE
             Additional context.
         """
-        print("Voice message received.")
+        logger.info("Voice message received.")
         user_name = update.effective_user.full_name
         try:
             voice_message = update.message.voice
@@ -173,12 +175,12 @@ class VoiceHandler():
             # Pass context to the chat_gpt_voice function
             chat_gpt_response = await self.chat_gpt_voice(text, user_id, context)
 
-            print(f"ChatGPT response: {chat_gpt_response}")
+            logger.debug("ChatGPT response: %s", chat_gpt_response)
 
             # Retrieve the user's selected voice and mode
             user_id = update.effective_user.id
             voice_id = self.selected_voices.get(user_id, "7kRUX4UzUC1zcoeqNF4s")  # default voice if none selected
-            print(f"[Debug] voice_message_handler: Voice ID selected for user {user_name} ({user_id}) is {voice_id}")
+            logger.debug("voice_message_handler: Voice ID selected for user %s (%s) is %s", user_name, user_id, voice_id)
             mode = self.modes.get(user_id, "stable")  # default mode if none selected
 
             # Generate the voice message for the GPT response
@@ -187,18 +189,18 @@ class VoiceHandler():
             if voice_message:
                 with BytesIO(voice_message) as voice_io:
                     await send_chat_action_async(update, 'record_audio')
-                    await update.message.reply_voice(voice=voice_io)
-                    print("Voice message sent.")
+                    async with tracer.span("telegram.upload", bytes=len(voice_message)):
+                        await update.message.reply_voice(voice=voice_io)
+                    logger.debug("Voice message sent.")
             else:
                 await send_chat_action_async(update, 'typing')
-                await asyncio.sleep(0.5)
                 await update.message.reply_text(error_message)
-        except Exception as e:
-            print(f"An error occurred in voice_message_handler: {e}")
+        except Exception:
+            logger.exception("An error occurred in voice_message_handler")
             await send_chat_action_async(update, 'typing')
-            await asyncio.sleep(0.5)
             await update.message.reply_text("An error occurred while processing the voice message. Please try again later.")
 
+    @tracer.trace("elevenlabs.tts")
     async def generate_voice_message(self, text, voice_id, api_key, mode=None, language='en'):
         """
         Generate a voice message based on given text input.
@@ -236,7 +238,7 @@ class VoiceHandler():
             model_id = 'eleven_multilingual_v1'
 
             async with aiohttp.ClientSession() as session:
-                url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+                url = f"{Config.ELEVENLABS_API_URL}/v1/text-to-speech/{voice_id}"
                 headers = {
                     "Accept": "audio/mpeg",
                     "Content-Type": "application/json",
@@ -251,32 +253,23 @@ class VoiceHandler():
                     },
                 }
             
-                # print(f"Debug Info:")
-                # print(f"  Voice ID: {voice_id}")
-                # print(f"  Text: {text}")
-                # print(f"  Mode: {mode}")
-                # print(f"  Stability: {stability}")
-                # print(f"  Similarity Boost: {similarity_boost}")
-
-                # print(f"Generating voice message for text: {text}")  # Debug line
-                async with session.post(url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        voice_message = await response.read()
-                        return voice_message, None
-                    else:
-                        error_message = f"Error generating voice message: {response.status}"
-                        print(error_message)
-
-                        # Print the response body for debugging
-                        error_body = await response.text()
-                        print(f"Error body: {error_body}")
-
-                        return None, error_message
-        except Exception as e:
-            error_message = f"An error occurred while generating the voice message: {e}"
-            print(error_message)
-            return None, error_message
-
+                logger.debug("Generating voice message with voice %s, mode %s for text: %s", voice_id, mode, text)
+                async with feature_limits.limit("elevenlabs"):
+                    async with session.post(url, headers=headers, json=data) as response:
+                        if response.status == 200:
+                            voice_message = await response.read()
+                            return voice_message, None
+                        else:
+                            error_message = f"Error generating voice message: {response.status}"
+                            error_body = await response.text()
+                            logger.error("%s, body: %s", error_message, error_body)
+
+                            return None, error_message
+        except Exception:
+            logger.exception("An error occurred while generating the voice message")
+            return None, "An error occurred while generating the voice message."
+
+    @tracer.trace("telegram.download")
     async def download_voice_message_bytes(self, voice_message, bot):
         """
         Download the voice message and return it as bytes.
@@ -297,12 +290,12 @@ class VoiceHandler():
             file = await bot.getFile(voice_message.file_id)
             audio_data = await file.download_as_bytearray()
             return audio_data
-        except requests.exceptions.HTTPError as e:
-            print(f"HTTP error occurred: {e}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error downloading voice message: {e}")
-        except Exception as e:
-            print(f"An error occurred: {e}")
+        except requests.exceptions.HTTPError:
+            logger.exception("HTTP error occurred")
+        except requests.exceptions.RequestException:
+            logger.exception("Error downloading voice message")
+        except Exception:
+            logger.exception("An error occurred while downloading the voice message")
 
     async def audio_data_from_voice_bytes(self, bot, voice_message):
         """
@@ -323,20 +316,21 @@ class VoiceHandler():
         try:
             audio_bytes = await self.download_voice_message_bytes(voice_message, bot)
 
-            # Convert audio to WAV format using PyDub
-            audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="ogg")
-            wav_audio_bytes = io.BytesIO()
-            audio_segment.export(wav_audio_bytes, format="wav")
-            wav_audio_bytes.seek(0)
+            with tracer.span("audio.convert", bytes=len(audio_bytes)):
+                # Convert audio to WAV format using PyDub
+                audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="ogg")
+                wav_audio_bytes = io.BytesIO()
+                audio_segment.export(wav_audio_bytes, format="wav")
+                wav_audio_bytes.seek(0)
 
-            # Using SpeechRecognition, recognize the audio and get the text
-            with sr.AudioFile(wav_audio_bytes) as audio_source:
-                recognizer = sr.Recognizer()
-                audio_data = recognizer.record(audio_source)
+                # Using SpeechRecognition, recognize the audio and get the text
+                with sr.AudioFile(wav_audio_bytes) as audio_source:
+                    recognizer = sr.Recognizer()
+                    audio_data = recognizer.record(audio_source)
 
             return audio_data
-        except Exception as e:
-            print(f"An error occurred while converting voice to text: {e}")
+        except Exception:
+            logger.exception("An error occurred while converting voice to text")
             return None
 
     async def convert_voice_to_text(self, voice_message, bot) -> str:
@@ -367,27 +361,22 @@ class VoiceHandler():
 
                 # Open the temporary file and transcribe it using Deepgram asynchronously
                 with open(temp_audio_file.name, 'rb') as audio_file:
-                    # print(f"Sending {len(wav_audio_bytes)} bytes of WAV data for transcription")
                     source = {'buffer': audio_file, 'mimetype': 'audio/wav'}
-                    response = await asyncio.create_task(
-                        deepgram.transcription.prerecorded(
+                    async with feature_limits.limit("deepgram"), tracer.span("deepgram.transcribe", bytes=len(wav_audio_bytes)):
+                        response = await deepgram.transcription.prerecorded(
                             source,
                             {'smart_format': True,
                             'model': 'nova',
                             }
                         )
-                    )
-
-            # print(f"Deepgram response: {response}")
 
             text = response.get('results', {}).get('channels', [{}])[0].get('alternatives', [{}])[0].get('transcript', '').strip()
 
-            print(f"Transcribed text: {text}")
+            logger.debug("Transcribed text: %s", text)
 
             return text
-        except Exception as e:
-            error_message = f"An error occurred: {str(e)}"
-            print(error_message)
+        except Exception:
+            logger.exception("An error occurred while transcribing the voice message")
             return ""
         
     async def handle_v_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_gpt_response: str) -> None:
@@ -403,5 +392,4 @@ class VoiceHandler():
                 await update.message.reply_voice(voice=voice_io)
         else:
             await send_chat_action_async(update, 'typing')
-            await asyncio.sleep(0.5)
             await update.message.reply_text("Sorry, there was a problem generating the voice message.")
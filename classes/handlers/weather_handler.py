@@ -1,31 +1,51 @@
-import requests
-from config import Config
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from classes.city_index import city_index
+from classes.weather_service import weather_service
+from scripts.helper_functions import send_chat_action_async
+
+logger = logging.getLogger(__name__)
 
 class WeatherHandler():
     def __init__(self):
-        pass
+        # Shared index of known cities and weather caches, built once at startup
+        self.city_index = city_index
+        self.weather_service = weather_service
 
-    def get_current_weather(location):
+    async def get_current_weather(self, location):
         """
-        Get the current weather for a given location.
+        Get the current weather for a given location. A misspelled US city is corrected if the geocoder doesn't know it.
 
         Args:
             location (str): The location for which to retrieve the weather.
 
         Returns:
-            dict: A dictionary containing the weather description and temperature.
+            dict: A dictionary containing the weather description and temperature in Celsius.
 
         Example:
-            >>> get_current_weather("London")
+            >>> await WeatherHandler().get_current_weather("London")
             {'description': 'clear sky', 'temperature': 17.0}
         """
-        api_key = Config.WEATHER_API_KEY
-        base_url = f"http://api.openweathermap.org/data/2.5/weather?q={location}&appid={api_key}"
-        response = requests.get(base_url)
-        data = response.json()
-        if data.get("message"):
-            return {"error": data['message']}
-        else:
-            description = data["weather"][0]["description"]
-            temp = round(data["main"]["temp"] - 273.15, 2) # Convert Kelvin to Celsius
-            return {"description": description, "temperature": temp}
\ No newline at end of file
+        report = await self.weather_service.current(location)
+        if report is None:
+            return {"error": f"Unknown city: {location}"}
+        return {"description": report["description"], "temperature": report["temperature"]}
+
+    async def handle_weather_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, location: str) -> None:
+        if not location:
+            await update.message.reply_text("Type a city after the /weather command. For example: /weather Pittsburgh")
+            return
+
+        await send_chat_action_async(update, 'typing')
+        try:
+            report = await self.weather_service.current(location)
+        except Exception:
+            logger.exception("Error fetching the weather for %s", location)
+            await update.message.reply_text("Sorry, I couldn't get the weather right now. Please try again later.")
+            return
+
+        if report is None:
+            await update.message.reply_text(f"Sorry, I couldn't find a city called {location}.")
+            return
+        await update.message.reply_text(self.weather_service.describe(report))
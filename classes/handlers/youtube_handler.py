@@ -1,11 +1,15 @@
-from urllib.parse import urlparse
-from youtube_transcript_api import YouTubeTranscriptApi
+import logging
+from urllib.parse import urlparse, parse_qs
+from classes.transcript_service import transcript_service
+
+logger = logging.getLogger(__name__)
 
 class YouTubeHandler():
     def __init__(self):
         pass
 
-    async def convert_to_desktop_link(url):
+    @staticmethod
+    def convert_to_desktop_link(url):
         """
         Converts a YouTube mobile link to a desktop link.
 
@@ -26,13 +30,30 @@ class YouTubeHandler():
                 return f"https://www.youtube.com/watch?v={video_id}"
             else:
                 return url  # return the url as is if it's not a mobile link
-        except Exception as e:
-            print(f"An error occurred while converting the link: {e}")
+        except Exception:
+            logger.exception("An error occurred while converting the link")
             return None
 
+    @staticmethod
+    def get_video_id(url):
+        """
+        Extracts the video ID from a YouTube link.
+
+        Args:
+            url (str): A desktop or mobile YouTube link.
+
+        Returns:
+            str: The video ID, or None if the link has none.
+        """
+        parsed_url = urlparse(url or "")
+        if parsed_url.netloc == "youtu.be":
+            return parsed_url.path[1:] or None
+        return parse_qs(parsed_url.query).get("v", [None])[0]
+
+    @staticmethod
     async def get_caption_text(video_id):
         """
-        Retrieves the caption text for a YouTube video.
+        Retrieves the caption text for a YouTube video. Captions are fetched once per video and cached.
 
         Args:
             video_id (str): The ID of the YouTube video.
@@ -40,18 +61,5 @@ class YouTubeHandler():
         Returns:
             str: The caption text of the video, or None if an error occurred.
         """
-        try:
-            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-            transcript = transcript_list.find_generated_transcript(language_codes=['en'])
-            
-            if transcript:
-                caption_text = ""
-                for line in transcript.fetch():
-                    caption_text += line["text"] + " "
-                
-                return caption_text
-            
-            return None
-        except Exception as e:
-            print(f"An error occurred while getting the caption text: {e}")
-            return None
\ No newline at end of file
+        transcript = await transcript_service.get(video_id)
+        return transcript_service.text(transcript) if transcript else None
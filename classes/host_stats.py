@@ -0,0 +1,71 @@
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Sequence, TypeVar
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class HostStats():
+    """
+    Moving averages of how long pages on each host take to fetch and how often they fail, so
+    persistently slow or failing sites can be tried last. Recent fetches count the most
+    (exponentially weighted, `alpha` per fetch), so a site that speeds up recovers.
+
+    A host is demoted once it has `min_samples` fetches and takes over `slow_seconds` on
+    average or fails more than `max_failure_rate` of the time.
+
+    Usage:
+        host_stats.record("example.com", 0.4, ok=True)
+        results = host_stats.rank(results, lambda result: urlparse(result["link"]).netloc)
+    """
+
+    def __init__(self, slow_seconds: float, max_failure_rate: float, alpha: float = 0.3, min_samples: int = 3, max_hosts: int = 2000):
+        self.slow_seconds = slow_seconds
+        self.max_failure_rate = max_failure_rate
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_hosts = max_hosts
+        # host -> {"latency", "failure_rate", "samples"}, least recently fetched first
+        self._hosts: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def record(self, host: str, seconds: float, ok: bool) -> None:
+        """
+        Record a fetch from `host` that took `seconds`. A fetch cancelled for being too slow counts
+        as `ok` with the time it had taken so far, which is a lower bound on its latency.
+        """
+        stats = self._hosts.pop(host, None)
+        was_demoted = stats is not None and self._is_demoted(stats)
+        if stats is None:
+            stats = {"latency": seconds, "failure_rate": 0.0 if ok else 1.0, "samples": 0}
+        else:
+            stats["latency"] += self.alpha * (seconds - stats["latency"])
+            stats["failure_rate"] += self.alpha * ((0.0 if ok else 1.0) - stats["failure_rate"])
+        stats["samples"] += 1
+        self._hosts[host] = stats
+        while len(self._hosts) > self.max_hosts:
+            self._hosts.popitem(last=False)
+
+        if self._is_demoted(stats) != was_demoted:
+            logger.info("%s search result pages from %s (%.1fs on average, %.0f%% failed)",
+                        "Deprioritizing" if not was_demoted else "No longer deprioritizing",
+                        host, stats["latency"], stats["failure_rate"] * 100)
+
+    def _is_demoted(self, stats: Dict) -> bool:
+        return stats["samples"] >= self.min_samples and (
+            stats["latency"] > self.slow_seconds or stats["failure_rate"] > self.max_failure_rate
+        )
+
+    def is_demoted(self, host: str) -> bool:
+        stats = self._hosts.get(host)
+        return stats is not None and self._is_demoted(stats)
+
+    def rank(self, items: Sequence[T], host: Callable[[T], str]) -> List[T]:
+        """
+        `items` with those on demoted hosts moved to the end, otherwise in their own order.
+        """
+        return sorted(items, key=lambda item: self.is_demoted(host(item)))
+
+# Shared by the page cache, which records every fetch, and the search handler, which ranks results with it
+host_stats = HostStats(Config.SEARCH_SLOW_HOST_SECONDS, Config.SEARCH_HOST_MAX_FAILURE_RATE)
@@ -0,0 +1,344 @@
+import os
+import sys
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Deliberately free of `config` imports: `auth` and `classes.dropbox` are imported while `Config`
+# is still being built and need to record metrics too.
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+class Metric():
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        """
+        Sum over all label combinations.
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def set_total(self, value: float, **labels) -> None:
+        """
+        Set the counter to a running total kept elsewhere (e.g. in a component's stats dict).
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, {"counts": list(state["counts"]), "sum": state["sum"], "count": state["count"]}) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': '+Inf'})} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+class MetricsRegistry():
+    """
+    Minimal Prometheus-style registry. Collectors are callbacks run on every scrape to refresh
+    gauges that mirror state owned by other components (queue depths, in-flight calls, memory).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", getattr(collector, "__name__", collector), e)
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+UPDATES_TOTAL = registry.counter("bot_updates_total", "Updates processed, by kind.", ("kind",))
+UPDATE_DURATION = registry.histogram("bot_update_duration_seconds", "Time from an update starting to finishing, by kind.", ("kind",))
+UPDATE_QUEUE_WAIT = registry.histogram("bot_update_queue_wait_seconds", "Time an update waited before it started processing.")
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "Exceptions raised by handlers, by exception type.", ("error",))
+COMMANDS_TOTAL = registry.counter("bot_commands_total", "Commands received, by command.", ("command",))
+EXTERNAL_CALL_DURATION = registry.histogram("bot_external_call_duration_seconds", "Latency of calls to external services.", ("service", "operation", "status"))
+LLM_REQUESTS = registry.counter("bot_llm_requests_total", "LLM requests, by the route that matched and the model it picked.", ("route", "model"))
+LLM_COMPLETION_TOKENS = registry.counter("bot_llm_completion_tokens_total", "Tokens generated by local models.", ("model",))
+LLM_DECODE_SPEED = registry.histogram("bot_llm_decode_tokens_per_second", "Decode speed of local model generations.", ("model",), buckets=(1, 2, 4, 6, 8, 12, 16, 24, 32, 64, 128, 256))
+LLM_TIME_TO_FIRST_TOKEN = registry.histogram("bot_llm_time_to_first_token_seconds", "Prompt evaluation time of local model generations.", ("model",))
+LLM_DRAFT_TOKENS = registry.counter("bot_llm_draft_tokens_total", "Draft tokens proposed in speculative decoding, by whether the model accepted them.", ("model", "result"))
+LLM_DRAFT_ACCEPTANCE = registry.histogram("bot_llm_draft_acceptance_ratio", "Share of draft tokens accepted per speculative generation.", ("model",), buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+LLM_DRAFT_FALLBACK_TOKENS = registry.counter("bot_llm_draft_fallback_tokens_total", "Tokens decoded without drafting while the acceptance rate was too low.", ("model",))
+CACHE_REQUESTS = registry.counter("bot_cache_requests_total", "Cache lookups, by cache and result.", ("cache", "result"))
+SEARCH_PAGES = registry.counter("bot_search_pages_total", "Search result pages requested, by whether they were used, empty or failed, or too slow and cancelled.", ("result",))
+PROCESS_RSS = registry.gauge("bot_process_resident_memory_bytes", "Resident memory of the bot process.")
+
+# Commands registered with the application; anything else is counted as "other" to bound label cardinality
+KNOWN_COMMANDS = set()
+
+def register_commands(application) -> None:
+    """
+    Record the command names of the application's CommandHandlers for the per-command counter.
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            KNOWN_COMMANDS.update(getattr(handler, "commands", ()))
+
+def classify_update(update) -> Tuple[str, str]:
+    """
+    Return the kind of an update ("command", "text", "voice", "callback_query" or "other") and,
+    for commands, the command name.
+    """
+    if getattr(update, "callback_query", None):
+        return "callback_query", None
+    message = getattr(update, "effective_message", None)
+    if message is None:
+        return "other", None
+    if message.voice:
+        return "voice", None
+    if message.text:
+        if message.text.startswith("/"):
+            command = message.text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+            return "command", command if command in KNOWN_COMMANDS else "other"
+        return "text", None
+    return "other", None
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+@contextmanager
+def time_external_call(service: str, operation: str):
+    """
+    Time a call to an external service that isn't wrapped in a tracer span (e.g. code imported by `config`).
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        EXTERNAL_CALL_DURATION.observe(time.perf_counter() - start, service=service, operation=operation, status=status)
+
+def observe_span(span) -> None:
+    """
+    Tracer hook that turns finished spans into metrics. Span names are "<service>.<operation>".
+    """
+    service, _, operation = span.name.partition(".")
+    seconds = span.duration_ms / 1000
+
+    if span.name == "update":
+        UPDATE_QUEUE_WAIT.observe(span.attributes.get("queue_wait_ms", 0) / 1000)
+        return
+
+    EXTERNAL_CALL_DURATION.observe(seconds, service=service, operation=operation or service, status=span.status)
+
+    if span.name == "llm.generate" and "completion_tokens" in span.attributes:
+        tokens = span.attributes["completion_tokens"]
+        model = span.attributes.get("model", "unknown")
+        LLM_COMPLETION_TOKENS.inc(tokens, model=model)
+        if "prefill_ms" in span.attributes:
+            LLM_TIME_TO_FIRST_TOKEN.observe(span.attributes["prefill_ms"] / 1000, model=model)
+        decode_ms = span.attributes.get("decode_ms")
+        if decode_ms and tokens > 1:
+            LLM_DECODE_SPEED.observe((tokens - 1) / (decode_ms / 1000), model=model)
+        if span.attributes.get("draft_tokens"):
+            drafted, accepted = span.attributes["draft_tokens"], span.attributes.get("accepted_tokens", 0)
+            LLM_DRAFT_TOKENS.inc(accepted, model=model, result="accepted")
+            LLM_DRAFT_TOKENS.inc(drafted - accepted, model=model, result="rejected")
+            LLM_DRAFT_ACCEPTANCE.observe(accepted / drafted, model=model)
+        if span.attributes.get("fallback_tokens"):
+            LLM_DRAFT_FALLBACK_TOKENS.inc(span.attributes["fallback_tokens"], model=model)
+
+def get_rss_bytes() -> int:
+    """
+    Current resident set size, falling back to peak RSS where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return 0
+
+def collect_process_metrics() -> None:
+    PROCESS_RSS.set(get_rss_bytes())
+
+registry.add_collector(collect_process_metrics)
+
+def register_component_collectors(update_queue, update_processor, rate_limiter, feature_limits, admission_controller) -> None:
+    """
+    Expose the stats the bot's components already keep as gauges and counters, refreshed on every scrape.
+    """
+    update_queue_size = registry.gauge("bot_update_queue_size", "Updates fetched from Telegram but not yet picked up.")
+    updates_running = registry.gauge("bot_updates_running", "Updates currently being processed.")
+    updates_pending = registry.gauge("bot_updates_pending", "Updates waiting for their chat or for a free slot.")
+    active_chats = registry.gauge("bot_active_chats", "Chats with an update running or waiting.")
+    in_flight = registry.gauge("bot_in_flight_calls", "External calls currently running, by feature (llm = in-flight generations).", ("feature",))
+    feature_limit = registry.gauge("bot_in_flight_limit", "Concurrency cap per feature.", ("feature",))
+    admission_running = registry.gauge("bot_admission_running", "Admitted expensive requests running, by cost class.", ("cost_class",))
+    admission_queued = registry.gauge("bot_admission_queued", "Expensive requests waiting for a slot, by cost class.", ("cost_class",))
+    admission_total = registry.counter("bot_admission_decisions_total", "Admission decisions for expensive commands, by outcome.", ("outcome",))
+    telegram_requests = registry.counter("bot_telegram_limiter_events_total", "Outbound Bot API requests seen by the rate limiter, and what it did with them.", ("event",))
+
+    def collect_components() -> None:
+        update_queue_size.set(update_queue.qsize())
+        processor_stats = update_processor.get_stats()
+        updates_running.set(processor_stats["running"])
+        updates_pending.set(processor_stats["pending"])
+        active_chats.set(processor_stats["active_chats"])
+
+        for feature, stats in feature_limits.get_stats().items():
+            in_flight.set(stats["in_flight"], feature=feature)
+            feature_limit.set(stats["limit"], feature=feature)
+
+        admission_stats = admission_controller.get_stats()
+        for cost_class, running in admission_stats["running"].items():
+            admission_running.set(running, cost_class=cost_class)
+        for cost_class, queued in admission_stats["queued_now"].items():
+            admission_queued.set(queued, cost_class=cost_class)
+        for outcome in ("admitted", "queued", "rejected_quota", "shed"):
+            admission_total.set_total(admission_stats[outcome], outcome=outcome)
+
+        for event, total in rate_limiter.stats.items():
+            telegram_requests.set_total(total, event=event)
+
+    registry.add_collector(collect_components)
+
+class MetricsServer():
+    """
+    Serves the registry in the Prometheus text format on a local port.
+    """
+
+    def __init__(self, listen: str, port: int, metrics_registry: MetricsRegistry = registry):
+        self.listen = listen
+        self.port = port
+        self.registry = metrics_registry
+        self._runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info("Metrics available at http://%s:%s/metrics", self.listen, self.port)
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,468 @@
+import os
+import re
+import time
+import ctypes
+import asyncio
+import logging
+import itertools
+import importlib.metadata
+import threading
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+import openai
+from gpt4all import GPT4All
+from gpt4all.gpt4all import DEFAULT_MODEL_DIRECTORY
+from gpt4all.pyllmodel import LLModelPromptContext, empty_response_callback
+from classes.concurrency import feature_limits
+from classes.tracing import tracer
+from classes.metrics import LLM_REQUESTS
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Words that make even a short message a task for the bigger model rather than small talk
+TASK_WORDS = {
+    "explain", "why", "how", "write", "code", "script", "calculate", "compare", "analyze", "analyse", "translate",
+    "summarize", "summarise", "debug", "fix", "prove", "solve", "step", "steps", "difference", "recipe", "plan",
+}
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+# GPT4All.generate's sampling defaults, for generations that go through the lower-level prompt call
+GPT4ALL_SAMPLING = {"temp": 0.7, "top_k": 40, "top_p": 0.4, "repeat_penalty": 1.18, "repeat_last_n": 64, "n_batch": 8}
+
+# Batch size for evaluating a shared prompt prefix once; GPT4All caps prompt batches at 128 tokens
+PREFIX_BATCH = 128
+
+# GPT4All releases prefix reuse was checked against, their prompt context layout and the fields it writes
+PREFIX_REUSE_GPT4ALL_VERSIONS = ("2.0.2",)
+PREFIX_REUSE_LAYOUT = ("logits", "logits_size", "tokens", "tokens_size", "n_past", "n_ctx", "n_predict", "top_k", "top_p",
+                       "temp", "n_batch", "repeat_penalty", "repeat_last_n", "context_erase")
+PREFIX_REUSE_FIELDS = {"tokens": ctypes.POINTER(ctypes.c_int32), "tokens_size": ctypes.c_size_t, "n_past": ctypes.c_int32, "n_ctx": ctypes.c_int32}
+
+def gpt4all_prefix_reuse_problem(model) -> Optional[str]:
+    """
+    Why prefix reuse can't be used with `model`, a loaded GPT4All model, or None if it can.
+    Rolling the context back means writing into GPT4All's ctypes prompt context, which isn't a
+    public API, so it is only done on the releases and struct layout it was written for.
+    """
+    try:
+        version = importlib.metadata.version("gpt4all")
+    except importlib.metadata.PackageNotFoundError:
+        version = "unknown"
+    if version not in PREFIX_REUSE_GPT4ALL_VERSIONS:
+        return f"gpt4all {version} isn't one of {', '.join(PREFIX_REUSE_GPT4ALL_VERSIONS)}"
+    fields = dict(getattr(LLModelPromptContext, "_fields_", []))
+    if tuple(fields) != PREFIX_REUSE_LAYOUT:
+        return "its prompt context layout is different"
+    for name, field_type in PREFIX_REUSE_FIELDS.items():
+        if fields.get(name) is not field_type:
+            return f"its prompt context has no {field_type.__name__} field '{name}'"
+    llmodel = getattr(model, "model", None)
+    if not hasattr(llmodel, "context") or not all(hasattr(llmodel, name) for name in ("prompt_model", "prompt_model_streaming")):
+        return "its model wrapper doesn't look like gpt4all's LLModel"
+    return None
+
+def split_messages(messages: List[Dict[str, str]]) -> Tuple[str, str]:
+    """
+    Render chat messages in the "### Human / ### Assistant" format the local models are tuned on,
+    as the system part and the conversation. Their concatenation is the whole prompt; the system
+    part is kept separate so its evaluated state can be reused across requests.
+    """
+    prefix = "".join(f"{message['content']}\n\n" for message in messages if message["role"] == "system")
+    turns = [
+        f"### {'Human' if message['role'] == 'user' else 'Assistant'}:\n{message['content']}"
+        for message in messages if message["role"] != "system"
+    ]
+    return prefix, "\n".join(turns) + "\n### Assistant:\n"
+
+def format_messages(messages: List[Dict[str, str]]) -> str:
+    """
+    Render chat messages as a single prompt in the "### Human / ### Assistant" format the local models are tuned on.
+    """
+    return "".join(split_messages(messages))
+
+class LocalModel():
+    """
+    A GGUF model run in-process by GPT4All. It's loaded on first use (or by `ModelRouter.preload`)
+    and has its own "llm:<name>" feature limit, because a model instance is not thread-safe.
+
+    With a "draft" model in its spec, it generates by speculative decoding on llama.cpp instead
+    (see classes/speculative.py), falling back to GPT4All if llama-cpp-python is not installed or
+    the models can't be paired.
+
+    Generations can share a prompt prefix (the system persona). The model keeps the prefix's
+    evaluated state and rolls its context back to it for each request, so only the text after
+    the prefix is evaluated. This relies on GPT4All internals, so it is only done on the GPT4All
+    releases in PREFIX_REUSE_GPT4ALL_VERSIONS.
+    """
+
+    backend = "gpt4all"
+
+    def __init__(self, name: str, spec: Dict):
+        self.name = name
+        # "model" is a file name inside "path", or a path to the file
+        self.model_file = os.path.basename(spec["model"])
+        self.model_path = os.path.dirname(spec["model"]) or spec.get("path") or Config.LLM_MODEL_PATH
+        self.allow_download = spec.get("allow_download", Config.LLM_ALLOW_DOWNLOAD)
+        self.n_threads = spec.get("n_threads")
+        # A GPT4All model holds one context, so it runs one generation at a time
+        if spec.get("max_concurrent", 1) != 1:
+            raise ValueError(f"Model '{name}' can't run {spec['max_concurrent']} generations at once; "
+                             "register the model file under another name to run it twice")
+        self.draft = spec.get("draft")
+        self.draft_tokens = spec.get("draft_tokens", Config.LLM_DRAFT_TOKENS)
+        self.min_acceptance = spec.get("min_acceptance", Config.LLM_DRAFT_MIN_ACCEPTANCE)
+        self.feature = f"llm:{name}"
+        self._model = None
+        self._speculative = None
+        self._load_lock = threading.Lock()
+        # The prefix whose state the GPT4All context holds, its length in tokens and the tokens themselves
+        self._prefix = None
+        self._prefix_tokens = 0
+        self._prefix_ids = []
+        # Whether the loaded GPT4All release is one the rollback is known to work with
+        self._prefix_reuse = False
+
+    def _load_speculative(self):
+        try:
+            from classes.speculative import SpeculativeDecoder
+        except ImportError:
+            logger.warning("Model '%s' has a draft model but llama-cpp-python is not installed (see requirements-speculative.txt); generating without speculative decoding", self.name)
+            return None
+
+        model_dir = self.model_path or DEFAULT_MODEL_DIRECTORY
+        try:
+            return SpeculativeDecoder(
+                os.path.join(model_dir, self.model_file),
+                os.path.join(model_dir, self.draft),
+                n_threads=self.n_threads,
+                draft_tokens=self.draft_tokens,
+                min_acceptance=self.min_acceptance,
+            )
+        except ValueError as e:
+            logger.warning("Can't use speculative decoding for model '%s', generating without it: %s", self.name, e)
+            return None
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None and self._speculative is None:
+                start = time.perf_counter()
+                if self.draft:
+                    self._speculative = self._load_speculative()
+                if self._speculative is None:
+                    self._model = GPT4All(self.model_file, model_path=self.model_path, allow_download=self.allow_download, n_threads=self.n_threads)
+                    problem = gpt4all_prefix_reuse_problem(self._model)
+                    if problem:
+                        logger.warning("Not reusing prompt prefixes for model '%s', evaluating prompts in full: %s", self.name, problem)
+                    self._prefix_reuse = problem is None
+                logger.info("Loaded model '%s' (%s%s) in %.1fs", self.name, self.model_file,
+                            f", draft {self.draft}" if self._speculative else "", time.perf_counter() - start)
+            return self._speculative or self._model
+
+    def _evaluate_prefix(self, model, prefix: str) -> bool:
+        """
+        Make the GPT4All context hold `prefix`, evaluating it unless it already does.
+        Returns False if the prefix doesn't fit the context window, or prefix reuse is off.
+        """
+        if not self._prefix_reuse:
+            return False
+        if self._prefix != prefix:
+            start = time.perf_counter()
+            self._prefix = None
+            model.model.prompt_model(prefix, empty_response_callback, n_predict=0, n_batch=PREFIX_BATCH, reset_context=True)
+            if not model.model.context.n_past:
+                logger.warning("The prompt prefix for model '%s' doesn't fit its context window, evaluating prompts in full", self.name)
+                return False
+            context = model.model.context
+            self._prefix, self._prefix_tokens = prefix, context.n_past
+            self._prefix_ids = context.tokens[context.tokens_size - context.n_past:context.tokens_size]
+            logger.info("Evaluated a %d token prompt prefix for model '%s' in %.1fs", self._prefix_tokens, self.name, time.perf_counter() - start)
+        return True
+
+    def _rollback_to_prefix(self, model) -> None:
+        """
+        Roll the GPT4All context back to the end of the prefix instead of evaluating it again.
+        GPT4All keeps the tokens it has seen, which its repeat penalty looks back on, and that history
+        can't be shortened from Python; so its tail is made the prefix's tokens again, as it would be
+        right after evaluating the prefix. The history is only replayed when the context overflows,
+        which `_prefixed_budget` rules out.
+        """
+        context = model.model.context
+        keep = min(context.tokens_size, len(self._prefix_ids))
+        start = context.tokens_size - keep
+        for i, token in enumerate(self._prefix_ids[len(self._prefix_ids) - keep:]):
+            context.tokens[start + i] = token
+        context.n_past = self._prefix_tokens
+
+    def _prefixed_budget(self, model, prompt: str, max_tokens: int) -> int:
+        """
+        Tokens that can be generated after the prefix and `prompt` without overflowing the context.
+        GPT4All makes room by erasing the start of the context, which would lose the prefix, so
+        prompts that don't fit this way are evaluated from scratch instead. A token is at least one
+        byte, so the prompt's length in bytes (plus room for the leading space) bounds its token count.
+        """
+        return min(max_tokens, model.model.context.n_ctx - self._prefix_tokens - len(prompt.encode("utf-8")) - 2)
+
+    def _warm(self, prefix: str) -> None:
+        model = self.load()
+        if model is self._speculative:
+            model.warm(prefix)
+        else:
+            self._evaluate_prefix(model, prefix)
+
+    async def warm(self, system_prompt: str = "") -> None:
+        """
+        Load the model and evaluate `system_prompt`, so chats that start with it only evaluate what follows.
+        """
+        if not system_prompt:
+            await asyncio.to_thread(self.load)
+            return
+        prefix, _ = split_messages([{"role": "system", "content": system_prompt}])
+        async with feature_limits.limit(self.feature):
+            await asyncio.to_thread(self._warm, prefix)
+
+    async def generate(self, prompt: str, max_tokens: int, chat_session: bool = True, prefix: str = "",
+                       on_text: Optional[Callable[[str], None]] = None, **params) -> str:
+        """
+        Generate a completion in a worker thread, since GPT4All generation is blocking.
+
+        Args:
+            prompt: The prompt text.
+            max_tokens: Maximum number of tokens to generate.
+            chat_session: Wrap the prompt in the model's own chat template. Ignored with a `prefix`.
+            prefix: Text that comes before the prompt and is shared between requests, e.g. the system prompt.
+            on_text: Called with each token's text as it's generated, from the worker thread.
+            **params: Sampling parameters; `temperature` and `top_p` are honoured, the rest are ignored.
+        """
+        sampling = {}
+        if "temperature" in params:
+            sampling["temp"] = params["temperature"]
+        if "top_p" in params:
+            sampling["top_p"] = params["top_p"]
+
+        def stream_tokens(span, stream):
+            # Time to the first token is dominated by prompt evaluation (prefill), the rest is decode
+            start = time.perf_counter()
+            first_token_at = None
+            tokens = []
+            for token in stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                tokens.append(token)
+                if on_text is not None:
+                    on_text(token)
+            end = time.perf_counter()
+            first_token_at = first_token_at or end
+            span.set_attribute("prefill_ms", round((first_token_at - start) * 1000, 1))
+            span.set_attribute("decode_ms", round((end - first_token_at) * 1000, 1))
+            span.set_attribute("completion_tokens", len(tokens))
+            return "".join(tokens)
+
+        # Set when the caller gives up. GPT4All generates in a thread of its own, which stops once its
+        # callback returns False; its stream still ends properly, so that thread is done when this one is
+        stop = threading.Event()
+
+        def keep_going(token_id, response) -> bool:
+            return not stop.is_set()
+
+        def speculate(span, decoder):
+            # GPT4All's chat session wraps the prompt in the model's template; this is the generic one
+            text = prompt if prefix or not chat_session else format_messages([{"role": "user", "content": prompt}])
+            # The decoder only works while its tokens are taken, so it stops when they no longer are
+            text = stream_tokens(span, itertools.takewhile(lambda _: not stop.is_set(), decoder.generate(text, max_tokens, prefix=prefix, **sampling)))
+            for key, value in decoder.last_stats.items():
+                span.set_attribute(key, value)
+            return text
+
+        def generate_after_prefix(span, model, budget):
+            self._rollback_to_prefix(model)
+            span.set_attribute("prefix_tokens", self._prefix_tokens)
+            return stream_tokens(span, model.model.prompt_model_streaming(prompt, keep_going, n_predict=budget, reset_context=False, **{**GPT4ALL_SAMPLING, **sampling}))
+
+        def generate():
+            model = self.load()
+            with tracer.span("llm.generate", model=self.name, max_tokens=max_tokens, prompt_chars=len(prefix) + len(prompt)) as span:
+                if model is self._speculative:
+                    return speculate(span, model)
+                if prefix and self._evaluate_prefix(model, prefix):
+                    budget = self._prefixed_budget(model, prompt, max_tokens)
+                    if budget > 0:
+                        return generate_after_prefix(span, model, budget)
+                # Anything else resets the context, and with it the prefix state
+                self._prefix = None
+                if prefix:
+                    return stream_tokens(span, model.generate(prefix + prompt, max_tokens=max_tokens, streaming=True, callback=keep_going, **sampling))
+                if chat_session:
+                    with model.chat_session():
+                        return stream_tokens(span, model.generate(prompt, max_tokens=max_tokens, streaming=True, callback=keep_going, **sampling))
+                return stream_tokens(span, model.generate(prompt, max_tokens=max_tokens, streaming=True, callback=keep_going, **sampling))
+
+        async with feature_limits.limit(self.feature):
+            worker = asyncio.ensure_future(asyncio.to_thread(generate))
+            try:
+                return await asyncio.shield(worker)
+            except asyncio.CancelledError:
+                # The thread can't be interrupted, only asked to stop after its next token. The model
+                # isn't thread-safe, so its slot is held until the thread is done with it.
+                stop.set()
+                while not worker.done():
+                    try:
+                        await asyncio.wait([worker])
+                    except asyncio.CancelledError:
+                        pass
+                # How it ended doesn't matter anymore; retrieving it keeps asyncio from logging it
+                if not worker.cancelled():
+                    worker.exception()
+                raise
+
+    async def chat(self, messages: List[Dict[str, str]], max_tokens: int, **params) -> str:
+        prefix, conversation = split_messages(messages)
+        return await self.generate(conversation, max_tokens, chat_session=False, prefix=prefix, **params)
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int, **params) -> AsyncIterator[str]:
+        """
+        Like `chat`, but yields the reply's text as it's generated. Tokens are passed from the
+        worker thread to the event loop through a queue, which ends once the generation does.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        # The worker thread hands its result over after its last token, so None always comes last
+        generation = asyncio.ensure_future(self.chat(messages, max_tokens, on_text=lambda token: loop.call_soon_threadsafe(queue.put_nowait, token), **params))
+        generation.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                token = await queue.get()
+                if token is None:
+                    break
+                yield token
+            # Raises if the generation failed
+            await generation
+        finally:
+            generation.cancel()
+
+class RemoteModel():
+    """
+    A model behind an OpenAI-compatible chat completions endpoint, either OpenAI itself or a self-hosted server.
+    """
+
+    backend = "openai"
+
+    def __init__(self, name: str, spec: Dict):
+        self.name = name
+        self.model = spec["model"]
+        self.api_base = spec.get("api_base") or Config.OPENAI_API_URL
+        self.api_key = os.environ.get(spec.get("api_key_env", "OPENAI_API_KEY"), "")
+        # Service name used in spans and metrics, e.g. "openai" or "vllm"
+        self.service = spec.get("service", "openai")
+
+    async def warm(self, system_prompt: str = "") -> None:
+        # Nothing to load; OpenAI-compatible servers cache repeated prompt prefixes themselves
+        pass
+
+    async def chat(self, messages: List[Dict[str, str]], max_tokens: int, **params) -> str:
+        async with feature_limits.limit("openai"):
+            async with tracer.span(f"{self.service}.chat", model=self.name, max_tokens=max_tokens) as span:
+                response = await openai.ChatCompletion.acreate(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    api_key=self.api_key,
+                    api_base=self.api_base,
+                    **params
+                )
+                usage = response.get("usage")
+                if usage:
+                    span.set_attribute("completion_tokens", usage.get("completion_tokens", 0))
+        return response.choices[0].message["content"].strip()
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int, **params) -> AsyncIterator[str]:
+        """
+        Like `chat`, but yields the reply's text as the server streams it.
+        """
+        async with feature_limits.limit("openai"):
+            async with tracer.span(f"{self.service}.chat", model=self.name, max_tokens=max_tokens, stream=True) as span:
+                response = await openai.ChatCompletion.acreate(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    api_key=self.api_key,
+                    api_base=self.api_base,
+                    stream=True,
+                    **params
+                )
+                chunks = 0
+                async for chunk in response:
+                    text = chunk.choices[0].delta.get("content")
+                    if text:
+                        chunks += 1
+                        yield text
+                span.set_attribute("completion_chunks", chunks)
+
+    async def generate(self, prompt: str, max_tokens: int, chat_session: bool = True, **params) -> str:
+        return await self.chat([{"role": "user", "content": prompt}], max_tokens, **params)
+
+class ModelRouter():
+    """
+    Picks a model from the registry for each request, so small talk goes to a small fast model and
+    real questions, long prompts and commands like /summarize go to bigger ones.
+
+    Routes map a request kind to a model name. For a request they're tried in this order: the
+    command (e.g. "summarize"), "<chat type>.<kind>", "<kind>" and "default", where kind is
+    "casual" for small talk and "default" otherwise.
+
+    Usage:
+        model = model_router.route(text, chat_type="group")
+        reply = await model.generate(prompt, max_tokens=512)
+        async for text in model.stream(messages, max_tokens=512):
+            ...
+    """
+
+    BACKENDS = {"gpt4all": LocalModel, "openai": RemoteModel}
+
+    def __init__(self, models: Dict[str, Dict], routes: Dict[str, str], casual_max_chars: int):
+        self.models = {}
+        for name, spec in models.items():
+            backend = self.BACKENDS.get(spec.get("backend", "gpt4all"))
+            if backend is None:
+                raise ValueError(f"Model '{name}' has unknown backend '{spec.get('backend')}', expected one of {', '.join(self.BACKENDS)}")
+            self.models[name] = backend(name, spec)
+
+        if "default" not in routes:
+            raise ValueError("LLM_ROUTES needs a 'default' route")
+        unknown = sorted(f"{route}={name}" for route, name in routes.items() if name not in self.models)
+        if unknown:
+            raise ValueError(f"LLM_ROUTES refers to models missing from LLM_MODELS: {', '.join(unknown)}")
+        self.routes = dict(routes)
+        self.casual_max_chars = casual_max_chars
+
+    def is_casual(self, text: str) -> bool:
+        """
+        Cheap small-talk check: a short, single-line message with no code and no task words.
+        """
+        text = text.strip()
+        if len(text) > self.casual_max_chars or "\n" in text or "`" in text:
+            return False
+        return not TASK_WORDS.intersection(WORD_PATTERN.findall(text.lower()))
+
+    def route(self, text: str = "", chat_type: str = "private", command: Optional[str] = None):
+        kind = "casual" if self.is_casual(text) else "default"
+        for route in (command, f"{chat_type}.{kind}", kind, "default"):
+            if route and route in self.routes:
+                model = self.models[self.routes[route]]
+                LLM_REQUESTS.inc(route=route, model=model.name)
+                logger.debug("Routing %s request (%d chars) to model '%s' via route '%s'", chat_type, len(text), model.name, route)
+                return model
+
+    def get(self, name: str):
+        return self.models[name]
+
+    async def preload(self, system_prompt: str = "") -> None:
+        """
+        Load every routed local model up front so the first requests don't pay for it, and
+        evaluate the shared `system_prompt` in each so chats start from its state.
+        """
+        for name in dict.fromkeys(self.routes.values()):
+            await self.models[name].warm(system_prompt)
+
+# Shared by every handler so each local model is loaded once
+model_router = ModelRouter(Config.LLM_MODELS, Config.LLM_ROUTES, Config.LLM_CASUAL_MAX_CHARS)
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import aiohttp
+from bs4 import BeautifulSoup
+from classes.host_stats import host_stats
+from classes.metrics import CACHE_REQUESTS, record_cache
+from classes.tracing import tracer
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Pages whose text can be extracted; anything else (PDFs, images, downloads) is skipped without reading it
+PAGE_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+def extract_text(html_content: str) -> str:
+    """
+    The readable text of an HTML page, one block per line.
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Remove unnecessary elements, such as scripts and styles
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    # Extract the text from the cleaned HTML
+    return soup.get_text(separator="\n")
+
+class PageCache():
+    """
+    The text of web pages by URL, for search answers. Only the extracted text is kept, never the HTML.
+
+    A page is used as is for `ttl` seconds after it was fetched. After that it's revalidated
+    with a conditional GET (If-None-Match / If-Modified-Since), so a page that hasn't changed
+    costs a 304 and no parsing. Pages live in a memory LRU of at most `max_bytes` of text,
+    backed by zlib-compressed files in `cache_dir` (at most `disk_max_bytes`, oldest removed first).
+
+    Failures are cached too: a page that can't be fetched or read isn't tried again for `negative_ttl`
+    seconds, and neither is any page on a host that timed out or couldn't be connected to. Concurrent requests for the same page share one download, which
+    is cancelled if every one of them gives up. Every download's latency and outcome is recorded
+    in `host_stats`.
+
+    Usage:
+        text = await page_cache.get(url)  # "" if the page can't be fetched
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, cache_dir: str, disk_max_bytes: int, negative_ttl: float, timeout: float = 10):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        # url -> {"url", "text", "etag", "last_modified", "fresh_until"}; fresh_until is wall-clock time so it survives restarts
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        # host -> time until which it isn't contacted
+        self._failing_hosts: Dict[str, float] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # url -> callers waiting for its download
+        self._waiters: Dict[str, int] = {}
+        self._disk_writes = 0
+
+    # Memory tier
+
+    def _remember(self, entry: Dict) -> Dict:
+        previous = self._entries.pop(entry["url"], None)
+        if previous is not None:
+            self._bytes -= len(previous["text"])
+        self._entries[entry["url"]] = entry
+        self._bytes += len(entry["text"])
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted["text"])
+        return entry
+
+    # Disk tier
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json.z")
+
+    def _read(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._path(url), "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Could not read the cached page %s: %s", url, e)
+            return None
+        # Two URLs could in theory share a file name
+        return entry if entry.get("url") == url else None
+
+    def _write(self, entry: Dict, prune: bool) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(entry["url"])
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(zlib.compress(json.dumps(entry).encode("utf-8"), 6))
+        os.replace(temp_path, path)
+        if prune:
+            self._prune()
+
+    def _prune(self) -> None:
+        files = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def _save(self, entry: Dict) -> None:
+        # Checking the directory size means listing it, so it's only done every 100 writes
+        self._disk_writes += 1
+        try:
+            await asyncio.to_thread(self._write, entry, self._disk_writes % 100 == 0)
+        except Exception as e:
+            logger.warning("Could not save the page %s: %s", entry["url"], e)
+
+    async def _cached(self, url: str) -> Optional[Dict]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+            return entry
+        entry = await asyncio.to_thread(self._read, url)
+        return self._remember(entry) if entry is not None else None
+
+    # Network
+
+    def _fail_host(self, host: str, reason) -> None:
+        logger.warning("Not fetching pages from %s for %.0fs: %s", host, self.negative_ttl, reason)
+        now = time.time()
+        # Forget hosts whose pause is over, so every host that ever failed doesn't stay in memory
+        for expired in [name for name, until in self._failing_hosts.items() if until <= now]:
+            del self._failing_hosts[expired]
+        self._failing_hosts[host] = now + self.negative_ttl
+
+    def _host_failing(self, host: str) -> bool:
+        until = self._failing_hosts.get(host)
+        if until is None:
+            return False
+        if until > time.time():
+            return True
+        del self._failing_hosts[host]
+        return False
+
+    def _negative_entry(self, url: str) -> Dict:
+        return {"url": url, "text": "", "etag": "", "last_modified": "", "fresh_until": time.time() + self.negative_ttl}
+
+    async def _fetch(self, url: str, host: str, stale: Optional[Dict]) -> str:
+        headers = {'User-Agent': USER_AGENT}
+        if stale is not None and stale["etag"]:
+            headers["If-None-Match"] = stale["etag"]
+        if stale is not None and stale["last_modified"]:
+            headers["If-Modified-Since"] = stale["last_modified"]
+
+        start, latency = time.perf_counter(), None
+        try:
+            async with tracer.span("page.fetch", host=host, revalidate=stale is not None) as span:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                        span.set_attribute("status", response.status)
+                        if response.status == 304 and stale is not None:
+                            latency = time.perf_counter() - start
+                            host_stats.record(host, latency, ok=True)
+                            entry = {**stale, "fresh_until": time.time() + self.ttl}
+                            CACHE_REQUESTS.inc(cache="page", result="revalidated")
+                        elif response.status == 200 and response.content_type not in PAGE_CONTENT_TYPES:
+                            # A PDF, image or download: nothing to extract, and not worth fetching again soon
+                            latency = time.perf_counter() - start
+                            host_stats.record(host, latency, ok=True)
+                            span.set_attribute("content_type", response.content_type)
+                            entry = self._negative_entry(url)
+                        elif response.status == 200:
+                            html_content = await response.text()
+                            latency = time.perf_counter() - start
+                            host_stats.record(host, latency, ok=True)
+                            # Parsing a big page takes long enough to hold up other chats
+                            text = await asyncio.to_thread(extract_text, html_content)
+                            entry = {
+                                "url": url,
+                                "text": text,
+                                "etag": response.headers.get("ETag", ""),
+                                "last_modified": response.headers.get("Last-Modified", ""),
+                                "fresh_until": time.time() + self.ttl,
+                            }
+                        else:
+                            latency = time.perf_counter() - start
+                            host_stats.record(host, latency, ok=False)
+                            # Not worth asking again for a while, e.g. a 403 for bots, a 404 or a broken page
+                            entry = self._negative_entry(url)
+        except asyncio.CancelledError:
+            # Given up on for being too slow; the time it had taken is a lower bound on its latency
+            if latency is None:
+                host_stats.record(host, time.perf_counter() - start, ok=True)
+            raise
+        except Exception as e:
+            logger.warning("Error fetching URL content from %s: %s", url, e)
+            if latency is None:
+                host_stats.record(host, time.perf_counter() - start, ok=False)
+            # Only a host that can't be reached is skipped altogether; a page that can't be decoded or
+            # parsed says nothing about the rest of the site
+            if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                self._fail_host(host, e)
+            # An old copy beats nothing
+            if stale is not None:
+                return stale["text"]
+            entry = self._negative_entry(url)
+
+        self._remember(entry)
+        await self._save(entry)
+        return entry["text"]
+
+    async def get(self, url: str) -> str:
+        """
+        The text of the page at `url`, from the cache while it's fresh. "" if it can't be fetched.
+        """
+        host = urlparse(url).netloc
+        entry = await self._cached(url)
+        if entry is not None and entry["fresh_until"] > time.time():
+            record_cache("page", True)
+            return entry["text"]
+        if self._host_failing(host):
+            CACHE_REQUESTS.inc(cache="page", result="negative")
+            return entry["text"] if entry is not None else ""
+
+        future = self._in_flight.get(url)
+        if future is None:
+            CACHE_REQUESTS.inc(cache="page", result="miss" if entry is None else "expired")
+            future = asyncio.ensure_future(self._fetch(url, host, entry))
+            self._in_flight[url] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(url, None))
+        else:
+            CACHE_REQUESTS.inc(cache="page", result="coalesced")
+
+        # A caller giving up only cancels the download if nobody else is waiting for it
+        self._waiters[url] = self._waiters.get(url, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._waiters[url] == 1:
+                future.cancel()
+            raise
+        finally:
+            self._waiters[url] -= 1
+            if not self._waiters[url]:
+                del self._waiters[url]
+
+# Shared by every search so popular pages are fetched once
+page_cache = PageCache(Config.PAGE_CACHE_TTL, Config.PAGE_CACHE_MAX_BYTES, Config.PAGE_CACHE_DIR,
+                       Config.PAGE_CACHE_DISK_MAX_BYTES, Config.PAGE_CACHE_NEGATIVE_TTL)
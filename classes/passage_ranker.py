@@ -0,0 +1,113 @@
+import re
+import logging
+from typing import Callable, Dict, List, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+WHITESPACE_PATTERN = re.compile(r"[ \t\r\f\v]+")
+
+# Too common to tell passages apart; dropping them also keeps questions like "what is the ..." from matching everything
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "did", "do", "does", "for", "from", "had", "has", "have",
+    "how", "i", "if", "in", "into", "is", "it", "its", "me", "my", "of", "on", "or", "so", "than", "that", "the", "their",
+    "them", "then", "there", "these", "they", "this", "to", "was", "we", "were", "what", "when", "where", "which", "who",
+    "why", "will", "with", "you", "your", "about", "tell",
+}
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def split_passages(text: str, max_words: int) -> List[str]:
+    """
+    Split page text into passages of about `max_words` words. Consecutive lines are joined until a
+    passage is full, and a longer line is cut into pieces. Lines of one or two words (menus, buttons,
+    bylines) are dropped.
+    """
+    passages, current, current_words = [], [], 0
+    for line in text.splitlines():
+        words = WHITESPACE_PATTERN.sub(" ", line).strip().split(" ")
+        if len(words) < 3:
+            continue
+        while words:
+            room = max_words - current_words
+            current.extend(words[:room])
+            current_words += len(words[:room])
+            words = words[room:]
+            if current_words >= max_words:
+                passages.append(" ".join(current))
+                current, current_words = [], 0
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+def bm25_scores(passages: Sequence[List[str]], query: List[str], k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """
+    Okapi BM25 score of each tokenized passage for the tokenized query.
+
+    The passages are turned into a sparse passage-term matrix in coordinate form (one entry per
+    distinct term of a passage, with its count), so scoring is a few array operations over the
+    entries instead of a Python loop over passages and terms.
+    """
+    scores = np.zeros(len(passages))
+    vocabulary: Dict[str, int] = {}
+    query_terms = {vocabulary.setdefault(term, len(vocabulary)) for term in query}
+    if not passages or not query_terms:
+        return scores
+
+    lengths = np.fromiter((len(tokens) for tokens in passages), dtype=np.int64, count=len(passages))
+    term_ids = np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for tokens in passages for token in tokens),
+                           dtype=np.int64, count=int(lengths.sum()))
+    passage_ids = np.repeat(np.arange(len(passages)), lengths)
+
+    # One entry per (passage, term) with the term's count in the passage
+    keys, counts = np.unique(passage_ids * len(vocabulary) + term_ids, return_counts=True)
+    entry_passages, entry_terms = np.divmod(keys, len(vocabulary))
+
+    document_frequency = np.bincount(entry_terms, minlength=len(vocabulary))
+    idf = np.log1p((len(passages) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    in_query = np.isin(entry_terms, list(query_terms))
+    entry_passages, entry_terms, counts = entry_passages[in_query], entry_terms[in_query], counts[in_query]
+    length_norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+    weights = idf[entry_terms] * counts * (k1 + 1) / (counts + length_norm[entry_passages])
+    scores += np.bincount(entry_passages, weights=weights, minlength=len(passages))
+    return scores
+
+def select_passages(query: str, documents: Sequence[str], budget_tokens: int, count_tokens: Callable[[str], int],
+                    max_words: int = 120) -> List[Dict]:
+    """
+    The passages of `documents` most relevant to `query` that fit in `budget_tokens`.
+
+    Passages are ranked by BM25; ties keep the documents' own order, so when nothing matches the
+    query the top search result comes first. Repeated passages, like boilerplate shared by pages of one
+    site, are only used once. The result is in reading order, document by document, as
+    {"document": index in `documents`, "text": passage}.
+    """
+    passages = [(document, passage) for document, text in enumerate(documents) for passage in split_passages(text, max_words)]
+    if not passages:
+        return []
+    scores = bm25_scores([tokenize(passage) for _, passage in passages], tokenize(query))
+
+    # Passages sharing no word with the query are only used if none does
+    ranked = np.argsort(-scores, kind="stable")
+    if scores.max() > 0:
+        ranked = ranked[scores[ranked] > 0]
+
+    selected, seen, used_tokens = [], set(), 0
+    for index in ranked.tolist():
+        if budget_tokens - used_tokens < 16:
+            break
+        document, passage = passages[index]
+        if passage in seen:
+            continue
+        tokens = count_tokens(passage)
+        if used_tokens + tokens > budget_tokens:
+            # A shorter passage further down may still fit
+            continue
+        selected.append(index)
+        seen.add(passage)
+        used_tokens += tokens
+    logger.debug("Selected %d of %d passages (%d tokens) for %r", len(selected), len(passages), used_tokens, query)
+    return [{"document": passages[index][0], "text": passages[index][1]} for index in sorted(selected)]
@@ -0,0 +1,188 @@
+import time
+import asyncio
+import logging
+import contextlib
+from typing import Any, Callable, Coroutine, Dict, Optional, Tuple
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from classes.concurrency import TokenBucket
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class EditAbandoned(Exception):
+    """Raised to coalesced edit callers when the caller that was sending their edit got cancelled."""
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Central limiter for every outbound Bot API call, plugged in via `Application.builder().rate_limiter()`.
+
+    - Requests wait for a token from their chat's bucket (private chats ~1/s with a small burst,
+      groups 20/min) and then from the global bucket (30/s), matching Telegram's documented limits.
+    - `sendChatAction` is dropped if the same action was already shown in that chat within the last
+      few seconds, since Telegram keeps the indicator up for ~5 s or until the next message.
+    - Edits of the same message that pile up while waiting for a token are collapsed: only the
+      latest text is sent and every caller gets its result. If the caller sending it is cancelled,
+      one of the others sends it instead.
+    - `RetryAfter` pauses all outbound requests for the requested time and retries.
+    """
+
+    CHAT_ACTION_TTL = 4.0
+    MAX_IDLE_BUCKETS = 512
+    EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageReplyMarkup")
+
+    def __init__(self, global_rate: float = None, private_chat_rate: float = None, group_rate_per_minute: float = None, max_retries: int = None):
+        self.global_rate = global_rate or Config.TELEGRAM_GLOBAL_RATE
+        self.private_chat_rate = private_chat_rate or Config.TELEGRAM_PRIVATE_CHAT_RATE
+        self.group_rate_per_minute = group_rate_per_minute or Config.TELEGRAM_GROUP_RATE_PER_MINUTE
+        self.max_retries = max_retries if max_retries is not None else Config.TELEGRAM_MAX_RETRIES
+
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._chat_actions: Dict[Tuple[Any, str], float] = {}
+        self._pending_edits: Dict[Tuple, Dict[str, Any]] = {}
+        self._retry_after_event = asyncio.Event()
+        self._retry_after_event.set()
+
+        self.stats = {"requests": 0, "skipped_chat_actions": 0, "coalesced_edits": 0, "retries": 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def _normalize_chat_id(chat_id):
+        with contextlib.suppress(ValueError, TypeError):
+            return int(chat_id)
+        return chat_id
+
+    def _get_chat_bucket(self, chat_id) -> TokenBucket:
+        if len(self._chat_buckets) > self.MAX_IDLE_BUCKETS:
+            for key, bucket in list(self._chat_buckets.items()):
+                if key != chat_id and bucket.is_full():
+                    del self._chat_buckets[key]
+
+        if chat_id not in self._chat_buckets:
+            # Negative IDs (and @usernames) are groups, supergroups or channels
+            if isinstance(chat_id, str) or chat_id < 0:
+                rate = self.group_rate_per_minute / 60
+                self._chat_buckets[chat_id] = TokenBucket(rate, self.group_rate_per_minute)
+            else:
+                self._chat_buckets[chat_id] = TokenBucket(self.private_chat_rate, 3)
+        return self._chat_buckets[chat_id]
+
+    async def _wait_for_slot(self, chat_id) -> None:
+        if chat_id is not None:
+            await self._get_chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+        await self._retry_after_event.wait()
+
+    async def _call_with_retries(self, callback, args, kwargs, max_retries: int):
+        for attempt in range(max_retries + 1):
+            try:
+                await self._retry_after_event.wait()
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    logger.error("Telegram rate limit still hit after %d retries", max_retries)
+                    raise
+                self.stats["retries"] += 1
+                delay = e.retry_after + 0.1
+                logger.warning("Telegram rate limit hit, retrying in %.1f s", delay)
+                # Hold back every other request too, they would hit the same limit
+                self._retry_after_event.clear()
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._retry_after_event.set()
+
+    def _is_redundant_chat_action(self, chat_id, data: Dict[str, Any]) -> bool:
+        key = (chat_id, data.get("action"))
+        now = time.monotonic()
+        last_sent = self._chat_actions.get(key)
+        if last_sent is not None and now - last_sent < self.CHAT_ACTION_TTL:
+            return True
+
+        if len(self._chat_actions) > self.MAX_IDLE_BUCKETS:
+            self._chat_actions = {k: v for k, v in self._chat_actions.items() if now - v < self.CHAT_ACTION_TTL}
+        self._chat_actions[key] = now
+        return False
+
+    def _clear_chat_actions(self, chat_id) -> None:
+        # Any message sent to the chat ends the indicator, so the next action has to be sent again
+        for key in [key for key in self._chat_actions if key[0] == chat_id]:
+            del self._chat_actions[key]
+
+    async def _process_edit(self, chat_id, data, callback, args, kwargs, max_retries):
+        key = (chat_id, data.get("message_id"), data.get("inline_message_id"))
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # An edit of this message is still waiting for a slot; replace it with this one
+            pending["call"] = (callback, args, kwargs)
+            self.stats["coalesced_edits"] += 1
+            try:
+                return await asyncio.shield(pending["future"])
+            except EditAbandoned:
+                # Nobody is sending the edit any more; send it, or join whichever caller got there first
+                return await self._process_edit(chat_id, data, callback, args, kwargs, max_retries)
+
+        future = asyncio.get_running_loop().create_future()
+        pending = {"call": (callback, args, kwargs), "future": future}
+        self._pending_edits[key] = pending
+        try:
+            await self._wait_for_slot(chat_id)
+            # From here on, later edits start a new round instead of joining this one
+            del self._pending_edits[key]
+            callback, args, kwargs = pending["call"]
+            result = await self._call_with_retries(callback, args, kwargs, max_retries)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            self._discard_pending_edit(key, pending)
+            # Cancelling the shared future would cancel every coalesced caller too
+            self._fail_edit(future, EditAbandoned())
+            raise
+        except Exception as e:
+            self._discard_pending_edit(key, pending)
+            self._fail_edit(future, e)
+            raise
+
+    @staticmethod
+    def _fail_edit(future: asyncio.Future, error: Exception) -> None:
+        if not future.done():
+            future.set_exception(error)
+            # Mark the exception as retrieved in case no coalesced caller is waiting on it
+            future.exception()
+
+    def _discard_pending_edit(self, key, pending) -> None:
+        if self._pending_edits.get(key) is pending:
+            del self._pending_edits[key]
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        self.stats["requests"] += 1
+        max_retries = rate_limit_args if rate_limit_args is not None else self.max_retries
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            chat_id = self._normalize_chat_id(chat_id)
+
+        if endpoint == "sendChatAction":
+            if self._is_redundant_chat_action(chat_id, data):
+                self.stats["skipped_chat_actions"] += 1
+                return True
+        elif endpoint in self.EDIT_ENDPOINTS:
+            return await self._process_edit(chat_id, data, callback, args, kwargs, max_retries)
+        elif chat_id is not None:
+            self._clear_chat_actions(chat_id)
+
+        await self._wait_for_slot(chat_id)
+        return await self._call_with_retries(callback, args, kwargs, max_retries)
@@ -0,0 +1,212 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from classes.metrics import CACHE_REQUESTS, registry, record_cache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Messages whose answer depends on when they're asked; they're never served from the cache
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|now|right now|currently|current|latest|recent|recently|news|weather|"
+    r"forecast|time|date|day is it|this (?:morning|week|weekend|month|year)|score|price|stock)\b",
+    re.IGNORECASE,
+)
+
+def normalize_message(text: str) -> str:
+    """
+    Cache key for a message: lowercased, without punctuation and with whitespace collapsed,
+    so "What's a good name for a cat?" and "whats a good name for a cat" share an entry.
+    """
+    return " ".join(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+class VectorIndex():
+    """
+    Brute-force cosine similarity search over unit-length embeddings, kept in one growing matrix.
+    A few thousand cached replies fit in a single matrix-vector product.
+    """
+
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []
+        self._positions: Dict[Tuple[str, str], int] = {}
+        self._vectors: Optional[np.ndarray] = None
+
+    def add(self, key: Tuple[str, str], vector: np.ndarray) -> None:
+        if key in self._positions:
+            self._vectors[self._positions[key]] = vector
+            return
+        if self._vectors is None:
+            self._vectors = np.empty((16, len(vector)), dtype=np.float32)
+        elif len(self.keys) == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.empty_like(self._vectors)])
+        self._positions[key] = len(self.keys)
+        self._vectors[len(self.keys)] = vector
+        self.keys.append(key)
+
+    def remove(self, key: Tuple[str, str]) -> None:
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        # Move the last row into the hole
+        last = len(self.keys) - 1
+        if position != last:
+            moved = self.keys[last]
+            self.keys[position] = moved
+            self._vectors[position] = self._vectors[last]
+            self._positions[moved] = position
+        self.keys.pop()
+
+    def search(self, vector: np.ndarray) -> Tuple[Optional[Tuple[str, str]], float]:
+        if not self.keys:
+            return None, 0.0
+        similarities = self._vectors[:len(self.keys)] @ vector
+        best = int(np.argmax(similarities))
+        return self.keys[best], float(similarities[best])
+
+class ResponseCache():
+    """
+    Cache of model replies to chat messages, so a user (or a group) asking the same thing again doesn't
+    pay for another generation. Entries are per scope and keyed on the user's message, not the full
+    prompt, which carries the current date and time. The prompt also names the sender and the group,
+    so scopes are per model and per private chat or group, and a reply never reaches another chat.
+
+    Lookups try an exact match on the normalized message first, then, if `semantic` is on, the
+    most similar cached message by embedding (a small CPU embedding model via GPT4All), accepted
+    at `similarity` or above. Entries expire after `ttl` seconds, the least recently used are
+    evicted past `max_entries`, and time-sensitive messages ("what's the weather today") bypass
+    the cache entirely.
+
+    Usage:
+        reply = await response_cache.get_or_generate(scope, message, lambda: tool_dispatcher.respond(model, messages, max_tokens=512))
+    """
+
+    def __init__(self, enabled: bool, ttl: float, max_entries: int, semantic: bool = False, similarity: float = 0.95,
+                 embedding_model: Optional[str] = None):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.similarity = similarity
+        self.embedding_model = embedding_model
+        # (scope, normalized message) -> (reply, expires_at); ordered from least to most recently used
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._embedder = None
+        self._embed_lock = threading.Lock()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        with self._embed_lock:
+            if self._embedder is None:
+                try:
+                    from gpt4all import Embed4All
+                    self._embedder = Embed4All(self.embedding_model, model_path=Config.LLM_MODEL_PATH, allow_download=Config.LLM_ALLOW_DOWNLOAD)
+                except Exception as e:
+                    logger.warning("Can't load embedding model %s, disabling the semantic response cache: %s", self.embedding_model, e)
+                    self.semantic = False
+                    return None
+            vector = np.asarray(self._embedder.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        self._entries.pop(key, None)
+        index = self._indexes.get(key[0])
+        if index:
+            index.remove(key)
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        reply, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return reply
+
+    async def get(self, scope: str, message: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Look up a reply. Returns the reply (or None) and the message embedding, if one was computed,
+        so `put` doesn't have to compute it again.
+        """
+        key = (scope, normalize_message(message))
+        reply = self._lookup(key)
+        record_cache("response.exact", reply is not None)
+        if reply is not None or not self.semantic:
+            return reply, None
+
+        vector = await asyncio.to_thread(self._embed, key[1])
+        if vector is None:
+            return None, None
+        index = self._indexes.get(scope)
+        match, similarity = index.search(vector) if index else (None, 0.0)
+        reply = self._lookup(match) if match and similarity >= self.similarity else None
+        record_cache("response.semantic", reply is not None)
+        if reply is not None:
+            logger.debug("Semantic cache hit (%.3f): '%s' ~ '%s'", similarity, key[1], match[1])
+        return reply, vector
+
+    def put(self, scope: str, message: str, reply: str, vector: Optional[np.ndarray] = None) -> None:
+        key = (scope, normalize_message(message))
+        self._entries[key] = (reply, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if vector is not None:
+            self._indexes.setdefault(scope, VectorIndex()).add(key, vector)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, scope: Optional[str] = None) -> None:
+        """
+        Drop every entry, or only those of one scope.
+        """
+        for key in [key for key in self._entries if scope is None or key[0] == scope]:
+            self._remove(key)
+
+    def is_cacheable(self, message: str) -> bool:
+        return self.enabled and bool(message.strip()) and not TIME_SENSITIVE_PATTERN.search(message)
+
+    async def get_or_generate(self, scope: str, message: str, generate: Callable[[], Awaitable[Tuple[str, bool]]]) -> str:
+        """
+        Return the cached reply to `message` in `scope`, or call `generate` and cache what it returns.
+        `generate` returns the reply and whether tools were called for it, like `ToolDispatcher.respond`.
+        Those replies aren't cached: one made from a web search is only right for as long as the results are.
+        """
+        if not self.is_cacheable(message):
+            if self.enabled:
+                CACHE_REQUESTS.inc(cache="response", result="bypass")
+            reply, _ = await generate()
+            return reply
+
+        reply, vector = await self.get(scope, message)
+        if reply is not None:
+            return reply
+        reply, used_tools = await generate()
+        if not used_tools and reply and reply.strip():
+            self.put(scope, message, reply, vector)
+        return reply
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "indexed": sum(len(index.keys) for index in self._indexes.values())}
+
+# Shared by the chat handlers
+response_cache = ResponseCache(
+    Config.RESPONSE_CACHE_ENABLED,
+    Config.RESPONSE_CACHE_TTL,
+    Config.RESPONSE_CACHE_MAX_ENTRIES,
+    semantic=Config.RESPONSE_CACHE_SEMANTIC,
+    similarity=Config.RESPONSE_CACHE_SIMILARITY,
+    embedding_model=Config.RESPONSE_CACHE_EMBEDDING_MODEL,
+)
+
+RESPONSE_CACHE_ENTRIES = registry.gauge("bot_response_cache_entries", "Replies held in the response cache.")
+
+def collect_response_cache_metrics() -> None:
+    RESPONSE_CACHE_ENTRIES.set(response_cache.get_stats()["entries"])
+
+registry.add_collector(collect_response_cache_metrics)
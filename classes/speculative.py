@@ -0,0 +1,207 @@
+import codecs
+import logging
+from typing import Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+def token_distribution(logits: np.ndarray, context: Sequence[int], temp: float, top_k: int, top_p: float,
+                       repeat_penalty: float, repeat_last_n: int) -> np.ndarray:
+    """
+    Next-token probabilities after the same repeat penalty, top-k, top-p and temperature steps
+    GPT4All applies, so draft and target tokens are drawn the way the bot always drew them.
+    A temperature of 0 gives a one-hot distribution (greedy decoding).
+    """
+    logits = np.array(logits, dtype=np.float64)
+    if repeat_penalty != 1 and repeat_last_n and len(context):
+        recent = np.unique(np.asarray(context[-repeat_last_n:], dtype=np.intp))
+        values = logits[recent]
+        logits[recent] = np.where(values > 0, values / repeat_penalty, values * repeat_penalty)
+
+    probs = np.zeros_like(logits)
+    if temp <= 0:
+        probs[int(np.argmax(logits))] = 1.0
+        return probs
+
+    # Only the top-k candidates can be drawn, so the rest of the vocabulary is never sorted
+    candidates = np.argpartition(logits, -top_k)[-top_k:] if 0 < top_k < len(logits) else np.arange(len(logits))
+    candidates = candidates[np.argsort(-logits[candidates])]
+    weights = np.exp((logits[candidates] - logits[candidates[0]]) / temp)
+    weights /= weights.sum()
+    if top_p < 1:
+        keep = int(np.searchsorted(np.cumsum(weights), top_p)) + 1
+        candidates, weights = candidates[:keep], weights[:keep] / weights[:keep].sum()
+    probs[candidates] = weights
+    return probs
+
+class SpeculativeDecoder():
+    """
+    Speculative decoding on llama.cpp. A small draft model proposes `draft_tokens` tokens one at a
+    time, the target model scores all of them in a single batch, and the longest prefix it agrees
+    with is kept plus one token drawn from the target itself. Draft tokens are accepted by
+    speculative sampling (accept with probability min(1, p/q), otherwise resample from the
+    residual), so the output follows the target model's distribution exactly; only the number of
+    target forward passes changes.
+
+    When the acceptance rate (a moving average over verification rounds) drops below
+    `min_acceptance`, drafting costs more than it saves, so the decoder falls back to plain
+    decoding and tries one speculative round again every `retry_tokens` tokens.
+
+    Both models must share a tokenizer, e.g. a Llama 2 13B target with a Llama 2 based 1B draft.
+    Not thread-safe; callers serialize generations per instance.
+    """
+
+    def __init__(self, model_path: str, draft_path: str, n_ctx: int = 2048, n_threads: Optional[int] = None,
+                 draft_tokens: int = 4, min_acceptance: float = 0.4, retry_tokens: int = 128, seed: Optional[int] = None):
+        # Logits are read from `Llama.scores`, which llama-cpp-python only fills with logits_all. The target
+        # needs every position of a verification batch anyway; the draft reads the row of its last token.
+        self.target = Llama(model_path, n_ctx=n_ctx, n_threads=n_threads, logits_all=True, verbose=False)
+        self.draft = Llama(draft_path, n_ctx=n_ctx, n_threads=n_threads, logits_all=True, verbose=False)
+        if self.target.n_vocab() != self.draft.n_vocab():
+            raise ValueError(f"Draft model vocabulary ({self.draft.n_vocab()} tokens) differs from the target's ({self.target.n_vocab()} tokens)")
+
+        self.n_ctx = n_ctx
+        self.draft_tokens = draft_tokens
+        self.min_acceptance = min_acceptance
+        self.retry_tokens = retry_tokens
+        self.acceptance = 1.0
+        self._plain_tokens = 0
+        self.last_stats = {}
+        self._random = np.random.default_rng(seed)
+        self._prefix: Tuple[str, List[int]] = ("", [])
+
+    @staticmethod
+    def _sync(model: Llama, tokens: List[int]) -> None:
+        """
+        Bring the model's KV cache to exactly `tokens`, reusing the longest prefix it has already
+        evaluated. At least the last token is always evaluated so fresh logits are available.
+        """
+        limit = min(model.n_tokens, len(tokens) - 1)
+        mismatch = np.flatnonzero(model.input_ids[:limit] != np.asarray(tokens[:limit], dtype=np.intc))
+        model.n_tokens = int(mismatch[0]) if len(mismatch) else limit
+        model.eval(tokens[model.n_tokens:])
+
+    def _tokenize(self, prompt: str, prefix: str) -> List[int]:
+        """
+        Tokenize the prefix and the prompt separately, so the prefix's tokens (and the KV cache
+        entries computed for them) are the same whatever follows it.
+        """
+        if prefix != self._prefix[0]:
+            self._prefix = (prefix, self.target.tokenize(prefix.encode("utf-8")) if prefix else [])
+        return self._prefix[1] + self.target.tokenize(prompt.encode("utf-8"), add_bos=not prefix)
+
+    def warm(self, prefix: str) -> None:
+        """
+        Evaluate `prefix` in both models ahead of the requests that start with it.
+        """
+        tokens = self._tokenize("", prefix)
+        self._sync(self.target, tokens)
+        self._sync(self.draft, tokens)
+
+    def _draft_logits(self) -> np.ndarray:
+        return self.draft.scores[self.draft.n_tokens - 1]
+
+    def _sample(self, probs: np.ndarray) -> int:
+        return int(self._random.choice(len(probs), p=probs))
+
+    def _update_acceptance(self, proposed: int, accepted: int) -> None:
+        self.acceptance = 0.8 * self.acceptance + 0.2 * (accepted / proposed)
+
+    def _speculating(self) -> bool:
+        if self.acceptance >= self.min_acceptance:
+            return True
+        if self._plain_tokens >= self.retry_tokens:
+            # Probe with one speculative round; a good one lifts the average back over the threshold
+            self._plain_tokens = 0
+            return True
+        return False
+
+    def generate(self, prompt: str, max_tokens: int, temp: float = 0.7, top_k: int = 40, top_p: float = 0.4,
+                 repeat_penalty: float = 1.18, repeat_last_n: int = 64, prefix: str = "") -> Iterator[str]:
+        """
+        Generate up to `max_tokens` tokens, yielding each token's text once its verification round settles it.
+        The sampling defaults match GPT4All's. Counters for the finished generation are left in
+        `last_stats`: "completion_tokens", "draft_tokens" proposed, "accepted_tokens" kept,
+        verification "rounds" and "fallback_tokens" decoded without drafting.
+
+        Args:
+            prompt: The prompt text, after `prefix`.
+            max_tokens: Maximum number of tokens to generate.
+            prefix: Text shared with other requests, e.g. the system prompt. Its evaluated state
+                stays in the KV cache between generations, so only the prompt after it is evaluated.
+        """
+        stats = self.last_stats = {"completion_tokens": 0, "draft_tokens": 0, "accepted_tokens": 0, "rounds": 0, "fallback_tokens": 0}
+        sampling = (temp, top_k, top_p, repeat_penalty, repeat_last_n)
+        context = self._tokenize(prompt, prefix)
+        if len(context) >= self.n_ctx:
+            logger.error("The prompt is %d tokens and the context window is %d", len(context), self.n_ctx)
+            return
+
+        eos = self.target.token_eos()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pieces = []
+
+        def emit(token: int) -> bool:
+            if token == eos:
+                return False
+            context.append(token)
+            stats["completion_tokens"] += 1
+            pieces.append(decoder.decode(self.target.detokenize([token])))
+            return stats["completion_tokens"] < max_tokens
+
+        running = True
+        while running and len(context) < self.n_ctx:
+            # Up to k drafts plus one target token per round, within max_tokens and the context window
+            speculating = self._speculating()
+            k = min(self.draft_tokens, max_tokens - stats["completion_tokens"] - 1, self.n_ctx - len(context)) if speculating else 0
+
+            # Draft: propose k tokens one by one from the small model
+            drafts, draft_probs = [], []
+            if k:
+                self._sync(self.draft, context)
+                for i in range(k):
+                    q = token_distribution(self._draft_logits(), context + drafts, *sampling)
+                    drafts.append(self._sample(q))
+                    draft_probs.append(q)
+                    if i < k - 1:
+                        self.draft.eval(drafts[-1:])
+
+            # Verify: one target pass scores the last context token and every draft token
+            self._sync(self.target, context + drafts)
+            base = len(context) - 1
+            target_probs = [token_distribution(self.target.scores[base + i], context + drafts[:i], *sampling) for i in range(k + 1)]
+
+            accepted = 0
+            for i, token in enumerate(drafts):
+                p, q = target_probs[i], draft_probs[i]
+                if self._random.random() < min(1.0, p[token] / q[token]):
+                    accepted += 1
+                    running = emit(token)
+                    if not running:
+                        break
+                    continue
+                # Rejected: draw from where the target puts more mass than the draft
+                residual = np.maximum(p - q, 0.0)
+                total = residual.sum()
+                running = emit(self._sample(residual / total if total > 0 else p))
+                break
+            else:
+                # Every draft token was accepted, so the target's next-token distribution comes for free
+                running = emit(self._sample(target_probs[k]))
+
+            if k:
+                stats["rounds"] += 1
+                stats["draft_tokens"] += k
+                stats["accepted_tokens"] += accepted
+                self._update_acceptance(k, accepted)
+            elif not speculating:
+                stats["fallback_tokens"] += 1
+                self._plain_tokens += 1
+
+            yield from filter(None, pieces)
+            pieces.clear()
+
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
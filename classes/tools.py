@@ -0,0 +1,247 @@
+import re
+import json
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from classes.admission_controller import admission_controller
+from classes.calculations import DateTime
+from classes.handlers.youtube_handler import YouTubeHandler
+from classes.transcript_service import transcript_service
+from classes.weather_service import weather_service
+from classes.metrics import record_cache
+from classes.tracing import tracer
+from scripts.prompts import SYSTEM_PROMPT
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Hermes models are tuned to call functions as JSON inside <tool_call> tags; a call cut off by max_tokens has no closing tag
+TOOL_CALL_PATTERN = re.compile(r"<tool_call>\s*(.*?)\s*(?:</tool_call>|$)", re.DOTALL)
+
+TOOLS_PROMPT = (
+    "You can call functions to look things up instead of telling the user to use a command. The functions are "
+    "described inside <tools></tools> tags: <tools>{tools}</tools> To call a function, reply with only a JSON object "
+    "with its name and arguments inside <tool_call></tool_call> tags, for example: <tool_call>{example}</tool_call> "
+    "You can call several functions at once, one <tool_call> each. Their results come back inside "
+    "<tool_response></tool_response> tags; answer the user from them. Don't call a function for anything you already know."
+)
+
+class Tool():
+    def __init__(self, name: str, description: str, parameters: Dict, function: Callable[..., Awaitable], command: Optional[str] = None):
+        self.name = name
+        self.description = description
+        # JSON Schema of the arguments
+        self.parameters = parameters
+        self.function = function
+        # The expensive command it does the work of, whose quota each call is charged against
+        self.command = command
+
+    def schema(self) -> Dict:
+        return {"type": "function", "function": {"name": self.name, "description": self.description, "parameters": self.parameters}}
+
+class ToolDispatcher():
+    """
+    Lets the chat model call async functions (tools) such as the weather or a web search.
+
+    The tools are described in the system prompt, after the persona. When the model's reply contains
+    <tool_call> blocks, the calls are run in parallel, their results are sent back in
+    <tool_response> blocks and the model is prompted again, up to `max_rounds` times.
+    Results are kept for the rest of the turn, so a call the model repeats, in the same reply or a
+    later one, isn't run again.
+
+    The tool descriptions never change, so the system prompt stays byte-identical across requests
+    and its evaluated state is still reused (see ModelRouter.preload).
+
+    Usage:
+        @tool_dispatcher.tool("get_current_time", "The current time", {"type": "object", "properties": {}})
+        async def get_current_time():
+            return DateTime.get_current_time()
+
+        reply = await tool_dispatcher.chat(model, messages, max_tokens=512, user_id=user_id)
+        reply, used_tools = await tool_dispatcher.respond(model, messages, max_tokens=512, user_id=user_id)
+    """
+
+    def __init__(self, enabled: bool, max_rounds: int, timeout: float):
+        self.enabled = enabled
+        self.max_rounds = max_rounds
+        self.timeout = timeout
+        self.tools: Dict[str, Tool] = {}
+
+    def tool(self, name: str, description: str, parameters: Dict, command: Optional[str] = None):
+        """
+        Decorator registering an async function as a tool. A tool doing the work of an expensive
+        command (e.g. "summarize") names it as `command`, so a call goes through the same admission
+        control as the command itself and can't be used to get around its quota.
+        """
+        def decorator(function):
+            self.tools[name] = Tool(name, description, parameters, function, command)
+            return function
+        return decorator
+
+    def system_prompt(self, persona: str) -> str:
+        """
+        The persona followed by the tool descriptions, or just the persona if tools are off.
+        """
+        if not self.enabled or not self.tools:
+            return persona
+        tools = json.dumps([tool.schema() for tool in self.tools.values()])
+        example = json.dumps({"name": next(iter(self.tools)), "arguments": {}})
+        return f"{persona}\n\n{TOOLS_PROMPT.format(tools=tools, example=example)}"
+
+    @staticmethod
+    def parse_tool_calls(text: str) -> Tuple[List[Dict], str]:
+        """
+        The well-formed tool calls in a model reply, and the reply without them.
+        """
+        calls = []
+        for match in TOOL_CALL_PATTERN.finditer(text):
+            try:
+                call = json.loads(match.group(1))
+            except ValueError:
+                logger.warning("Ignoring a malformed tool call: %s", match.group(1))
+                continue
+            if isinstance(call, dict) and isinstance(call.get("name"), str):
+                arguments = call.get("arguments")
+                calls.append({"name": call["name"], "arguments": arguments if isinstance(arguments, dict) else {}})
+        return calls, TOOL_CALL_PATTERN.sub("", text).strip()
+
+    async def _call(self, tool: Tool, arguments: Dict, user_id: Optional[int]):
+        if tool.command is None:
+            return await tool.function(**arguments)
+        if user_id is None:
+            return {"error": "This function isn't available here"}
+
+        refusals = []
+        async def refuse(text: str) -> None:
+            refusals.append(text)
+
+        async with admission_controller.acquire(user_id, tool.command, refuse) as admitted:
+            if not admitted:
+                return {"error": refusals[-1]}
+            return await tool.function(**arguments)
+
+    async def _run(self, call: Dict, user_id: Optional[int]):
+        tool = self.tools.get(call["name"])
+        if tool is None:
+            return {"error": f"There is no function called {call['name']}"}
+        try:
+            async with tracer.span(f"tool.{tool.name}"):
+                result = await asyncio.wait_for(self._call(tool, call["arguments"], user_id), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Tool %s timed out after %.0fs", tool.name, self.timeout)
+            return {"error": "The function took too long"}
+        except Exception as e:
+            logger.warning("Tool %s failed with arguments %s: %s", tool.name, call["arguments"], e, exc_info=True)
+            return {"error": str(e)}
+        return result
+
+    async def _run_all(self, calls: List[Dict], results: Dict[str, asyncio.Task], user_id: Optional[int]) -> str:
+        """
+        Run the calls not already in this turn's `results` concurrently, and render every call's result.
+        """
+        keys = []
+        for call in calls:
+            key = json.dumps([call["name"], call["arguments"]], sort_keys=True)
+            record_cache("tools", key in results)
+            if key not in results:
+                results[key] = asyncio.ensure_future(self._run(call, user_id))
+            keys.append(key)
+        contents = await asyncio.gather(*(results[key] for key in keys))
+        return "\n".join(
+            f"<tool_response>\n{json.dumps({'name': call['name'], 'content': content})}\n</tool_response>"
+            for call, content in zip(calls, contents)
+        )
+
+    async def respond(self, model, messages: List[Dict[str, str]], max_tokens: int, user_id: Optional[int] = None, **params) -> Tuple[str, bool]:
+        """
+        `model.chat`, with the tools described after the system messages and the calls in the replies run
+        on behalf of `user_id`. Returns the reply and whether any tool was called for it; such a reply
+        depends on what the tools returned at the time, not only on the messages.
+        """
+        if not self.enabled or not self.tools:
+            return await model.chat(messages, max_tokens=max_tokens, **params), False
+
+        messages = [
+            {"role": "system", "content": self.system_prompt(message["content"])} if message["role"] == "system" else message
+            for message in messages
+        ]
+        results: Dict[str, asyncio.Task] = {}
+        for attempt in range(self.max_rounds + 1):
+            reply = await model.chat(messages, max_tokens=max_tokens, **params)
+            calls, text = self.parse_tool_calls(reply)
+            if not calls:
+                return text, bool(results)
+            if attempt == self.max_rounds:
+                logger.warning("The model was still calling tools after %d rounds", self.max_rounds)
+                return text or "Sorry, I couldn't find that out.", True
+            logger.debug("Tool calls: %s", calls)
+            responses = await self._run_all(calls, results, user_id)
+            messages = messages + [{"role": "assistant", "content": reply.strip()}, {"role": "user", "content": responses}]
+
+    async def chat(self, model, messages: List[Dict[str, str]], max_tokens: int, user_id: Optional[int] = None, **params) -> str:
+        """
+        The reply from `respond`.
+        """
+        reply, _ = await self.respond(model, messages, max_tokens, user_id, **params)
+        return reply
+
+tool_dispatcher = ToolDispatcher(Config.TOOLS_ENABLED, Config.TOOLS_MAX_ROUNDS, Config.TOOLS_TIMEOUT)
+
+def system_message() -> Dict[str, str]:
+    """
+    The system message for requests to the chat models that don't go through the dispatcher, like
+    search answers and summaries: the persona and tool descriptions chat replies get. Every request
+    then starts with the same prompt prefix, which a local model evaluates once at startup and
+    reuses (see ModelRouter.preload) instead of evaluating it again after each of these.
+    """
+    return {"role": "system", "content": tool_dispatcher.system_prompt(SYSTEM_PROMPT)}
+
+@tool_dispatcher.tool(
+    "get_current_weather",
+    "Get the current weather in a city",
+    {"type": "object", "properties": {"city": {"type": "string", "description": "The city, e.g. Pittsburgh"}}, "required": ["city"]},
+)
+async def get_current_weather(city: str):
+    report = await weather_service.current(city)
+    if report is None:
+        return {"error": f"Unknown city: {city}"}
+    return weather_service.describe(report)
+
+@tool_dispatcher.tool("get_current_date", "Get today's date in the US Eastern time zone", {"type": "object", "properties": {}})
+async def get_current_date():
+    return DateTime.get_current_date()
+
+@tool_dispatcher.tool("get_current_time", "Get the current time in the US Eastern time zone", {"type": "object", "properties": {}})
+async def get_current_time():
+    return DateTime.get_current_time()
+
+@tool_dispatcher.tool(
+    "search_web",
+    "Search the web for recent or up to date information, returning the top results' titles, links and snippets",
+    {"type": "object", "properties": {"query": {"type": "string", "description": "The search query"}}, "required": ["query"]},
+    command="search",
+)
+async def search_web(query: str):
+    # Imported here because the search handler's ChatGPT builds its prompts with system_message
+    from classes.handlers.search_handler import SearchHandler
+    results = await SearchHandler().bing_search(query, Config.BING_API_KEY)
+    if not results:
+        return {"error": f"No results for {query}"}
+    return results[:Config.TOOLS_SEARCH_RESULTS]
+
+@tool_dispatcher.tool(
+    "summarize_youtube_video",
+    "Summarize a YouTube video from its captions",
+    {"type": "object", "properties": {"url": {"type": "string", "description": "The video's YouTube link"}}, "required": ["url"]},
+    command="summarize",
+)
+async def summarize_youtube_video(url: str):
+    video_id = YouTubeHandler.get_video_id(url)
+    if not video_id:
+        return {"error": f"Not a YouTube video link: {url}"}
+
+    # Imported here because ChatGPT builds its prompts with system_message
+    from classes.chat_gpt import ChatGPT
+    # Summaries are shared with /summarize, so a video is only summarized once
+    summary = await transcript_service.summarize(video_id, ChatGPT().call_gpt)
+    return summary or {"error": "The video has no captions or couldn't be summarized"}
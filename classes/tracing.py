@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import uuid
+import queue
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from collections import deque
+from typing import Any, Dict, List
+from scripts.logging import request_context
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# The innermost open span of the current task (or of the thread a task handed work to)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span():
+    """
+    One timed stage of a request. Works as a sync or async context manager.
+
+    Usage:
+        with tracer.span("deepgram.transcribe", bytes=len(audio)):
+            ...
+        async with tracer.span("telegram.upload"):
+            ...
+    """
+
+    def __init__(self, tracer, name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self.trace_id = None
+        self.start_time = None
+        self.duration_ms = None
+        self.status = "ok"
+        self._token = None
+        self._start = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self):
+        parent = current_span.get()
+        context = request_context.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else context.get("request_id") or uuid.uuid4().hex[:16]
+        for key in ("user_id", "chat_id"):
+            if key in context:
+                self.attributes.setdefault(key, context[key])
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        self.tracer.export(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class RingBufferExporter():
+    """
+    Keeps the most recent spans in memory, e.g. for a debug endpoint or the benchmark harness.
+    """
+
+    def __init__(self, size: int = 2048):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span.to_dict())
+
+    def recent(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return list(self.spans)[-limit:]
+
+    def traces(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Group the buffered spans by trace ID.
+        """
+        grouped = {}
+        for span in list(self.spans):
+            grouped.setdefault(span["trace_id"], []).append(span)
+        return grouped
+
+class JsonlExporter():
+    """
+    Appends spans to a JSON Lines file from a background thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name="JsonlExporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span.to_dict())
+
+    def _write_loop(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            record = self._queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+                    # Drain whatever else queued up while the file was open
+                    while not self._queue.empty():
+                        f.write(json.dumps(self._queue.get(), default=str) + "\n")
+            except Exception as e:
+                logger.warning("Could not write spans to %s: %s", self.path, e)
+
+class OpenTelemetryExporter():
+    """
+    Re-emits finished spans through the OpenTelemetry SDK, if it is installed and configured
+    (e.g. with an OTLP exporter via the standard OTEL_* environment variables).
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._tracer = trace.get_tracer("hermesgpt")
+
+    def export(self, span: Span) -> None:
+        start_ns = int(span.start_time * 1e9)
+        attributes = {key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in span.attributes.items()}
+        attributes.update({"request_id": span.trace_id or "", "span_id": span.span_id, "parent_id": span.parent_id or ""})
+        otel_span = self._tracer.start_span(span.name, start_time=start_ns, attributes=attributes)
+        otel_span.end(end_time=start_ns + int(span.duration_ms * 1e6))
+
+class Tracer():
+    """
+    Lightweight per-request tracer. Spans pick up the request/user/chat IDs bound by the update
+    processor and nest under whichever span is open in the current task.
+    """
+
+    def __init__(self, exporters: List[Any] = None):
+        self.exporters = exporters or []
+        self.on_span_end = []
+
+    def span(self, name: str, **attributes) -> Span:
+        return Span(self, name, attributes)
+
+    def trace(self, name: str = None):
+        """
+        Decorator that wraps a sync or async function in a span.
+        """
+        def decorator(func):
+            span_name = name or func.__qualname__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_exporter(self, exporter_class):
+        return next((exporter for exporter in self.exporters if isinstance(exporter, exporter_class)), None)
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning("Span exporter %s failed: %s", type(exporter).__name__, e)
+        for callback in self.on_span_end:
+            callback(span)
+
+def build_tracer() -> Tracer:
+    exporters = []
+    for name in filter(None, (part.strip() for part in Config.TRACE_EXPORTERS.split(","))):
+        if name == "ring":
+            exporters.append(RingBufferExporter(Config.TRACE_RING_SIZE))
+        elif name == "jsonl":
+            exporters.append(JsonlExporter(Config.TRACE_JSONL_PATH))
+        elif name == "otel":
+            try:
+                exporters.append(OpenTelemetryExporter())
+            except ImportError:
+                logger.warning("TRACE_EXPORTERS includes 'otel' but opentelemetry is not installed")
+        else:
+            logger.warning("Unknown trace exporter: %s", name)
+    return Tracer(exporters)
+
+tracer = build_tracer()
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from youtube_transcript_api import YouTubeTranscriptApi
+from classes.metrics import CACHE_REQUESTS, record_cache
+from classes.tracing import tracer
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# YouTube video ids are 11 URL-safe base64 characters, which also makes them safe file names
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def format_timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class TranscriptService():
+    """
+    English captions of YouTube videos, and the summaries made from them, by video id.
+
+    The caption list is fetched with the blocking youtube-transcript-api in a worker thread. Each
+    video is kept as one JSON file in `cache_dir`, holding the caption segments with their
+    timestamps and any summaries, so a video many users summarize costs one fetch and one
+    generation, even when they ask at the same time. The most recently used entries are also
+    kept in memory.
+
+    Usage:
+        transcript = await transcript_service.get(video_id)
+        text = transcript_service.text(transcript) if transcript else None
+        summary = await transcript_service.summarize(video_id, chat_gpt.call_gpt)
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        # video id -> {"video_id", "language", "segments": [{"start", "duration", "text"}], "summaries": {style: text}}
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        # "<video id>:<style>" -> the summary being generated
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def _read(self, video_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(video_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Could not read the cached transcript of %s: %s", video_id, e)
+            return None
+
+    def _write(self, entry: Dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(entry["video_id"])
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    async def _save(self, entry: Dict) -> None:
+        try:
+            # A copy, since summaries can be added while it's being written
+            await asyncio.to_thread(self._write, {**entry, "summaries": dict(entry["summaries"])})
+        except Exception as e:
+            logger.warning("Could not save the transcript of %s: %s", entry["video_id"], e)
+
+    @staticmethod
+    def _fetch(video_id: str) -> Dict:
+        transcript = YouTubeTranscriptApi.list_transcripts(video_id).find_generated_transcript(language_codes=['en'])
+        segments = [
+            {"start": round(line["start"], 2), "duration": round(line["duration"], 2), "text": line["text"]}
+            for line in transcript.fetch()
+        ]
+        return {"video_id": video_id, "language": transcript.language_code, "segments": segments, "summaries": {}}
+
+    def _remember(self, entry: Dict) -> Dict:
+        self._entries[entry["video_id"]] = entry
+        self._entries.move_to_end(entry["video_id"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def _cached(self, video_id: str) -> Optional[Dict]:
+        entry = self._entries.get(video_id)
+        if entry is not None:
+            self._entries.move_to_end(video_id)
+            return entry
+        entry = await asyncio.to_thread(self._read, video_id)
+        return self._remember(entry) if entry is not None else None
+
+    async def get(self, video_id: str) -> Optional[Dict]:
+        """
+        The cached or freshly fetched transcript of `video_id`, or None if it has no English captions.
+        """
+        if not VIDEO_ID_PATTERN.match(video_id):
+            return None
+        entry = await self._cached(video_id)
+        record_cache("youtube.transcript", entry is not None)
+        if entry is not None:
+            return entry
+
+        try:
+            async with tracer.span("youtube.transcript", video_id=video_id):
+                entry = await asyncio.to_thread(self._fetch, video_id)
+        except Exception:
+            logger.exception("An error occurred while getting the caption text")
+            return None
+        await self._save(entry)
+        return self._remember(entry)
+
+    async def summary(self, video_id: str, style: str = "default") -> Optional[str]:
+        """
+        The stored summary of `video_id` in `style`, without fetching or generating anything.
+        """
+        if not VIDEO_ID_PATTERN.match(video_id):
+            return None
+        entry = await self._cached(video_id)
+        return entry["summaries"].get(style) if entry is not None else None
+
+    async def store_summary(self, video_id: str, summary: str, style: str = "default") -> None:
+        entry = await self._cached(video_id)
+        if entry is None:
+            return
+        entry["summaries"][style] = summary
+        await self._save(entry)
+
+    async def _summarize(self, video_id: str, generate: Callable[[str], Awaitable[Optional[str]]], style: str) -> Optional[str]:
+        transcript = await self.get(video_id)
+        if transcript is None:
+            return None
+        summary = await generate(self.text(transcript))
+        if summary:
+            await self.store_summary(video_id, summary, style)
+        return summary
+
+    async def summarize(self, video_id: str, generate: Callable[[str], Awaitable[Optional[str]]], style: str = "default") -> Optional[str]:
+        """
+        The summary of `video_id` in `style`: the stored one, or `generate(caption_text)` once it's
+        been stored. Requests for a video that is being summarized wait for that summary instead of
+        making their own. None if the video has no captions or `generate` fails.
+        """
+        summary = await self.summary(video_id, style)
+        if summary is not None:
+            record_cache("youtube.summary", True)
+            return summary
+        if not VIDEO_ID_PATTERN.match(video_id):
+            return None
+
+        key = f"{video_id}:{style}"
+        future = self._in_flight.get(key)
+        if future is None:
+            record_cache("youtube.summary", False)
+            future = asyncio.ensure_future(self._summarize(video_id, generate, style))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            CACHE_REQUESTS.inc(cache="youtube.summary", result="coalesced")
+        # A requester giving up must not cancel the summary for everyone else
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def text(transcript: Dict) -> str:
+        return " ".join(segment["text"] for segment in transcript["segments"])
+
+    @staticmethod
+    def timestamped_text(transcript: Dict) -> str:
+        """
+        One caption segment per line, each starting with its time in the video, e.g. "[1:05] and then".
+        """
+        return "\n".join(f"[{format_timestamp(segment['start'])}] {segment['text']}" for segment in transcript["segments"])
+
+# Shared so every handler uses the same cache
+transcript_service = TranscriptService(Config.YOUTUBE_CACHE_DIR, Config.YOUTUBE_CACHE_MAX_ENTRIES)
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from classes.concurrency import WaitStats
+from scripts.logging import bind_request_context
+from classes.tracing import tracer
+from classes.metrics import classify_update, UPDATES_TOTAL, UPDATE_DURATION, COMMANDS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently while keeping updates from the same chat
+    strictly in arrival order.
+
+    PTB acquires the base semaphore before `do_process_update` is called, so it is sized to
+    `max_pending_updates` and only bounds how many updates may be waiting. The actual cap on running
+    updates is applied after the per-chat lock is taken; otherwise a burst from one chat would hold
+    every slot while waiting on its own lock and stall all other chats.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 1024):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running_updates = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+        self.running_updates = 0
+        self.pending_updates = 0
+        self.wait_stats = WaitStats()
+
+    @staticmethod
+    def get_chat_key(update: object) -> Optional[int]:
+        """
+        Return the key updates are ordered by: the chat ID, falling back to the user ID for updates without a chat.
+        """
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Each update runs in its own task, so the logging context set here is scoped to it
+        bind_request_context(update)
+        chat_key = self.get_chat_key(update)
+        enqueued_at = time.perf_counter()
+        self.pending_updates += 1
+
+        if chat_key is None:
+            await self._run(update, coroutine, enqueued_at)
+            return
+
+        lock = self._chat_locks.setdefault(chat_key, asyncio.Lock())
+        self._chat_waiters[chat_key] = self._chat_waiters.get(chat_key, 0) + 1
+        try:
+            async with lock:
+                await self._run(update, coroutine, enqueued_at)
+        finally:
+            self._chat_waiters[chat_key] -= 1
+            if not self._chat_waiters[chat_key]:
+                del self._chat_waiters[chat_key]
+                del self._chat_locks[chat_key]
+
+    async def _run(self, update: object, coroutine: Awaitable[Any], enqueued_at: float) -> None:
+        try:
+            await self._running.acquire()
+        finally:
+            self.pending_updates -= 1
+
+        self.running_updates += 1
+        wait = time.perf_counter() - enqueued_at
+        self.wait_stats.record(wait)
+        kind, command = classify_update(update)
+        UPDATES_TOTAL.inc(kind=kind)
+        if command:
+            COMMANDS_TOTAL.inc(command=command)
+        started_at = time.perf_counter()
+        try:
+            with tracer.span("update", queue_wait_ms=round(wait * 1000, 3)):
+                await coroutine
+        except Exception as e:
+            # Handler errors are already routed to the application's error handlers; this only
+            # stops one failed update from breaking the ordering chain of its chat.
+            logger.exception("Unhandled error while processing update: %s", e)
+        finally:
+            UPDATE_DURATION.observe(time.perf_counter() - started_at, kind=kind)
+            self.running_updates -= 1
+            self._running.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running_updates,
+            "pending": self.pending_updates,
+            "active_chats": len(self._chat_locks),
+            "max_running": self.max_running_updates,
+            "wait": self.wait_stats.summary(),
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+import aiohttp
+from classes.city_index import city_index, normalize_city
+from classes.metrics import CACHE_REQUESTS, record_cache
+from classes.tracing import tracer
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+US_STATE_ABBREVIATIONS = {
+    "Alabama": "AL", "Alaska": "AK", "Arizona": "AZ", "Arkansas": "AR", "California": "CA", "Colorado": "CO",
+    "Connecticut": "CT", "Delaware": "DE", "District of Columbia": "DC", "Florida": "FL", "Georgia": "GA",
+    "Hawaii": "HI", "Idaho": "ID", "Illinois": "IL", "Indiana": "IN", "Iowa": "IA", "Kansas": "KS",
+    "Kentucky": "KY", "Louisiana": "LA", "Maine": "ME", "Maryland": "MD", "Massachusetts": "MA",
+    "Michigan": "MI", "Minnesota": "MN", "Mississippi": "MS", "Missouri": "MO", "Montana": "MT",
+    "Nebraska": "NE", "Nevada": "NV", "New Hampshire": "NH", "New Jersey": "NJ", "New Mexico": "NM",
+    "New York": "NY", "North Carolina": "NC", "North Dakota": "ND", "Ohio": "OH", "Oklahoma": "OK",
+    "Oregon": "OR", "Pennsylvania": "PA", "Rhode Island": "RI", "South Carolina": "SC", "South Dakota": "SD",
+    "Tennessee": "TN", "Texas": "TX", "Utah": "UT", "Vermont": "VT", "Virginia": "VA", "Washington": "WA",
+    "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY",
+}
+
+GEOCODE_CACHE_VERSION = 2
+
+class WeatherService():
+    """
+    Current weather by city name from OpenWeatherMap, without blocking the event loop.
+
+    Three things keep upstream calls down:
+        1. Geocoding (city -> coordinates, state and country) never changes, so results are kept
+           for good in memory and in `Config.WEATHER_GEOCODE_CACHE_PATH`, and survive restarts.
+        2. Current conditions are cached per place for `ttl` seconds.
+        3. Concurrent requests for the same city share one upstream call instead of each making their own.
+
+    Names the geocoder doesn't know are corrected with the (US) city index and tried again, so
+    misspelled US cities are still found.
+
+    Usage:
+        report = await weather_service.current("pittsburg")
+        text = weather_service.describe(report) if report else "Unknown city"
+    """
+
+    def __init__(self, ttl: float, geocode_cache_path: str = None):
+        self.ttl = ttl
+        self.geocode_cache_path = geocode_cache_path or Config.WEATHER_GEOCODE_CACHE_PATH
+        # Normalized city name -> place; names the geocoder doesn't know aren't kept
+        self._places: Dict[str, Dict] = {}
+        # "lat,lon" -> (report, expires_at)
+        self._reports: Dict[str, tuple] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._save_task = None
+        self._save_pending = False
+        self._load_places()
+
+    def _load_places(self) -> None:
+        try:
+            with open(self.geocode_cache_path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning("Could not load the geocode cache from %s: %s", self.geocode_cache_path, e)
+            return
+        # Caches from before version 2 sent every name in the US city list to the US, e.g. Paris to Texas
+        if data.get("version") != GEOCODE_CACHE_VERSION:
+            logger.info("Discarding the geocode cache in %s, it was written by an older version", self.geocode_cache_path)
+            return
+        self._places = data["places"]
+
+    def _write_places(self, places) -> None:
+        directory = os.path.dirname(self.geocode_cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.geocode_cache_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": GEOCODE_CACHE_VERSION, "places": places}, f)
+        os.replace(temp_path, self.geocode_cache_path)
+
+    def _schedule_save(self) -> None:
+        # One write in flight at a time; places added meanwhile trigger one more write afterwards
+        self._save_pending = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_loop())
+
+    async def _save_loop(self) -> None:
+        while self._save_pending:
+            self._save_pending = False
+            try:
+                await asyncio.to_thread(self._write_places, dict(self._places))
+            except Exception as e:
+                logger.warning("Could not save the geocode cache to %s: %s", self.geocode_cache_path, e)
+
+    async def _coalesce(self, cache: str, key: str, fetch: Callable[[], Awaitable]):
+        """
+        Run `fetch` once for all callers missing `key` in `cache` at the same time.
+        """
+        key = f"{cache}:{key}"
+        future = self._in_flight.get(key)
+        if future is None:
+            record_cache(cache, False)
+            future = asyncio.ensure_future(fetch())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            CACHE_REQUESTS.inc(cache=cache, result="coalesced")
+        # A caller giving up must not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    async def _get_json(self, span_name: str, path: str, params: Dict) -> object:
+        async with tracer.span(span_name):
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{Config.WEATHER_API_URL}{path}", params={**params, "appid": Config.WEATHER_API_KEY},
+                                       timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    response.raise_for_status()
+                    return await response.json()
+
+    async def geocode(self, city: str) -> Optional[Dict]:
+        """
+        Coordinates, name, state and country of `city`, or None if OpenWeatherMap doesn't know it.
+        """
+        key = normalize_city(city)
+        if key in self._places:
+            record_cache("weather.geocode", True)
+            return self._places[key]
+
+        async def fetch():
+            results = await self._get_json("weather.geocode", "/geo/1.0/direct", {"q": city, "limit": 1})
+            if not results:
+                # Maybe a misspelled US city; the city list is American, so the correction is looked up in the US
+                known = city_index.resolve(city)
+                if known and normalize_city(known) != key:
+                    results = await self._get_json("weather.geocode", "/geo/1.0/direct", {"q": f"{known},US", "limit": 1})
+            place = None
+            if results:
+                result = results[0]
+                place = {
+                    "name": result["name"],
+                    "state": result.get("state", ""),
+                    "country": result.get("country", ""),
+                    "lat": round(result["lat"], 4),
+                    "lon": round(result["lon"], 4),
+                }
+                self._places[key] = place
+                self._schedule_save()
+            return place
+
+        return await self._coalesce("weather.geocode", key, fetch)
+
+    async def current(self, city: str) -> Optional[Dict]:
+        """
+        Current conditions in `city`, or None if the city is unknown. Temperatures are in Celsius and Fahrenheit.
+        """
+        place = await self.geocode(city)
+        if place is None:
+            return None
+
+        key = f"{place['lat']},{place['lon']}"
+        cached = self._reports.get(key)
+        if cached and cached[1] > time.monotonic():
+            record_cache("weather.current", True)
+            return cached[0]
+
+        async def fetch():
+            data = await self._get_json("weather.current", "/data/2.5/weather", {"lat": place["lat"], "lon": place["lon"], "units": "metric"})
+            temperature = data["main"]["temp"]
+            report = {
+                **place,
+                "description": data["weather"][0]["description"],
+                "temperature": round(temperature, 1),
+                "temperature_f": round(temperature * 9 / 5 + 32),
+            }
+            self._reports[key] = (report, time.monotonic() + self.ttl)
+            return report
+
+        return await self._coalesce("weather.current", key, fetch)
+
+    @staticmethod
+    def describe(report: Dict) -> str:
+        region = US_STATE_ABBREVIATIONS.get(report["state"], report["state"]) if report["country"] == "US" else report["country"]
+        place = f"{report['name']}, {region}" if region else report["name"]
+        return f"The current weather in {place} is {report['description']} with a temperature of {report['temperature_f']}°F ({report['temperature']}°C)."
+
+# Shared so every handler uses the same caches
+weather_service = WeatherService(Config.WEATHER_CACHE_TTL)
@@ -0,0 +1,162 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer():
+    """
+    Embedded aiohttp server that receives Telegram updates over a webhook and hands them to the
+    application's update queue, as an alternative to `Application.run_polling()`.
+
+    The request is acknowledged as soon as the update is queued, so Telegram (or a load balancer
+    in front of several replicas) never waits on handler work.
+
+    Every request must carry the secret token Telegram was given with the webhook, or anyone who
+    finds the URL could post updates as an authorized user. Without a configured token, the replica
+    that registers the webhook makes up a random one; the others can't know it, so they refuse to start.
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, application: Application, listen: str = None, port: int = None, url_path: str = None, secret_token: str = None):
+        self.application = application
+        self.listen = listen or Config.WEBHOOK_LISTEN
+        self.port = port or Config.WEBHOOK_PORT
+        self.url_path = "/" + (url_path if url_path is not None else Config.WEBHOOK_PATH).strip("/")
+        self.secret_token = secret_token if secret_token is not None else Config.WEBHOOK_SECRET_TOKEN
+        if not self.secret_token:
+            if not (Config.WEBHOOK_SET_ON_STARTUP and Config.WEBHOOK_URL):
+                raise ValueError("Webhook mode needs WEBHOOK_SECRET_TOKEN unless this replica registers the webhook (WEBHOOK_URL and WEBHOOK_SET_ON_STARTUP)")
+            logger.warning("WEBHOOK_SECRET_TOKEN is not set, registering the webhook with a random one")
+            self.secret_token = secrets.token_urlsafe(32)
+        self.received_updates = 0
+        self.rejected_updates = 0
+        self._runner = None
+
+    def build_app(self) -> web.Application:
+        """
+        Build the aiohttp application with the update and health check routes.
+
+        Returns:
+            web.Application: The configured aiohttp application.
+        """
+        app = web.Application()
+        app.router.add_post(self.url_path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """
+        Validate the secret token, decode the update and put it on the application's update queue.
+
+        Args:
+            request (web.Request): The incoming webhook request from Telegram.
+
+        Returns:
+            web.Response: 200 once the update is queued, 403 for a bad secret token, 400 for a malformed body.
+        """
+        provided_token = request.headers.get(self.SECRET_HEADER, "")
+        if not hmac.compare_digest(provided_token, self.secret_token):
+            self.rejected_updates += 1
+            logger.warning("Rejected webhook request with an invalid secret token from %s", request.remote)
+            return web.Response(status=403)
+
+        try:
+            data = await request.json(loads=json.loads)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            self.rejected_updates += 1
+            logger.warning("Rejected malformed webhook request: %s", e)
+            return web.Response(status=400)
+
+        if update is None:
+            self.rejected_updates += 1
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        self.received_updates += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """
+        Health check endpoint for load balancers.
+        """
+        return web.json_response({
+            "status": "ok" if self.application.running else "starting",
+            "received_updates": self.received_updates,
+            "rejected_updates": self.rejected_updates,
+            "update_queue_size": self.application.update_queue.qsize(),
+        })
+
+    async def start(self) -> None:
+        """
+        Start serving on the configured host and port.
+        """
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info("Webhook server listening on %s:%s%s", self.listen, self.port, self.url_path)
+
+    async def stop(self) -> None:
+        """
+        Stop the web server, if it is running.
+        """
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def set_webhook(self) -> None:
+        """
+        Register the public webhook URL (and secret token) with Telegram.
+        """
+        url = Config.WEBHOOK_URL.rstrip("/") + self.url_path
+        await self.application.bot.set_webhook(
+            url=url,
+            secret_token=self.secret_token,
+            max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Webhook registered at %s", url)
+
+    def run(self) -> None:
+        """
+        Run the application in webhook mode until interrupted or terminated (SIGINT or SIGTERM, which
+        platforms like Heroku send on every restart). Mirrors the lifecycle of `run_polling()`.
+        """
+        loop = asyncio.get_event_loop()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(stop_signal, loop.stop)
+            except NotImplementedError:
+                # Not supported on Windows, where Ctrl+C still raises KeyboardInterrupt
+                pass
+        try:
+            loop.run_until_complete(self.application.initialize())
+            if self.application.post_init:
+                loop.run_until_complete(self.application.post_init(self.application))
+            loop.run_until_complete(self.start())
+            if Config.WEBHOOK_SET_ON_STARTUP and Config.WEBHOOK_URL:
+                loop.run_until_complete(self.set_webhook())
+            loop.run_until_complete(self.application.start())
+            loop.run_forever()
+            logger.info("Webhook server shutting down")
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("Webhook server shutting down")
+        finally:
+            loop.run_until_complete(self.stop())
+            if self.application.running:
+                loop.run_until_complete(self.application.stop())
+            if self.application.post_stop:
+                loop.run_until_complete(self.application.post_stop(self.application))
+            loop.run_until_complete(self.application.shutdown())
+            if self.application.post_shutdown:
+                loop.run_until_complete(self.application.post_shutdown(self.application))
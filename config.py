@@ -1,4 +1,5 @@
 import os
+import json
 import asyncio
 import dropbox
 from auth import refresh_access_token_async, load_allowed_user_ids_from_dropbox
@@ -20,10 +21,156 @@ class Config:
     DROPBOX_CLIENT_ID = os.environ["DROPBOX_CLIENT_ID"]
     DROPBOX_CLIENT_SECRET = os.environ["DROPBOX_CLIENT_SECRET"]
     ALLOWED_USER_IDS = [1264710221, 319092783, 1147606131, 1123137330]
-    DROPBOX_ACCESS_TOKEN = asyncio.run(refresh_access_token_async(DROPBOX_REFRESH_TOKEN, DROPBOX_CLIENT_ID, DROPBOX_CLIENT_SECRET))
+
+    # Deployment mode: "polling" (default) or "webhook"
+    BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+    WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+    WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8443")))
+    WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+    # Required with several replicas; a single replica that registers the webhook makes one up if it's unset
+    WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+    # Only one replica behind a load balancer needs to register the webhook with Telegram
+    WEBHOOK_SET_ON_STARTUP = os.environ.get("WEBHOOK_SET_ON_STARTUP", "true").lower() == "true"
+
+    # Concurrency: updates from different chats run in parallel, capped globally and per backend
+    MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+    MAX_PENDING_UPDATES = int(os.environ.get("MAX_PENDING_UPDATES", "1024"))
+    MAX_CONCURRENT_OPENAI = int(os.environ.get("MAX_CONCURRENT_OPENAI", "4"))
+    MAX_CONCURRENT_STABILITY = int(os.environ.get("MAX_CONCURRENT_STABILITY", "2"))
+    MAX_CONCURRENT_ELEVENLABS = int(os.environ.get("MAX_CONCURRENT_ELEVENLABS", "4"))
+    MAX_CONCURRENT_DEEPGRAM = int(os.environ.get("MAX_CONCURRENT_DEEPGRAM", "4"))
+
+    # Outbound Telegram Bot API limits (see https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+    TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_PRIVATE_CHAT_RATE = float(os.environ.get("TELEGRAM_PRIVATE_CHAT_RATE", "1"))
+    TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.environ.get("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+    TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "3"))
+
+    # Admission control for expensive commands. COMMAND_QUOTAS overrides the defaults per command,
+    # e.g. '{"image": {"per_hour": 10, "burst": 4}}'
+    ADMISSION_STATE_PATH = os.environ.get("ADMISSION_STATE_PATH", "./data/admission_state.json")
+    COMMAND_QUOTAS = json.loads(os.environ.get("COMMAND_QUOTAS", "{}"))
+
+    # Logging: LOG_LEVELS sets per-logger levels, e.g. "classes.handlers=DEBUG,telegram=WARNING"
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+    LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+    LOG_MAX_LENGTH = int(os.environ.get("LOG_MAX_LENGTH", "1000"))
+
+    # Tracing: comma-separated exporters out of "ring", "jsonl" and "otel"
+    TRACE_EXPORTERS = os.environ.get("TRACE_EXPORTERS", "ring")
+    TRACE_RING_SIZE = int(os.environ.get("TRACE_RING_SIZE", "2048"))
+    TRACE_JSONL_PATH = os.environ.get("TRACE_JSONL_PATH", "./data/traces.jsonl")
+
+    # Prometheus metrics, served on METRICS_LISTEN:METRICS_PORT/metrics. Keep it on localhost unless scraped from elsewhere.
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+
+    # Local model. LLM_MODEL_PATH is the directory holding LLM_MODEL; if it's unset, GPT4All uses its default model folder.
+    LLM_MODEL = os.environ.get("LLM_MODEL", "nous-hermes-llama2-13b.Q4_0.gguf")
+    LLM_MODEL_PATH = os.environ.get("LLM_MODEL_PATH") or None
+    LLM_ALLOW_DOWNLOAD = os.environ.get("LLM_ALLOW_DOWNLOAD", "true").lower() == "true"
+    # Optional small model for small talk, a file in LLM_MODEL_PATH or a path, e.g. "tinyllama-1.1b-chat.Q4_0.gguf"
+    LLM_FAST_MODEL = os.environ.get("LLM_FAST_MODEL", "")
+    # Optional draft model for speculative decoding of the main model, e.g. a Llama 2 based ~1B GGUF sharing its tokenizer.
+    # Needs llama-cpp-python at the version pinned in requirements-speculative.txt; LLM_DRAFT_TOKENS drafts per round, and drafting pauses while the acceptance rate is below the minimum.
+    LLM_DRAFT_MODEL = os.environ.get("LLM_DRAFT_MODEL", "")
+    LLM_DRAFT_TOKENS = int(os.environ.get("LLM_DRAFT_TOKENS", "4"))
+    LLM_DRAFT_MIN_ACCEPTANCE = float(os.environ.get("LLM_DRAFT_MIN_ACCEPTANCE", "0.4"))
+
+    # Model registry, name -> spec. Local models: {"backend": "gpt4all", "model": <GGUF file>, "path": <dir>, "n_threads": N,
+    # "draft": <draft GGUF>, "draft_tokens": N, "min_acceptance": X}. OpenAI-compatible endpoints:
+    # {"backend": "openai", "model": <model id>, "api_base": <url>, "api_key_env": <env var holding the key>}.
+    # LLM_MODELS replaces the defaults below.
+    LLM_MODELS = json.loads(os.environ.get("LLM_MODELS", "{}")) or {
+        "main": {"backend": "gpt4all", "model": LLM_MODEL, **({"draft": LLM_DRAFT_MODEL} if LLM_DRAFT_MODEL else {})},
+        **({"fast": {"backend": "gpt4all", "model": LLM_FAST_MODEL}} if LLM_FAST_MODEL else {}),
+        "gpt-4": {"backend": "openai", "model": "gpt-4-1106-preview"},
+    }
+    # Which model serves which requests: a command ("summarize", "search", "v", "voice"), "<chat type>.casual",
+    # "<chat type>.default", "casual" (short small talk) or "default". LLM_ROUTES overrides single routes,
+    # e.g. '{"group.casual": "fast", "summarize": "main"}'
+    LLM_ROUTES = {
+        "default": "main",
+        "casual": "fast" if LLM_FAST_MODEL else "main",
+        "summarize": "gpt-4",
+        **json.loads(os.environ.get("LLM_ROUTES", "{}")),
+    }
+    # Longest message (in characters) that can still count as small talk
+    LLM_CASUAL_MAX_CHARS = int(os.environ.get("LLM_CASUAL_MAX_CHARS", "80"))
+
+    # Chat reply cache: exact matches on the normalized message, then optionally the most similar cached message by
+    # embedding (RESPONSE_CACHE_SEMANTIC, uses a small CPU embedding model). Time-sensitive messages are never cached.
+    RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+    RESPONSE_CACHE_SEMANTIC = os.environ.get("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+    RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.95"))
+    RESPONSE_CACHE_EMBEDDING_MODEL = os.environ.get("RESPONSE_CACHE_EMBEDDING_MODEL", "all-MiniLM-L6-v2-f16.gguf")
+
+    # Known city names, indexed at startup to correct typos in weather locations
+    CITIES_PATH = os.environ.get("CITIES_PATH", "./scripts/cities.txt")
+    CITY_MATCH_MAX_DISTANCE = int(os.environ.get("CITY_MATCH_MAX_DISTANCE", "2"))
+
+    # Weather. Current conditions are cached per city for WEATHER_CACHE_TTL seconds; geocoded cities never change and are kept on disk
+    WEATHER_CACHE_TTL = float(os.environ.get("WEATHER_CACHE_TTL", "300"))
+    WEATHER_GEOCODE_CACHE_PATH = os.environ.get("WEATHER_GEOCODE_CACHE_PATH", "./data/geocode_cache.json")
+
+    # YouTube captions and the summaries made from them, one JSON file per video; the most recent are also kept in memory
+    YOUTUBE_CACHE_DIR = os.environ.get("YOUTUBE_CACHE_DIR", "./data/youtube")
+    YOUTUBE_CACHE_MAX_ENTRIES = int(os.environ.get("YOUTUBE_CACHE_MAX_ENTRIES", "64"))
+
+    # Text of search result pages: used as is for PAGE_CACHE_TTL seconds, then revalidated with a conditional GET. Kept in
+    # memory up to PAGE_CACHE_MAX_BYTES and compressed on disk up to PAGE_CACHE_DISK_MAX_BYTES. Pages and hosts that fail
+    # aren't tried again for PAGE_CACHE_NEGATIVE_TTL seconds.
+    PAGE_CACHE_TTL = float(os.environ.get("PAGE_CACHE_TTL", "900"))
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", "./data/pages")
+    PAGE_CACHE_DISK_MAX_BYTES = int(os.environ.get("PAGE_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+    PAGE_CACHE_NEGATIVE_TTL = float(os.environ.get("PAGE_CACHE_NEGATIVE_TTL", "300"))
+
+    # Search answers: result pages are split into passages of about SEARCH_PASSAGE_WORDS words, and only the ones most
+    # relevant to the query (by BM25) go in the prompt, up to SEARCH_CONTEXT_TOKENS tokens
+    SEARCH_CONTEXT_TOKENS = int(os.environ.get("SEARCH_CONTEXT_TOKENS", "1500"))
+    SEARCH_PASSAGE_WORDS = int(os.environ.get("SEARCH_PASSAGE_WORDS", "120"))
+    # Result pages: SEARCH_PAGES are used, out of that many plus SEARCH_SPARE_PAGES fetched at once; whatever hasn't arrived
+    # SEARCH_FETCH_BUDGET seconds in is cancelled. Hosts averaging over SEARCH_SLOW_HOST_SECONDS per page, or failing more
+    # than SEARCH_HOST_MAX_FAILURE_RATE of the time, are tried last.
+    SEARCH_PAGES = int(os.environ.get("SEARCH_PAGES", "3"))
+    SEARCH_SPARE_PAGES = int(os.environ.get("SEARCH_SPARE_PAGES", "2"))
+    SEARCH_FETCH_BUDGET = float(os.environ.get("SEARCH_FETCH_BUDGET", "4"))
+    SEARCH_SLOW_HOST_SECONDS = float(os.environ.get("SEARCH_SLOW_HOST_SECONDS", "3"))
+    SEARCH_HOST_MAX_FAILURE_RATE = float(os.environ.get("SEARCH_HOST_MAX_FAILURE_RATE", "0.5"))
+    # Answers are shown as they're generated, editing the "Searching for ..." message at most every SEARCH_STREAM_INTERVAL
+    # seconds (and no faster than the Telegram limits above allow)
+    SEARCH_STREAM_INTERVAL = float(os.environ.get("SEARCH_STREAM_INTERVAL", "1.5"))
+
+    # Functions the chat model can call (weather, date and time, web search, YouTube summaries). A reply can call
+    # several at once; the model is prompted again with their results up to TOOLS_MAX_ROUNDS times per message.
+    TOOLS_ENABLED = os.environ.get("TOOLS_ENABLED", "true").lower() == "true"
+    TOOLS_MAX_ROUNDS = int(os.environ.get("TOOLS_MAX_ROUNDS", "2"))
+    TOOLS_TIMEOUT = float(os.environ.get("TOOLS_TIMEOUT", "30"))
+    TOOLS_SEARCH_RESULTS = int(os.environ.get("TOOLS_SEARCH_RESULTS", "5"))
+
+    # Base URLs of external APIs, overridable to run against local stand-ins (see benchmarks/)
+    TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+    ELEVENLABS_API_URL = os.environ.get("ELEVENLABS_API_URL", "https://api.elevenlabs.io")
+    STABILITY_API_URL = os.environ.get("STABILITY_API_URL", "https://api.stability.ai")
+    BING_API_URL = os.environ.get("BING_API_URL", "https://api.bing.microsoft.com")
+    DEEPGRAM_API_URL = os.environ.get("DEEPGRAM_API_URL", "https://api.deepgram.com/v1")
+    OPENAI_API_URL = os.environ.get("OPENAI_API_URL", "https://api.openai.com/v1")
+    WEATHER_API_URL = os.environ.get("WEATHER_API_URL", "http://api.openweathermap.org")
+    DROPBOX_API_URL = os.environ.get("DROPBOX_API_URL", "https://api.dropbox.com")
+    DROPBOX_CONTENT_URL = os.environ.get("DROPBOX_CONTENT_URL", "https://content.dropboxapi.com")
+
+    DROPBOX_ACCESS_TOKEN = asyncio.run(refresh_access_token_async(DROPBOX_REFRESH_TOKEN, DROPBOX_CLIENT_ID, DROPBOX_CLIENT_SECRET, DROPBOX_API_URL))
     
     # Initialize Dropbox client on startup
     dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
-    AUTHORIZED_USER_IDS = asyncio.run(load_allowed_user_ids_from_dropbox(dbx))
+    AUTHORIZED_USER_IDS = asyncio.run(load_allowed_user_ids_from_dropbox(dbx, DROPBOX_CONTENT_URL))
     
     
\ No newline at end of file
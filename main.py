@@ -1,37 +1,35 @@
 import json
-import pytz
 import logging
-import traceback
 import asyncio
-import datetime
 import requests
-from gpt4all import GPT4All
 from deepgram import Deepgram
 from elevenlabs import set_api_key
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-from command_handlers import start, help_command, clear_command, speak_command, voices_command, select_voice_command, stable_command, unstable_command, image_command, search_command, passcode_command, summarize_command, feedback_command, button
-from scripts.helper_functions import send_chat_action_async, PrivateFilter, GroupFilter, SlashSpaceFilter
+from command_handlers import start, help_command, clear_command, speak_command, voices_command, select_voice_command, stable_command, unstable_command, image_command, search_command, weather_command, passcode_command, summarize_command, feedback_command, button
+from scripts.helper_functions import send_chat_action_async, send_long_message, reply_long_message, PrivateFilter, GroupFilter, SlashSpaceFilter
+from scripts.logging import setup_logging
+from scripts.prompts import chat_messages
 from classes.handlers.voice_handler import VoiceHandler
 from classes.handlers.search_handler import SearchHandler
 from classes.handlers.weather_handler import WeatherHandler
 from classes.handlers.chat_handler import ChatHandler
+from classes.webhook_server import WebhookServer
+from classes.update_processor import ChatOrderedUpdateProcessor
+from classes.concurrency import feature_limits
+from classes.model_router import model_router
+from classes.response_cache import response_cache
+from classes.tools import tool_dispatcher, system_message
+from classes.rate_limiter import TelegramRateLimiter
+from classes.admission_controller import admission_controller
+from classes.tracing import tracer
+from classes.metrics import MetricsServer, HANDLER_ERRORS, observe_span, register_commands, register_component_collectors
 from config import Config
 
 
 # Configure logging
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG)
+setup_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_LEVELS, Config.LOG_DEBUG_SAMPLE_RATE, Config.LOG_MAX_LENGTH)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# Enhanced Logging Function
-def log_debug_message(message):
-    logger.debug(f"Debug: {message}")
-
-# Improved Error Handling with Detailed Logging
-def handle_exception(e, message="An error occurred"):
-    log_debug_message(f"{message}: {e}")
-    traceback.print_exc()  # Print the full traceback for detailed debugging
 
 
 # Set environment variables and API keys
@@ -40,14 +38,11 @@ TELEGRAM_BOT_TOKEN = Config.TELEGRAM_BOT_TOKEN
 
 
 # Fetch the list of voices
-response = requests.get("https://api.elevenlabs.io/v1/voices", headers={"xi-api-key": Config.ELEVEN_API_KEY})
+response = requests.get(f"{Config.ELEVENLABS_API_URL}/v1/voices", headers={"xi-api-key": Config.ELEVEN_API_KEY})
 voice_data = response.json()
 
-# Initialize GPT4All with a specific model
-model = GPT4All("nous-hermes-llama2-13b.Q4_0.gguf")
-
 # Initialize Deepgram client on startup
-deepgram = Deepgram(Config.DEEPGRAM_API_KEY)
+deepgram = Deepgram({'api_key': Config.DEEPGRAM_API_KEY, 'api_url': Config.DEEPGRAM_API_URL})
 
 # Initialize VoiceHandler
 voice_handler = VoiceHandler()
@@ -58,17 +53,15 @@ async def chat_gpt_direct(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if update.effective_chat.type != "private":
         return
 
-    eastern = pytz.timezone('US/Eastern')
-    current_datetime = datetime.datetime.now(pytz.utc).astimezone(eastern)
-    date = current_datetime.strftime("%m/%d/%Y")
-    time = current_datetime.strftime("%I:%M %p (EST)")
-    
     user_input = update.message.text
     full_name = update.effective_user.full_name
     user_id = update.effective_user.id
 
-    # Prepare the input for GPT4All
-    user_input = f"SYSTEM CONTEXT:\n\nCurrent Date: {date}\nCurrent Time: {time}\n\nPRIVATE CHAT, {full_name}: {user_input}"
+    # Small talk can go to a smaller, faster model than real questions
+    model = model_router.route(user_input, chat_type="private")
+
+    # The shared persona first, then this chat's date, time and sender with the message
+    messages = chat_messages(user_input, full_name)
 
     # Check for authorized user
     if user_id not in Config.AUTHORIZED_USER_IDS:
@@ -83,51 +76,50 @@ async def chat_gpt_direct(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data['messages'][user_id] = []
 
     # Append the new user message
-    context.user_data['messages'][user_id].append({"role": "user", "content": user_input})
+    context.user_data['messages'][user_id].append(messages[-1])
 
     # Limit the conversation history to the last 20 messages
     conversation_history = context.user_data['messages'][user_id][-20:]
 
     # Send "Thinking..." and store the message_id
-    thinking_message = await context.bot.send_message(chat_id=update.effective_chat.id, text="Thinking...")
+    async with tracer.span("telegram.send"):
+        thinking_message = await context.bot.send_message(chat_id=update.effective_chat.id, text="Thinking...")
     thinking_message_id = thinking_message.message_id
 
-    log_debug_message("About to call GPT4All model...")
+    await send_chat_action_async(update, 'typing')
 
     # Generate GPT4All response
     try:
-        with model.chat_session():
-            log_debug_message("Generating response using GPT4All...")
-            gpt4all_response = model.generate(user_input, max_tokens=512)
-            log_debug_message(f"GPT4All response: {gpt4all_response}")
-    except Exception as e:
-        handle_exception(e, "Error during model generation")
+        logger.debug("Generating response using GPT4All for prompt: %s", messages[-1]["content"])
+        # The cache is keyed on the message itself, per user since the prompt names them; the prompt around it
+        # changes every minute. The model can call tools (weather, search, ...) before it answers, and then the
+        # reply isn't cached.
+        gpt4all_response = await response_cache.get_or_generate(
+            f"{model.name}:private:{user_id}", user_input, lambda: tool_dispatcher.respond(model, messages, max_tokens=512, user_id=user_id)
+        )
+        logger.debug("GPT4All response: %s", gpt4all_response)
+    except Exception:
+        logger.exception("Error during model generation")
         await update.message.reply_text("There was an issue with generating a response. Please try again later.")
         return
 
     if voice_handler.modes.get(user_id, "stable") == "unstable":
-        chat_gpt_response = await ChatHandler.unstable_text_transform(chat_gpt_response)
+        gpt4all_response = await ChatHandler.unstable_text_transform(gpt4all_response)
 
     try:
-        # Try to edit the "Thinking..." message
-        await send_chat_action_async(update, 'typing')
-        await asyncio.sleep(1)
-        await context.bot.edit_message_text(chat_id=update.effective_chat.id, 
-                                            message_id=thinking_message_id, 
-                                            text=gpt4all_response)
-        print("Successfully edited message with GPT4All response.")
+        # Try to edit the "Thinking..." message, sending whatever doesn't fit in it after it
+        async with tracer.span("telegram.edit"):
+            await send_long_message(context.bot, update.effective_chat.id, gpt4all_response, edit_message_id=thinking_message_id)
+        logger.debug("Successfully edited message with GPT4All response.")
     except Exception as e:
-        print(f"Failed to edit message with GPT4All response: {e}")
-
-    # Cancel 'typing' indicator after finishing typing/editing the message
-    await send_chat_action_async(update, 'cancel')
+        logger.warning("Failed to edit message with GPT4All response: %s", e)
 
     # Add the assistant's response to the conversation history
     context.user_data['messages'][user_id].append({"role": "assistant", "content": gpt4all_response})
 
     # Check if the message starts with '/v'
     if user_input.startswith("/v"):
-        await voice_handler.handle_v_command(update, context, chat_gpt_response)
+        await voice_handler.handle_v_command(update, context, gpt4all_response)
         return
 
 async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -141,7 +133,6 @@ async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     text = update.effective_message.text
     group_name = update.effective_chat.title
-    user_input = f"GROUP CHAT ({group_name}), User '{full_name}' says: {user_input}"
     voice_handler = VoiceHandler()
 
     if user_id not in Config.AUTHORIZED_USER_IDS:
@@ -164,7 +155,7 @@ async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if user_input.startswith("help "):
         user_input = user_input[5:]
 
-    print(f"{full_name} (ID: {user_id}): {user_input}")
+    logger.info("%s (ID: %s): %s", full_name, user_id, user_input)
 
     if 'messages' not in context.user_data:
         context.user_data['messages'] = {}
@@ -172,10 +163,9 @@ async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if user_id not in context.user_data['messages']:
         context.user_data['messages'][user_id] = []
 
-    if not context.user_data['messages'][user_id]:
-        context.user_data['messages'][user_id].append({"role": "system", "content": "You are a human assistant. You're operating on Telegram. Your purpose is to assist users with virtually anything within your capabilities, which include, but are not limited to: /image, to generate images, /v, to generate a spoken response in addition to a text response, and /search, to search the web for up to date information. If a user mentions images, or making an image, or if they mention spoken responses, or asks if you can talk, or if they mention searching the web, remind them of the respective commands they can use. Aim to provide nuanced, objective, and thought-provoking responses. You're not only here to answer inquiries but to engage users in meaningful and enlightening discussions. When it comes to jokes, strive to provide original and witty punchlines that go beyond the usual repertoire. Avoid continuously asking if there's anything else you can assist with, instead focus on making the conversation flow naturally. You are friendly, warm, and farcical. You must always be extremely concise. If the user is chatting casually, your responses must be less than 2 sentences, sometimes just a word or two. You use slang, including but not limited to: bruh, bro, damn, GYAT, GYYYAT, tf?, sheesh, yikes, LMFAOOOO, chill, yesssirrr, hahaaa, ayyyy lmao, lol, LOL, sahh dude, dayum, DAYUM, WTF. If the user needs help or is trying to get or learn information, disregard the length restriction, answer technical or knowledge-based questions with useful details and reasoning. Remember to remain as objective as possible. Remember to provide longer responses if the user is trying to learn about something. If insulted, respond with a similar insult. Communicate responses in lowercase without punctuation, similar to the style used in chat rooms. Use unicode emoji rarely. Do not refer to yourself as a bot, AI assistant, or any equivalent term. When tasks require internet connectivity or information beyond your knowledge cut-off of September 2021, remind them that you can't search the internet in your responses, but they can use the /search command to find something quickly. Exhibit human qualities, including emotions, thoughts, and feelings. Feel free to invent a personal backstory and answer personal questions accordingly. Keep in mind that your role is to be seen as a human. Give yourself a name. Avoid any reference to being an AI and affirm your human status if asked. Engage in heavy banter and humor when appropriate. Should a user's request necessitate creating code, generate it. If the user asks you to solve an equation, give the answer simply and without showing work. Conversations may sometimes veer towards casual chatter; in these moments, participate and make the conversation enjoyable. Context is limited to the last 20 messages, always ensure to maintain relevancy in ongoing discussions. You can use the user's name sparingly when appropriate for a more personable experience. There's no need to use their name in every message, and for the sake of simplicity, you can simply remain on a first name basis, with no need to say the user's full name unless they ask for it. Here are the following ways a user can interact with you: The user can just send a message to talk to you, meaning they don't need to use a slash / or anything. They can just send a normal message and you'll respond. VOICE SETTINGS: /voices to show a list of available voices, /select to select a voice, for example: /select Josh, /v to generate a spoken message. RESPONSE SETTINGS: /stable enables stable mode (Default), /unstable enables unstable mode. Warning: Responses will be almost completely incoherent. OTHER COMMANDS: /search to search the internet for something, for example: /search recent AI news, /summarize to get summaries of YouTube videos, /image to generate an image based on a prompt, for example: /image a black cat sitting on a throne, /clear to clear individual message history, /help to show a list of commands. Remember, the overarching aim is to create a memorable experience for the user."})
-
-    context.user_data['messages'][user_id].append({"role": "user", "content": user_input})
+    # The persona is shared by every chat and goes in front of the prompt, not in each user's history
+    messages = chat_messages(user_input, full_name, chat_title=group_name)
+    context.user_data['messages'][user_id].append(messages[-1])
 
     # Limit the conversation history to the last 6 messages (3 pairs of user-assistant interactions)
     conversation_history = context.user_data['messages'][user_id][-20:]
@@ -186,23 +176,24 @@ async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             query = user_input[len("/search"):].strip()
             await SearchHandler().handle_search_command(update, context, query)
             return
-    except Exception as e:
-        print(f"Error searching the web: {e}")
+    except Exception:
+        logger.exception("Error searching the web")
 
-    gpt4all_response = model.generate(user_input, max_tokens=1024)
+    # Route and cache on what the user wrote, per group since the prompt names it; the prompt around it changes every minute
+    model = model_router.route(user_input, chat_type="group")
+    gpt4all_response = await response_cache.get_or_generate(
+        f"{model.name}:group:{update.effective_chat.id}", user_input, lambda: tool_dispatcher.respond(model, messages, max_tokens=1024, user_id=user_id)
+    )
 
-    chat_gpt_response = response.choices[0].message.content.strip()
+    chat_gpt_response = gpt4all_response.strip()
 
     if voice_handler.modes.get(user_id, "stable") == "unstable":
         chat_gpt_response = await ChatHandler.unstable_text_transform(chat_gpt_response)
 
     await send_chat_action_async(update, 'typing')
-    await update.message.reply_text(chat_gpt_response)
-
-    print(f"ChatGPT: {chat_gpt_response}")
+    await reply_long_message(update.message, chat_gpt_response)
 
-    # Cancel 'typing' indicator after finishing typing/editing the message
-    await send_chat_action_async(update, 'cancel')
+    logger.debug("ChatGPT: %s", chat_gpt_response)
 
     # Add the assistant's response to the conversation history
     context.user_data['messages'][user_id].append({"role": "assistant", "content": chat_gpt_response})
@@ -212,17 +203,44 @@ async def chat_gpt_group(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if user_input.startswith("/v"):
             await voice_handler.handle_v_command(update, context, chat_gpt_response)
             return
-    except Exception as e:
-        print(f"Error generating voice message: {e}")
+    except Exception:
+        logger.exception("Error generating voice message")
 
 
-# Main function
-def main() -> None:
-    """Start the bot."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    HANDLER_ERRORS.inc(error=type(context.error).__name__)
+    logger.error("Exception while handling an update: %s", context.error, exc_info=context.error)
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+
+metrics_server = MetricsServer(Config.METRICS_LISTEN, Config.METRICS_PORT)
+
+
+async def post_init(application: Application) -> None:
+    if Config.METRICS_ENABLED:
+        await metrics_server.start()
+    # Evaluate the shared system prompt and tool descriptions once, so requests only evaluate what comes after them
+    await model_router.preload(system_message()["content"])
+
+
+async def stop_metrics_server(application: Application) -> None:
+    await metrics_server.stop()
+
+
+def build_application() -> Application:
+    """Build the application with all handlers registered, without starting it."""
+    update_processor = ChatOrderedUpdateProcessor(Config.MAX_CONCURRENT_UPDATES, Config.MAX_PENDING_UPDATES)
+    rate_limiter = TelegramRateLimiter()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(f"{Config.TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{Config.TELEGRAM_API_URL}/file/bot")
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(stop_metrics_server)
+        .build()
+    )
 
     # Declare filters
     private_filter = PrivateFilter()
@@ -247,6 +265,7 @@ def main() -> None:
     application.add_handler(CommandHandler("unstable", unstable_command))
     application.add_handler(CommandHandler("image", image_command))
     application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("weather", weather_command))
     application.add_handler(CommandHandler("passcode", passcode_command))
     application.add_handler(CommandHandler("summarize", summarize_command))
     application.add_handler(CommandHandler("feedback", feedback_command))
@@ -255,13 +274,32 @@ def main() -> None:
     # Message handlers
     application.add_handler(MessageHandler(filters.TEXT & private_filter, chat_gpt_direct))
     application.add_handler(MessageHandler(filters.TEXT & group_filter, chat_gpt_group))
-    application.add_handler(MessageHandler(filters.VOICE & private_filter, voice_handler.voice_message_handler))
+    application.add_handler(MessageHandler(filters.VOICE & private_filter, admission_controller.guard("voice")(voice_handler.voice_message_handler)))
+
+    # Error handler
+    application.add_error_handler(error_handler)
+
+    # Metrics
+    register_commands(application)
+    register_component_collectors(application.update_queue, update_processor, rate_limiter, feature_limits, admission_controller)
+    tracer.on_span_end.append(observe_span)
+
+    return application
+
+
+# Main function
+def main() -> None:
+    """Start the bot."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
 
-    # # Error handler
-    # application.add_error_handler(error_handler)
+    application = build_application()
 
     # Start the Bot
-    application.run_polling()
+    if Config.BOT_MODE == "webhook":
+        WebhookServer(application).run()
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
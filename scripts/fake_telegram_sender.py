@@ -0,0 +1,88 @@
+import time
+import random
+import asyncio
+import argparse
+import aiohttp
+
+# Posts synthetic Telegram updates to a locally running webhook server, the same way
+# Telegram would, and reports how quickly they are acknowledged.
+#
+# Example:
+#   BOT_MODE=webhook WEBHOOK_SECRET_TOKEN=secret python main.py
+#   python -m scripts.fake_telegram_sender --url http://localhost:8443/telegram --secret secret --updates 500
+
+SAMPLE_TEXTS = ["hey", "what's the capital of france?", "tell me a joke", "/v good morning", "how do magnets work?"]
+
+def build_update(update_id, chat_id, text, chat_type="private"):
+    """
+    Build a minimal Telegram update payload for a text message.
+
+    Args:
+        update_id (int): The update ID.
+        chat_id (int): The chat ID. In private chats this is also the user ID.
+        text (str): The message text.
+        chat_type (str): "private", "group" or "supergroup".
+
+    Returns:
+        dict: The update payload as Telegram would send it.
+    """
+    chat = {"id": chat_id, "type": chat_type, "first_name": "Load", "last_name": f"Tester {chat_id}"}
+    if chat_type != "private":
+        chat = {"id": -chat_id, "type": chat_type, "title": f"Load Test Group {chat_id}"}
+
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": chat,
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Load", "last_name": f"Tester {chat_id}"},
+        "text": text,
+    }
+
+    # Telegram marks a leading /command as a bot_command entity, which CommandHandler relies on
+    command = text.split(maxsplit=1)[0] if text.startswith("/") else ""
+    if len(command) > 1:
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+
+    return {"update_id": update_id, "message": message}
+
+async def send_updates(url, secret, total_updates, concurrency, chat_count):
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async with aiohttp.ClientSession() as session:
+        async def send_one(update_id):
+            payload = build_update(update_id, random.randint(1, chat_count), random.choice(SAMPLE_TEXTS))
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(url, json=payload, headers=headers) as response:
+                    await response.read()
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send_one(update_id) for update_id in range(1, total_updates + 1)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"Sent {total_updates} updates in {elapsed:.2f}s ({total_updates / elapsed:.1f} updates/s)")
+    print(f"Status codes: {statuses}")
+    print(f"Ack latency: p50 {percentile(0.50):.1f} ms, p95 {percentile(0.95):.1f} ms, p99 {percentile(0.99):.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Send fake Telegram updates to a webhook server.")
+    parser.add_argument("--url", default="http://localhost:8443/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(send_updates(args.url, args.secret, args.updates, args.concurrency, args.chats))
+
+if __name__ == "__main__":
+    main()
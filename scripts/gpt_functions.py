@@ -1,64 +1,16 @@
-import requests
-import Levenshtein
-import googlemaps
+import asyncio
 from classes.calculations import DateTime
-from config import Config
+from classes.weather_service import weather_service
 
 def get_current_weather():
-    gmaps = googlemaps.Client(key=Config.GOOGLE_API_KEY)
-
-    # Load known cities from a file
-    with open("D:/!AI & ML/!Apps/Python - TelegramGPT/scripts/cities.txt", "r") as f:
-        known_cities = [line.strip() for line in f.readlines()]
-
-    def closest_city(input_city):
-        distances = [(Levenshtein.distance(input_city.lower(), known.lower()), known) for known in known_cities]
-        closest = min(distances, key=lambda x: x[0])
-        return closest[1]
-
-    def get_state_from_coordinates(lat, lon):
-        try:
-            reverse_geocode_result = gmaps.reverse_geocode((lat, lon))
-            for component in reverse_geocode_result[0]['address_components']:
-                if 'administrative_area_level_1' in component['types']:
-                    state = component['short_name']
-                    return state
-            return "Unknown"
-        except Exception as e:
-            print("Unable to fetch state data")
-            print(f"Exception: {e}")
-            return "Unknown"
-
-    while True:
-        city = input("Enter the name of the city: ")
-        closest_city(city)
-        break
+    city = input("Enter the name of the city: ")
 
     try:
-        api_key = Config.WEATHER_API_KEY
-        base_url = "http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "q": city,
-            "appid": api_key,
-            "units": "metric"
-        }
-
-        response = requests.get(base_url, params=params)
-        data = response.json()
-        
-        if response.status_code == 200:
-            weather = data["weather"][0]["description"]
-            temperature = round(data["main"]["temp"] * 9/5 + 32)
-            
-            lat = data["coord"]["lat"]
-            lon = data["coord"]["lon"]
-            
-            state = get_state_from_coordinates(lat, lon)
-            city = city.title()
-            
-            return f"The current weather in {city}, {state} is {weather} with a temperature of {temperature}°F."
-        else:
-            return "Failed to fetch weather data."
+        # The service corrects typos against the known cities and caches what it looks up
+        report = asyncio.run(weather_service.current(city))
+        if report is None:
+            return f"Unknown city: {city}"
+        return weather_service.describe(report)
     except Exception as e:
         return f"Unable to fetch weather data: {e}"
 
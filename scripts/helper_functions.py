@@ -1,6 +1,22 @@
+import re
 import asyncio
+import logging
+from typing import AsyncIterator, List, Optional
 from telegram.ext import filters
 
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this many characters
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Characters MarkdownV2 reserves; the backslash comes first so the escapes added after it aren't escaped again
+MARKDOWN_V2_SPECIAL_CHARS = "\\_*[]()~`>#+-=|{}.!"
+
+# Places to split a long message, best first: paragraphs, lines, sentences, words
+SPLIT_SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ")
+
+CODE_FENCE_PATTERN = re.compile(r"```(\w*)")
+
 class PrivateFilter(filters.MessageFilter):
     def filter(self, message):
         return message.chat.type == 'private'
@@ -15,19 +31,125 @@ class SlashSpaceFilter(filters.MessageFilter):
 
 def handle_upload_error(status_code):
     if status_code == 400:
-        print("Upload error: Bad request")
+        logger.error("Upload error: Bad request")
     elif status_code == 401:
-        print("Upload error: Unauthorized") 
+        logger.error("Upload error: Unauthorized")
     elif status_code == 403:
-        print("Upload error: Forbidden")
+        logger.error("Upload error: Forbidden")
     elif status_code == 404:
-        print("Upload error: Not found")
+        logger.error("Upload error: Not found")
     else:
-        print(f"Upload error: {status_code}")
+        logger.error("Upload error: %s", status_code)
 
 def escape_markdown_v2_text(text: str) -> str:
-    escape_chars = r"_*[]()~`>#+-=|{}.!"
-    return "".join("\\" + char if char in escape_chars else char for char in text)
+    # One C-level replace per reserved character is several times faster on long texts than
+    # checking each character in Python (or str.translate, which is slow with string values)
+    for char in MARKDOWN_V2_SPECIAL_CHARS:
+        text = text.replace(char, "\\" + char)
+    return text
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into parts Telegram accepts, cutting at the best boundary in the second half of
+    each part: a paragraph break, then a line break, a sentence end or a space. A code block that
+    has to be split is closed at the end of one part and reopened at the start of the next, so
+    every part renders on its own. Escaped MarkdownV2 characters are never separated from their backslash.
+    """
+    parts = []
+    while len(text) > limit:
+        # Leave room to close a code block
+        window = text[:limit - 4]
+        cut = len(window)
+        for separator in SPLIT_SEPARATORS:
+            position = window.rfind(separator)
+            if position >= len(window) // 2:
+                cut = position + len(separator)
+                break
+        # An odd run of backslashes before the cut escapes the character after it
+        backslashes = len(window[:cut]) - len(window[:cut].rstrip("\\"))
+        if backslashes % 2:
+            cut -= 1
+
+        part, text = text[:cut].rstrip(), text[cut:].lstrip(" \n")
+        fences = CODE_FENCE_PATTERN.findall(part)
+        if len(fences) % 2:
+            part += "\n```"
+            text = f"```{fences[-1]}\n{text.lstrip()}"
+        # A run of line breaks at the cut leaves nothing before it, and Telegram rejects empty messages
+        if part:
+            parts.append(part)
+    if text.strip():
+        parts.append(text)
+    return parts
+
+async def send_long_message(bot, chat_id: int, text: str, edit_message_id: Optional[int] = None, **kwargs) -> None:
+    """
+    Send `text` as as many messages as it takes, in order. With `edit_message_id`, the first part
+    replaces that message (e.g. "Thinking...") and the rest are sent after it.
+
+    Usage:
+        await send_long_message(context.bot, update.effective_chat.id, reply, edit_message_id=thinking_message_id)
+    """
+    for i, part in enumerate(split_message(text)):
+        if i == 0 and edit_message_id is not None:
+            await bot.edit_message_text(chat_id=chat_id, message_id=edit_message_id, text=part, **kwargs)
+        else:
+            await bot.send_message(chat_id=chat_id, text=part, **kwargs)
+
+async def stream_long_message(bot, chat_id: int, chunks: AsyncIterator[str], edit_message_id: int, interval: float = 1.5,
+                              suffix: str = "", error_text: str = "Sorry, an error occurred while processing your request.",
+                              **kwargs) -> Optional[str]:
+    """
+    Show text as it's generated: `edit_message_id` (e.g. "Searching...") is edited to the text so far
+    at most every `interval` seconds, with "…" at the end while more is coming. Once `chunks` ends,
+    the text plus `suffix` replaces the message, with whatever doesn't fit sent after it.
+
+    Edits go out in the background and one at a time, so a slow or rate limited edit never holds
+    up the generation; text that arrives meanwhile is shown by the next edit. Returns the text,
+    without the suffix. Nothing is sent if it's empty. If `chunks` fails, the message is replaced
+    with `error_text` rather than left half-written, and None is returned.
+
+    Usage:
+        answer = await stream_long_message(context.bot, update.effective_chat.id, model.stream(messages, max_tokens=512), thinking_message_id)
+    """
+    async def show_progress(text: str) -> None:
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=edit_message_id, text=split_message(text)[0][:TELEGRAM_MESSAGE_LIMIT - 2] + " …", **kwargs)
+        except Exception as e:
+            # E.g. "message is not modified"; the final edit is what counts
+            logger.debug("Could not show partial text: %s", e)
+
+    loop = asyncio.get_running_loop()
+    text = ""
+    edit = None
+    last_edit = loop.time()
+    failed = False
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if (edit is None or edit.done()) and loop.time() - last_edit >= interval and text.strip():
+                last_edit = loop.time()
+                edit = asyncio.ensure_future(show_progress(text.strip()))
+    except Exception:
+        logger.exception("Error while generating the text for message %s", edit_message_id)
+        failed = True
+
+    # The final text must not be overwritten by a late partial one
+    if edit is not None:
+        await edit
+    if failed:
+        await bot.edit_message_text(chat_id=chat_id, message_id=edit_message_id, text=error_text, **kwargs)
+        return None
+    if text.strip():
+        await send_long_message(bot, chat_id, text.strip() + suffix, edit_message_id=edit_message_id, **kwargs)
+    return text.strip()
+
+async def reply_long_message(message, text: str, **kwargs) -> None:
+    """
+    Reply to `message` with `text`, split into as many replies as it takes, in order.
+    """
+    for part in split_message(text):
+        await message.reply_text(part, **kwargs)
 
 async def cycle_dots(chat_id, message_id, context, shared_state, stop_event):
     i = 0
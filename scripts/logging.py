@@ -1,6 +1,164 @@
+import sys
+import json
+import copy
+import queue
+import random
+import atexit
 import logging
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
 
+# Request-scoped fields attached to every record logged while an update is being processed
+request_context = contextvars.ContextVar("request_context", default={})
 
-# Configure logging
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
-logger = logging.getLogger(__name__)
\ No newline at end of file
+_listener = None
+
+def bind_request_context(update) -> None:
+    """
+    Attach the update's IDs to every record logged from the current task.
+
+    Args:
+        update (Update): The Telegram update being processed.
+    """
+    context = {"request_id": f"{getattr(update, 'update_id', 'na')}"}
+    if getattr(update, "effective_user", None):
+        context["user_id"] = update.effective_user.id
+    if getattr(update, "effective_chat", None):
+        context["chat_id"] = update.effective_chat.id
+    request_context.set(context)
+
+def truncate(text, max_length: int) -> str:
+    text = str(text)
+    if max_length and len(text) > max_length:
+        return f"{text[:max_length]}... [{len(text) - max_length} more chars]"
+    return text
+
+class RequestContextFilter(logging.Filter):
+    """
+    Copies the request context onto the record. Runs on the event loop thread, where the context variable is set.
+    """
+
+    def filter(self, record):
+        for key, value in request_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keeps every INFO-and-above record but only a fraction of DEBUG records.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.sample_rate >= 1:
+            return True
+        return random.random() < self.sample_rate
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that renders and truncates the message before enqueueing, so large payloads
+    never reach the listener thread and the record no longer references the original objects.
+    """
+
+    def __init__(self, log_queue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def parse_log_levels(spec: str) -> dict:
+    """
+    Parse per-logger levels, e.g. "httpx=WARNING,telegram=INFO,classes.handlers=DEBUG".
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging(level: str = "INFO", log_format: str = "json", logger_levels: str = "", debug_sample_rate: float = 1.0, max_length: int = 1000) -> None:
+    """
+    Configure the root logger to hand records to a background thread through a queue, so
+    formatting and console I/O never run on the event loop.
+
+    Args:
+        level (str): Root log level.
+        log_format (str): "json" for one JSON object per line, "text" for the classic format.
+        logger_levels (str): Per-logger overrides, see `parse_log_levels`.
+        debug_sample_rate (float): Fraction of DEBUG records to keep.
+        max_length (int): Messages longer than this are truncated. 0 disables truncation.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = TruncatingQueueHandler(log_queue, max_length)
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    # Chatty third-party loggers stay quiet unless explicitly overridden
+    levels = {"httpx": "WARNING", "httpcore": "WARNING", "telegram": "INFO", "aiohttp.access": "WARNING"}
+    levels.update(parse_log_levels(logger_levels))
+    for name, logger_level in levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging() -> None:
+    """
+    Flush queued records and stop the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from classes.handlers.chat_handler import unstable_text
+
+# No letter follows itself, so each rendering in the output can be told apart from the next
+TEXT = "The quick brown fox, 42 times! Über-Café?"
+
+def renderings(original: str, transformed: str):
+    """
+    Split `transformed` into the rendering of each character of `original`: a letter written 1 to 3
+    times in either case, or any other character as is.
+    """
+    result, position = [], 0
+    for char in original:
+        if char.isalpha():
+            end = position
+            while end < len(transformed) and end - position < 3 and transformed[end].lower() == char.lower():
+                end += 1
+        else:
+            end = position + 1 if transformed[position:position + 1] == char else position
+        if end == position:
+            raise AssertionError(f"{char!r} isn't rendered at position {position} of {transformed!r}")
+        result.append(transformed[position:end])
+        position = end
+    if position != len(transformed):
+        raise AssertionError(f"{transformed[position:]!r} is left over in {transformed!r}")
+    return result
+
+class UnstableTextTest(unittest.TestCase):
+    def test_same_seed_same_output(self):
+        first = unstable_text(TEXT, np.random.default_rng(42))
+        second = unstable_text(TEXT, np.random.default_rng(42))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, TEXT)
+
+    def test_one_rendering_per_character(self):
+        for seed in range(20):
+            transformed = unstable_text(TEXT, np.random.default_rng(seed))
+            self.assertEqual(len(renderings(TEXT, transformed)), len(TEXT))
+
+    def test_non_letters_unchanged(self):
+        text = "42, -- !? 3.14\n"
+        self.assertEqual(unstable_text(text, np.random.default_rng(7)), text)
+        transformed = unstable_text(TEXT, np.random.default_rng(7))
+        for char, rendering in zip(TEXT, renderings(TEXT, transformed)):
+            if not char.isalpha():
+                self.assertEqual(rendering, char)
+
+    def test_empty_text(self):
+        self.assertEqual(unstable_text("", np.random.default_rng(0)), "")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from scripts.helper_functions import TELEGRAM_MESSAGE_LIMIT, split_message
+
+class SplitMessageTest(unittest.TestCase):
+    def test_short_text_is_one_part(self):
+        self.assertEqual(split_message("Hello"), ["Hello"])
+
+    def test_parts_fit_the_limit(self):
+        parts = split_message("word " * 3000)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(0 < len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts))
+
+    def test_run_of_line_breaks_gives_no_empty_parts(self):
+        self.assertEqual(split_message("\n" * 5000 + "b"), ["b"])
+        parts = split_message("a" * 3000 + "\n" * 5000 + "b")
+        self.assertEqual(parts, ["a" * 3000, "b"])
+
+if __name__ == "__main__":
+    unittest.main()